@@ -1,5 +1,8 @@
-import torch
+import math
 from functools import partial
+
+import numpy as np
+import torch
 from torch.utils.data import DataLoader
 from torch.utils.data import DistributedSampler as _DistributedSampler
 
@@ -51,6 +54,47 @@ class DistributedSampler(_DistributedSampler):
         return iter(indices)
 
 
+class BalancedResamplingSampler(_DistributedSampler):
+    """
+    Class-balanced grouping and sampling (CBGS, https://arxiv.org/abs/1908.09492) as an index sampler.
+    Every epoch draws int(n_c * ratio_c) indices with replacement among the n_c samples that contain class c,
+    shuffles them and shards them over the replicas like DistributedSampler. The dataset itself is not resampled.
+    """
+
+    def __init__(self, dataset, num_replicas=1, rank=0, seed=0):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
+        class_presence = dataset.get_class_presence()
+        self.class_indices = [
+            torch.from_numpy(np.nonzero(class_presence[:, k])[0]) for k in range(class_presence.shape[1])
+        ]
+
+        duplicated_samples = sum([len(x) for x in self.class_indices])
+        frac = 1.0 / len(self.class_indices)
+        self.class_num_samples = [
+            int(len(x) * (frac / (len(x) / duplicated_samples))) if len(x) > 0 else 0 for x in self.class_indices
+        ]
+        self.num_samples = math.ceil(sum(self.class_num_samples) / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+
+    def __iter__(self):
+        # the same draw on every replica, so that the shards are disjoint
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = torch.cat([
+            cur_indices[torch.randint(len(cur_indices), (num_samples,), generator=g)]
+            for cur_indices, num_samples in zip(self.class_indices, self.class_num_samples) if num_samples > 0
+        ])
+        indices = indices[torch.randperm(len(indices), generator=g)].tolist()
+
+        indices += indices[:(self.total_size - len(indices))]
+        assert len(indices) == self.total_size
+
+        indices = indices[self.rank:self.total_size:self.num_replicas]
+        assert len(indices) == self.num_samples
+
+        return iter(indices)
+
+
 def build_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None, workers=4, seed=None,
                      logger=None, training=True, merge_all_iters_to_one_epoch=False, total_epochs=0):
 
@@ -62,11 +106,25 @@ def build_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None,
         logger=logger,
     )
 
+    if merge_all_iters_to_one_epoch and getattr(dataset, 'use_balanced_sampler', False):
+        # the sampler draws a new balanced subset every epoch, which a merged epoch never starts
+        if logger is not None:
+            logger.warning('BALANCED_SAMPLER does not support merge_all_iters_to_one_epoch, '
+                           'falling back to resampling the infos once')
+        dataset.use_balanced_sampler = False
+        dataset.infos = dataset.balanced_infos_resampling(dataset.infos)
+
     if merge_all_iters_to_one_epoch:
         assert hasattr(dataset, 'merge_all_iters_to_one_epoch')
         dataset.merge_all_iters_to_one_epoch(merge=True, epochs=total_epochs)
 
-    if dist:
+    if getattr(dataset, 'use_balanced_sampler', False):
+        if dist:
+            rank, world_size = common_utils.get_dist_info()
+            sampler = BalancedResamplingSampler(dataset, world_size, rank, seed=seed if seed is not None else 0)
+        else:
+            sampler = BalancedResamplingSampler(dataset, seed=seed if seed is not None else 0)
+    elif dist:
         if training:
             sampler = torch.utils.data.distributed.DistributedSampler(dataset)
         else:
@@ -110,6 +110,44 @@ def global_scaling_with_roi_boxes(gt_boxes, roi_boxes, points, scale_range, retu
     return gt_boxes, roi_boxes, points
 
 
+def global_transform(gt_boxes, points, flip_axes=(), noise_rotation=0.0, noise_scale=1.0, noise_translate=None):
+    """
+    Applies random_flip_along_x/y, global_rotation, global_scaling and the world translation in one pass, with the
+    composed 4x4 matrix.
+    Args:
+        gt_boxes: (N, 7 + C), [x, y, z, dx, dy, dz, heading, [vx], [vy]]
+        points: (M, 3 + C)
+        flip_axes: enabled flips in the order they are applied, 'x' (y -> -y) or 'y' (x -> -x)
+        noise_rotation: angle along z-axis, angle increases x ==> y
+        noise_scale:
+        noise_translate: (1, 3), optional
+    Returns:
+        gt_boxes, points, transform_matrix: (4, 4)
+    """
+    transform_matrix = np.eye(4)
+    # the heading after the flips is heading_sign * heading + heading_offset
+    heading_sign, heading_offset = 1, 0.0
+    for cur_axis in flip_axes:
+        assert cur_axis in ['x', 'y']
+        transform_matrix[1 if cur_axis == 'x' else 0] *= -1
+        heading_sign, heading_offset = -heading_sign, -heading_offset - (np.pi if cur_axis == 'y' else 0.0)
+    cosa, sina = np.cos(noise_rotation), np.sin(noise_rotation)
+    transform_matrix[:3, :3] = np.array([[cosa, -sina, 0], [sina, cosa, 0], [0, 0, 1]]) @ transform_matrix[:3, :3]
+    transform_matrix[:3, :3] *= noise_scale
+    if noise_translate is not None:
+        transform_matrix[:3, 3] = np.asarray(noise_translate).reshape(3)
+
+    rot_scale, translate = transform_matrix[:3, :3].T, transform_matrix[:3, 3]
+    points[:, 0:3] = points[:, 0:3] @ rot_scale + translate
+    gt_boxes[:, 0:3] = gt_boxes[:, 0:3] @ rot_scale + translate
+    gt_boxes[:, 3:6] *= noise_scale
+    gt_boxes[:, 6] = heading_sign * gt_boxes[:, 6] + (heading_offset + noise_rotation)
+    if gt_boxes.shape[1] > 7:
+        gt_boxes[:, 7:9] = gt_boxes[:, 7:9] @ rot_scale[:2, :2]
+        gt_boxes[:, 9:] *= noise_scale
+    return gt_boxes, points, transform_matrix
+
+
 def random_image_flip_horizontal(image, depth_map, gt_boxes, calib):
     """
     Performs random horizontal flip augmentation
@@ -1,9 +1,10 @@
+import time
 from functools import partial
 
 import numpy as np
 from PIL import Image
 
-from ...utils import common_utils
+from ...utils import common_utils, pipeline_profiler
 from . import augmentor_utils, database_sampler
 
 
@@ -113,6 +114,62 @@ class DataAugmentor(object):
         data_dict['noise_scale'] = noise_scale
         return data_dict
 
+    def random_world_transform(self, data_dict=None, config=None):
+        """
+        random_world_flip (ALONG_AXIS_LIST), random_world_rotation (WORLD_ROT_ANGLE), random_world_scaling
+        (WORLD_SCALE_RANGE) and random_world_translation (NOISE_TRANSLATE_STD) fused into one matrix that is applied
+        to the points and boxes once. Missing keys skip that step. The parameters are drawn in the same order as the
+        separate augmentors, so both give the same results for the same seed.
+        """
+        if data_dict is None:
+            return partial(self.random_world_transform, config=config)
+        if 'roi_boxes' in data_dict.keys():
+            for cur_key, cur_augmentor in [('ALONG_AXIS_LIST', self.random_world_flip),
+                                           ('WORLD_ROT_ANGLE', self.random_world_rotation),
+                                           ('WORLD_SCALE_RANGE', self.random_world_scaling),
+                                           ('NOISE_TRANSLATE_STD', self.random_world_translation)]:
+                if cur_key in config:
+                    data_dict = cur_augmentor(data_dict=data_dict, config=config)
+            return data_dict
+
+        flip_axes = []
+        for cur_axis in config.get('ALONG_AXIS_LIST', []):
+            assert cur_axis in ['x', 'y']
+            enable = np.random.choice([False, True], replace=False, p=[0.5, 0.5])
+            data_dict['flip_%s' % cur_axis] = enable
+            if enable:
+                flip_axes.append(cur_axis)
+
+        noise_rot = 0.0
+        if 'WORLD_ROT_ANGLE' in config:
+            rot_range = config['WORLD_ROT_ANGLE']
+            if not isinstance(rot_range, list):
+                rot_range = [-rot_range, rot_range]
+            noise_rot = data_dict['noise_rot'] = np.random.uniform(rot_range[0], rot_range[1])
+
+        noise_scale = 1.0
+        scale_range = config.get('WORLD_SCALE_RANGE', [1.0, 1.0])
+        if scale_range[1] - scale_range[0] >= 1e-3:
+            noise_scale = data_dict['noise_scale'] = np.random.uniform(scale_range[0], scale_range[1])
+
+        noise_translate = None
+        if 'NOISE_TRANSLATE_STD' in config:
+            noise_translate_std = config['NOISE_TRANSLATE_STD']
+            assert len(noise_translate_std) == 3
+            noise_translate = data_dict['noise_translate'] = np.array([
+                np.random.normal(0, noise_translate_std[0], 1),
+                np.random.normal(0, noise_translate_std[1], 1),
+                np.random.normal(0, noise_translate_std[2], 1),
+            ], dtype=np.float32).T
+
+        gt_boxes, points, _ = augmentor_utils.global_transform(
+            data_dict['gt_boxes'], data_dict['points'], flip_axes=flip_axes, noise_rotation=noise_rot,
+            noise_scale=noise_scale, noise_translate=noise_translate
+        )
+        data_dict['gt_boxes'] = gt_boxes
+        data_dict['points'] = points
+        return data_dict
+
     def random_image_flip(self, data_dict=None, config=None):
         if data_dict is None:
             return partial(self.random_image_flip, config=config)
@@ -298,8 +355,12 @@ class DataAugmentor(object):
 
         Returns:
         """
+        stage_times = data_dict.get('stage_times', None)
         for cur_augmentor in self.data_augmentor_queue:
+            start_time = time.time()
             data_dict = cur_augmentor(data_dict=data_dict)
+            if stage_times is not None:
+                stage_times['augmentor/' + pipeline_profiler.get_stage_name(cur_augmentor)] = time.time() - start_time
 
         data_dict['gt_boxes'][:, 6] = common_utils.limit_period(
             data_dict['gt_boxes'][:, 6], offset=0.5, period=2 * np.pi
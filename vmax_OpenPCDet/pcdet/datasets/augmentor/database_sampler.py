@@ -1,14 +1,13 @@
 import pickle
 
 import os
-import copy
+import re
+from pathlib import Path
 import numpy as np
 from skimage import io
 import torch
-import SharedArray
 import torch.distributed as dist
 
-from ...ops.iou3d_nms import iou3d_nms_utils
 from ...utils import box_utils, common_utils, calibration_kitti
 from pcdet.datasets.kitti.kitti_object_eval_python import kitti_common
 
@@ -27,6 +26,7 @@ class DataBaseSampler(object):
             self.db_infos[class_name] = []
 
         self.use_shared_memory = sampler_cfg.get('USE_SHARED_MEMORY', False)
+        self.use_memmap = sampler_cfg.get('USE_MEMMAP', False)
 
         for db_info_path in sampler_cfg.DB_INFO_PATH:
             db_info_path = self.root_path.resolve() / db_info_path
@@ -47,7 +47,26 @@ class DataBaseSampler(object):
         for func_name, val in sampler_cfg.PREPARE.items():
             self.db_infos = getattr(self, func_name)(self.db_infos, val)
 
+        if sampler_cfg.get('DB_DATA_PATH', None) is None:
+            db_data_path = self.get_default_db_data_path()
+            if db_data_path is not None:
+                sampler_cfg.DB_DATA_PATH = [db_data_path]
+
+        # databases built in the integrated format only store 'global_data_offset' and no per-object files
+        integrated_only = any('path' not in infos[0] for infos in self.db_infos.values() if len(infos) > 0)
+        if integrated_only and not self.use_shared_memory and not self.use_memmap:
+            db_data_path = self.root_path.resolve() / sampler_cfg.get('DB_DATA_PATH', [''])[0]
+            assert db_data_path.is_file(), \
+                'the GT database has no per-object files, set USE_MEMMAP or USE_SHARED_MEMORY with DB_DATA_PATH'
+            if self.logger is not None:
+                self.logger.info('GT database has no per-object files, memory-mapping %s' % db_data_path)
+            self.use_memmap = True
+        if self.use_memmap:
+            assert len(sampler_cfg.get('DB_DATA_PATH', [])) == 1, \
+                'USE_MEMMAP requires a single integrated DB_DATA_PATH (gt_database_*_global.npy)'
+
         self.gt_database_data_key = self.load_db_to_shared_memory() if self.use_shared_memory else None
+        self._gt_database_memmap = None
 
         self.sample_groups = {}
         self.sample_class_num = {}
@@ -64,9 +83,29 @@ class DataBaseSampler(object):
                 'indices': np.arange(len(self.db_infos[class_name]))
             }
 
+    def get_default_db_data_path(self):
+        """
+        Finds the integrated GT database if the config sets no DB_DATA_PATH: the 'global_data_path' stored in the
+        db infos, or else gt_database_{N}sweeps_withvelo_global.npy next to nuscenes_dbinfos_{N}sweeps_withvelo.pkl.
+        Returns:
+            db_data_path: path relative to the root path, None if it cannot be derived
+        """
+        for infos in self.db_infos.values():
+            if len(infos) > 0 and 'global_data_path' in infos[0]:
+                return infos[0]['global_data_path']
+
+        if len(self.sampler_cfg.DB_INFO_PATH) == 1:
+            db_info_path = Path(self.sampler_cfg.DB_INFO_PATH[0])
+            match = re.fullmatch(r'nuscenes_dbinfos_(\d+)sweeps_withvelo\.pkl', db_info_path.name)
+            if match is not None:
+                return str(db_info_path.with_name(f'gt_database_{match.group(1)}sweeps_withvelo_global.npy'))
+        return None
+
     def __getstate__(self):
         d = dict(self.__dict__)
         del d['logger']
+        # every worker maps the database itself so the pages are shared through the page cache
+        d['_gt_database_memmap'] = None
         return d
 
     def __setstate__(self, d):
@@ -74,6 +113,8 @@ class DataBaseSampler(object):
 
     def __del__(self):
         if self.use_shared_memory:
+            import SharedArray
+
             self.logger.info('Deleting GT database from shared memory')
             cur_rank, num_gpus = common_utils.get_dist_info()
             sa_key = self.sampler_cfg.DB_DATA_PATH[0]
@@ -101,6 +142,17 @@ class DataBaseSampler(object):
         self.logger.info('GT database has been saved to shared memory')
         return sa_key
 
+    def load_db_to_memmap(self):
+        """
+        Maps the integrated GT database read-only, once per process.
+        Returns:
+            gt_database_data: (N, C) memory-mapped array indexed by info['global_data_offset']
+        """
+        if self._gt_database_memmap is None:
+            db_data_path = self.root_path.resolve() / self.sampler_cfg.DB_DATA_PATH[0]
+            self._gt_database_memmap = np.load(str(db_data_path), mmap_mode='r')
+        return self._gt_database_memmap
+
     def filter_by_difficulty(self, db_infos, removed_difficulty):
         new_db_infos = {}
         for key, dinfos in db_infos.items():
@@ -383,15 +435,19 @@ class DataBaseSampler(object):
         img_aug_gt_dict = self.initilize_image_aug_dict(data_dict, gt_boxes_mask)
 
         if self.use_shared_memory:
+            import SharedArray
+
             gt_database_data = SharedArray.attach(f"shm://{self.gt_database_data_key}")
             gt_database_data.setflags(write=0)
+        elif self.use_memmap:
+            gt_database_data = self.load_db_to_memmap()
         else:
             gt_database_data = None
 
         for idx, info in enumerate(total_valid_sampled_dict):
-            if self.use_shared_memory:
+            if gt_database_data is not None:
                 start_offset, end_offset = info['global_data_offset']
-                obj_points = copy.deepcopy(gt_database_data[start_offset:end_offset])
+                obj_points = np.array(gt_database_data[start_offset:end_offset], dtype=np.float32)
             else:
                 file_path = self.root_path / info['path']
 
@@ -432,7 +488,8 @@ class DataBaseSampler(object):
         large_sampled_gt_boxes = box_utils.enlarge_box3d(
             sampled_gt_boxes[:, 0:7], extra_width=self.sampler_cfg.REMOVE_EXTRA_WIDTH
         )
-        points = box_utils.remove_points_in_boxes3d(points, large_sampled_gt_boxes)
+        # margin of roiaware_pool3d_utils.points_in_boxes_cpu, which remove_points_in_boxes3d used before
+        points = points[box_utils.points_in_boxes_numba(points, large_sampled_gt_boxes, margin=1e-2) < 0]
         points = np.concatenate([obj_points[:, :points.shape[-1]], points], axis=0)
         gt_names = np.concatenate([gt_names, sampled_gt_names], axis=0)
         gt_boxes = np.concatenate([gt_boxes, sampled_gt_boxes], axis=0)
@@ -461,27 +518,33 @@ class DataBaseSampler(object):
         sampled_mv_height = []
         sampled_gt_boxes2d = []
 
+        sampled_groups = []
         for class_name, sample_group in self.sample_groups.items():
             if self.limit_whole_scene:
                 num_gt = np.sum(class_name == gt_names)
                 sample_group['sample_num'] = str(int(self.sample_class_num[class_name]) - num_gt)
             if int(sample_group['sample_num']) > 0:
                 sampled_dict = self.sample_with_fixed_number(class_name, sample_group)
-
-                arrays = [x['box3d_lidar'] for x in sampled_dict]
-
-                if len(arrays) is not 0:
-                    sampled_boxes = np.stack(arrays, axis=0).astype(np.float32)
-                else:
-                    continue
-
-                assert not self.sampler_cfg.get('DATABASE_WITH_FAKELIDAR', False), 'Please use latest codes to generate GT_DATABASE'
-
-                iou1 = iou3d_nms_utils.boxes_bev_iou_cpu(sampled_boxes[:, 0:7], existed_boxes[:, 0:7])
-                iou2 = iou3d_nms_utils.boxes_bev_iou_cpu(sampled_boxes[:, 0:7], sampled_boxes[:, 0:7])
-                iou2[range(sampled_boxes.shape[0]), range(sampled_boxes.shape[0])] = 0
-                iou1 = iou1 if iou1.shape[1] > 0 else iou2
-                valid_mask = ((iou1.max(axis=1) + iou2.max(axis=1)) == 0)
+                if len(sampled_dict) > 0:
+                    sampled_boxes = np.stack([x['box3d_lidar'] for x in sampled_dict], axis=0).astype(np.float32)
+                    sampled_groups.append((sampled_dict, sampled_boxes))
+
+        if len(sampled_groups) > 0:
+            assert not self.sampler_cfg.get('DATABASE_WITH_FAKELIDAR', False), 'Please use latest codes to generate GT_DATABASE'
+
+            # one pruned collision pass over the scene boxes and the candidates of all classes
+            num_gt = gt_boxes.shape[0]
+            all_boxes = np.concatenate([gt_boxes[:, 0:7]] + [x[1][:, 0:7] for x in sampled_groups], axis=0)
+            overlaps = box_utils.boxes_bev_overlap_numba(all_boxes)
+            placed = np.zeros(all_boxes.shape[0], dtype=np.bool_)
+            placed[:num_gt] = True
+
+            start_idx = num_gt
+            for sampled_dict, sampled_boxes in sampled_groups:
+                end_idx = start_idx + sampled_boxes.shape[0]
+                # a candidate collides with anything already in the scene and with every other candidate of its class
+                cur_overlaps = overlaps[start_idx:end_idx]
+                valid_mask = ~(cur_overlaps[:, placed].any(axis=1) | cur_overlaps[:, start_idx:end_idx].any(axis=1))
 
                 if self.img_aug_type is not None:
                     sampled_boxes2d, mv_height, valid_mask = self.sample_gt_boxes_2d(data_dict, sampled_boxes, valid_mask)
@@ -490,11 +553,13 @@ class DataBaseSampler(object):
                         sampled_mv_height.append(mv_height)
 
                 valid_mask = valid_mask.nonzero()[0]
+                placed[start_idx + valid_mask] = True
                 valid_sampled_dict = [sampled_dict[x] for x in valid_mask]
                 valid_sampled_boxes = sampled_boxes[valid_mask]
 
                 existed_boxes = np.concatenate((existed_boxes, valid_sampled_boxes[:, :existed_boxes.shape[-1]]), axis=0)
                 total_valid_sampled_dict.extend(valid_sampled_dict)
+                start_idx = end_idx
 
         sampled_gt_boxes = existed_boxes[gt_boxes.shape[0]:, :]
 
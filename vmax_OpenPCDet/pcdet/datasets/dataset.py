@@ -1,3 +1,4 @@
+import time
 from collections import defaultdict
 from pathlib import Path
 
@@ -40,6 +41,8 @@ class DatasetTemplate(torch_data.Dataset):
         self.voxel_size = self.data_processor.voxel_size
         self.total_epochs = 0
         self._merge_all_iters_to_one_epoch = False
+        # per-stage timings of each sample in data_dict['stage_times'], see utils/pipeline_profiler.py
+        self.profile_pipeline = self.dataset_cfg.get('PROFILE_PIPELINE', False)
 
         if hasattr(self.data_processor, "depth_downsample_factor"):
             self.depth_downsample_factor = self.data_processor.depth_downsample_factor
@@ -176,6 +179,10 @@ class DatasetTemplate(torch_data.Dataset):
                 voxel_num_points: optional (num_voxels)
                 ...
         """
+        if self.profile_pipeline:
+            prepare_start_time = time.time()
+            stage_times = data_dict.setdefault('stage_times', {})
+
         if self.training:
             assert 'gt_boxes' in data_dict, 'gt_boxes should be provided for training'
             gt_boxes_mask = np.array([n in self.class_names for n in data_dict['gt_names']], dtype=np.bool_)
@@ -203,7 +210,10 @@ class DatasetTemplate(torch_data.Dataset):
                 data_dict['gt_boxes2d'] = data_dict['gt_boxes2d'][selected]
 
         if data_dict.get('points', None) is not None:
+            start_time = time.time()
             data_dict = self.point_feature_encoder.forward(data_dict)
+            if self.profile_pipeline:
+                stage_times['point_feature_encoder'] = time.time() - start_time
 
         data_dict = self.data_processor.forward(
             data_dict=data_dict
@@ -215,10 +225,32 @@ class DatasetTemplate(torch_data.Dataset):
 
         data_dict.pop('gt_names', None)
 
+        if self.profile_pipeline:
+            stage_times['prepare_data'] = time.time() - prepare_start_time
         return data_dict
 
+    @staticmethod
+    def concat_with_batch_index(arrays):
+        """
+        Concatenates per-sample arrays into one preallocated (sum(N_i), 1 + C) array with the sample index in front.
+        Args:
+            arrays: list of (N_i, C)
+
+        Returns:
+        """
+        num_rows = [x.shape[0] for x in arrays]
+        ret = np.empty((sum(num_rows), arrays[0].shape[-1] + 1), dtype=np.result_type(*arrays))
+        offset = 0
+        for i, arr in enumerate(arrays):
+            # slice writes straight into the output, no padded copy per sample and no JIT in the workers
+            ret[offset:offset + num_rows[i], 0] = i
+            ret[offset:offset + num_rows[i], 1:] = arr
+            offset += num_rows[i]
+        return ret
+
     @staticmethod
     def collate_batch(batch_list, _unused=False):
+        start_time = time.time()
         data_dict = defaultdict(list)
         for cur_sample in batch_list:
             for key, val in cur_sample.items():
@@ -235,13 +267,9 @@ class DatasetTemplate(torch_data.Dataset):
                         val = [i for item in val for i in item]
                     ret[key] = np.concatenate(val, axis=0)
                 elif key in ['points', 'voxel_coords']:
-                    coors = []
                     if isinstance(val[0], list):
                         val =  [i for item in val for i in item]
-                    for i, coor in enumerate(val):
-                        coor_pad = np.pad(coor, ((0, 0), (1, 0)), mode='constant', constant_values=i)
-                        coors.append(coor_pad)
-                    ret[key] = np.concatenate(coors, axis=0)
+                    ret[key] = DatasetTemplate.concat_with_batch_index(val)
                 elif key in ['gt_boxes']:
                     max_gt = max([len(x) for x in val])
                     batch_gt_boxes3d = np.zeros((batch_size, max_gt, val[0].shape[-1]), dtype=np.float32)
@@ -299,7 +327,7 @@ class DatasetTemplate(torch_data.Dataset):
 
                         images.append(image_pad)
                     ret[key] = np.stack(images, axis=0)
-                elif key in ['calib']:
+                elif key in ['calib', 'stage_times']:
                     ret[key] = val
                 elif key in ["points_2d"]:
                     max_len = max([len(_val) for _val in val])
@@ -317,9 +345,10 @@ class DatasetTemplate(torch_data.Dataset):
                     ret[key] = torch.stack([torch.stack(imgs,dim=0) for imgs in val],dim=0)
                 else:
                     ret[key] = np.stack(val, axis=0)
-            except:
-                print('Error in collate_batch: key=%s' % key)
-                raise TypeError
+            except Exception as e:
+                raise TypeError('Error in collate_batch: key=%s' % key) from e
 
         ret['batch_size'] = batch_size * batch_size_ratio
+        if 'stage_times' in ret:
+            ret['stage_times'].append({'collate_batch': time.time() - start_time})
         return ret
@@ -1,16 +1,29 @@
-import copy
+import hashlib
+import json
+import multiprocessing
+import os
 import pickle
+import shutil
+import time
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 from tqdm import tqdm
 
-from ...ops.roiaware_pool3d import roiaware_pool3d_utils
-from ...utils import common_utils
+from ...utils import box_utils, columnar_infos, common_utils
 from ..dataset import DatasetTemplate
 from pyquaternion import Quaternion
 from PIL import Image
 
+NUSC_RESULTS_META = {
+    'use_camera': False,
+    'use_lidar': True,
+    'use_radar': False,
+    'use_map': False,
+    'use_external': False,
+}
+
 
 class NuScenesDataset(DatasetTemplate):
     def __init__(self, dataset_cfg, class_names, training=True, root_path=None, logger=None):
@@ -27,22 +40,48 @@ class NuScenesDataset(DatasetTemplate):
             self.use_camera = False
 
         self.include_nuscenes_data(self.mode)
-        if self.training and self.dataset_cfg.get('BALANCED_RESAMPLING', False):
+        # CBGS is done by BalancedResamplingSampler in build_dataloader unless BALANCED_SAMPLER is False
+        self.use_balanced_sampler = self.training and self.dataset_cfg.get('BALANCED_RESAMPLING', False) and \
+            self.dataset_cfg.get('BALANCED_SAMPLER', True)
+        self._class_presence = None
+        if self.training and self.dataset_cfg.get('BALANCED_RESAMPLING', False) and not self.use_balanced_sampler:
             self.infos = self.balanced_infos_resampling(self.infos)
 
+        self.use_sweep_cache = self.dataset_cfg.get('USE_SWEEP_CACHE', False)
+        self.sweep_cache_dir = self.root_path / self.dataset_cfg.get('SWEEP_CACHE_PATH', 'sweep_cache')
+        self._sweep_cache = None
+        self._eval_nusc = None
+        if self.use_sweep_cache and self.load_sweep_cache_manifest() != self.get_sweep_cache_manifest():
+            raise RuntimeError(
+                'Sweep cache %s is missing or does not match the infos, please create it again with '
+                '"python -m pcdet.datasets.nuscenes.nuscenes_dataset --func create_sweep_cache"' % self.sweep_cache_dir
+            )
+
+    def __getstate__(self):
+        d = super().__getstate__()
+        # every dataloader worker maps the sweep cache itself
+        d['_sweep_cache'] = None
+        d['_eval_nusc'] = None
+        return d
+
     def include_nuscenes_data(self, mode):
         self.logger.info('Loading NuScenes dataset')
         nuscenes_infos = []
 
-        for info_path in self.dataset_cfg.INFO_PATH[mode]:
-            info_path = self.root_path / info_path
-            if not info_path.exists():
-                continue
-            with open(info_path, 'rb') as f:
-                infos = pickle.load(f)
-                nuscenes_infos.extend(infos)
+        info_paths = [self.root_path / x for x in self.dataset_cfg.INFO_PATH[mode]]
+        info_paths = [x for x in info_paths if x.exists()]
+        if self.dataset_cfg.get('COLUMNAR_INFOS', True) and len(info_paths) > 0:
+            # shared read-only by all workers, see ColumnarInfos
+            cache_dir = self.root_path / 'info_cache' / '+'.join([x.stem for x in info_paths])
+            nuscenes_infos = columnar_infos.load_columnar_infos(info_paths, cache_dir, logger=self.logger)
+            self.infos = nuscenes_infos
+        else:
+            for info_path in info_paths:
+                with open(info_path, 'rb') as f:
+                    infos = pickle.load(f)
+                    nuscenes_infos.extend(infos)
 
-        self.infos.extend(nuscenes_infos)
+            self.infos.extend(nuscenes_infos)
         self.logger.info('Total samples for NuScenes dataset: %d' % (len(nuscenes_infos)))
 
     def balanced_infos_resampling(self, infos):
@@ -53,10 +92,10 @@ class NuScenesDataset(DatasetTemplate):
             return infos
 
         cls_infos = {name: [] for name in self.class_names}
-        for info in infos:
+        for idx, info in enumerate(infos):
             for name in set(info['gt_names']):
                 if name in self.class_names:
-                    cls_infos[name].append(info)
+                    cls_infos[name].append(idx)
 
         duplicated_samples = sum([len(v) for _, v in cls_infos.items()])
         cls_dist = {k: len(v) / duplicated_samples for k, v in cls_infos.items()}
@@ -72,24 +111,45 @@ class NuScenesDataset(DatasetTemplate):
             ).tolist()
         self.logger.info('Total samples after balanced resampling: %s' % (len(sampled_infos)))
 
-        cls_infos_new = {name: [] for name in self.class_names}
-        for info in sampled_infos:
-            for name in set(info['gt_names']):
-                if name in self.class_names:
-                    cls_infos_new[name].append(info)
+        if isinstance(infos, columnar_infos.ColumnarInfos):
+            return infos.take(sampled_infos)
+        return [infos[idx] for idx in sampled_infos]
 
-        cls_dist_new = {k: len(v) / len(sampled_infos) for k, v in cls_infos_new.items()}
+    def get_class_presence(self):
+        """
+        Returns:
+            class_presence: (N, num_classes) bool, whether self.infos[i] contains an object of self.class_names[j]
+        """
+        if self._class_presence is not None:
+            return self._class_presence
+
+        cache_path = None
+        if isinstance(self.infos, columnar_infos.ColumnarInfos) and self.infos.path is not None \
+                and self.infos.indices is None:
+            # stored next to the columnar infos, so it is rebuilt together with them
+            class_names_key = hashlib.sha1('\n'.join(self.class_names).encode()).hexdigest()[:16]
+            cache_path = self.infos.path / ('class_presence_%s.npy' % class_names_key)
+            if cache_path.exists():
+                self._class_presence = np.load(str(cache_path))
+                return self._class_presence
+
+        class_to_idx = {name: k for k, name in enumerate(self.class_names)}
+        class_presence = np.zeros((len(self.infos), len(self.class_names)), dtype=np.bool_)
+        for idx, info in enumerate(self.infos):
+            for name in set(info['gt_names']):
+                if name in class_to_idx:
+                    class_presence[idx, class_to_idx[name]] = True
 
-        return sampled_infos
+        if cache_path is not None:
+            tmp_path = cache_path.parent / ('%s.tmp%d.npy' % (cache_path.stem, os.getpid()))
+            np.save(str(tmp_path), class_presence)
+            os.replace(tmp_path, cache_path)
+        self._class_presence = class_presence
+        return class_presence
 
     def get_sweep(self, sweep_info):
-        def remove_ego_points(points, center_radius=1.0):
-            mask = ~((np.abs(points[:, 0]) < center_radius) & (np.abs(points[:, 1]) < center_radius))
-            return points[mask]
-
         lidar_path = self.root_path / sweep_info['lidar_path']
-        points_sweep = np.fromfile(str(lidar_path), dtype=np.float32, count=-1).reshape([-1, 5])[:, :4]
-        points_sweep = remove_ego_points(points_sweep).T
+        points_sweep = load_lidar_points(lidar_path, remove_ego=True).T
         if sweep_info['transform_matrix'] is not None:
             num_points = points_sweep.shape[1]
             points_sweep[:3, :] = sweep_info['transform_matrix'].dot(
@@ -98,15 +158,53 @@ class NuScenesDataset(DatasetTemplate):
         cur_times = sweep_info['time_lag'] * np.ones((1, points_sweep.shape[1]))
         return points_sweep.T, cur_times.T
 
+    def get_sweep_cache_info_paths(self):
+        info_paths = [self.root_path / info_path for info_paths in self.dataset_cfg.INFO_PATH.values()
+                      for info_path in info_paths]
+        return [info_path for info_path in info_paths if info_path.exists()]
+
+    def get_sweep_cache_manifest(self):
+        """
+        Returns:
+            manifest: the info files the sweep cache is built from, with their mtime and size
+        """
+        return {
+            'sources': [[str(p), os.path.getmtime(p), os.path.getsize(p)] for p in self.get_sweep_cache_info_paths()]
+        }
+
+    def load_sweep_cache_manifest(self):
+        manifest_path = self.sweep_cache_dir / 'manifest.json'
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+
+    def get_sweep_cache(self):
+        """
+        Returns:
+            points: (N, 4) float32 memory-mapped point store written by create_sweep_cache
+            index: {'lidar': {lidar_path: (start, end)}, 'sweep': {lidar_path: (start, end)}}, sweeps are ego-filtered
+        """
+        if self._sweep_cache is None:
+            with open(self.sweep_cache_dir / 'index.pkl', 'rb') as f:
+                index = pickle.load(f)
+            points = np.load(str(self.sweep_cache_dir / 'points.npy'), mmap_mode='r')
+            self._sweep_cache = (points, index)
+        return self._sweep_cache
+
     def get_lidar_with_sweeps(self, index, max_sweeps=1):
         info = self.infos[index]
+        sweep_ids = np.random.choice(len(info['sweeps']), max_sweeps - 1, replace=False)
+        if self.use_sweep_cache:
+            return self.get_lidar_with_sweeps_from_cache(info, sweep_ids)
+
         lidar_path = self.root_path / info['lidar_path']
-        points = np.fromfile(str(lidar_path), dtype=np.float32, count=-1).reshape([-1, 5])[:, :4]
+        points = load_lidar_points(lidar_path)
 
         sweep_points_list = [points]
         sweep_times_list = [np.zeros((points.shape[0], 1))]
 
-        for k in np.random.choice(len(info['sweeps']), max_sweeps - 1, replace=False):
+        for k in sweep_ids:
             points_sweep, times_sweep = self.get_sweep(info['sweeps'][k])
             sweep_points_list.append(points_sweep)
             sweep_times_list.append(times_sweep)
@@ -117,6 +215,28 @@ class NuScenesDataset(DatasetTemplate):
         points = np.concatenate((points, times), axis=1)
         return points
 
+    def get_lidar_with_sweeps_from_cache(self, info, sweep_ids):
+        cache_points, cache_index = self.get_sweep_cache()
+        sweep_infos = [info['sweeps'][k] for k in sweep_ids]
+        slices = [cache_index['lidar'][info['lidar_path']]] + \
+            [cache_index['sweep'][sweep_info['lidar_path']] for sweep_info in sweep_infos]
+
+        points = np.empty((sum(end - start for start, end in slices), 5), dtype=np.float32)
+        cur_offset = 0
+        for k, (start, end) in enumerate(slices):
+            cur_points = points[cur_offset:cur_offset + end - start]
+            cur_points[:, :4] = cache_points[start:end]
+            if k == 0:
+                cur_points[:, 4] = 0
+            else:
+                transform_matrix = sweep_infos[k - 1]['transform_matrix']
+                if transform_matrix is not None:
+                    cur_points[:, :3] = cur_points[:, :3].astype(np.float64) @ transform_matrix[:3, :3].T + \
+                        transform_matrix[:3, 3]
+                cur_points[:, 4] = sweep_infos[k - 1]['time_lag']
+            cur_offset += end - start
+        return points
+
     def crop_image(self, input_dict):
         W, H = input_dict["ori_shape"]
         imgs = input_dict["camera_imgs"]
@@ -219,7 +339,8 @@ class NuScenesDataset(DatasetTemplate):
         if self._merge_all_iters_to_one_epoch:
             index = index % len(self.infos)
 
-        info = copy.deepcopy(self.infos[index])
+        info = self.infos[index]
+        start_time = time.time()
         points = self.get_lidar_with_sweeps(index, max_sweeps=self.dataset_cfg.MAX_SWEEPS)
 
         input_dict = {
@@ -227,6 +348,8 @@ class NuScenesDataset(DatasetTemplate):
             'frame_id': Path(info['lidar_path']).stem,
             'metadata': {'token': info['token']}
         }
+        if self.profile_pipeline:
+            input_dict['stage_times'] = {'get_lidar_with_sweeps': time.time() - start_time}
 
         if 'gt_boxes' in info:
             if self.dataset_cfg.get('FILTER_MIN_POINTS_IN_GT', False):
@@ -234,9 +357,10 @@ class NuScenesDataset(DatasetTemplate):
             else:
                 mask = None
 
+            # the infos are shared between samples, the augmentors modify their own copies in place
             input_dict.update({
-                'gt_names': info['gt_names'] if mask is None else info['gt_names'][mask],
-                'gt_boxes': info['gt_boxes'] if mask is None else info['gt_boxes'][mask]
+                'gt_names': info['gt_names'].copy() if mask is None else info['gt_names'][mask],
+                'gt_boxes': info['gt_boxes'].copy() if mask is None else info['gt_boxes'][mask]
             })
         if self.use_camera:
             input_dict = self.load_camera_info(input_dict, info)
@@ -253,19 +377,26 @@ class NuScenesDataset(DatasetTemplate):
 
         return data_dict
 
-    def evaluation(self, det_annos, class_names, **kwargs):
-        import json
+    def get_eval_nusc(self):
         from nuscenes.nuscenes import NuScenes
+        if self._eval_nusc is None:
+            self._eval_nusc = NuScenes(
+                version=self.dataset_cfg.VERSION, dataroot=str(self.root_path), verbose=True, lazy=True
+            )
+        return self._eval_nusc
+
+    def convert_det_annos_to_nusc_results(self, det_annos):
+        """
+        Converts (a chunk of) det_annos into the content of a nuScenes result file, used by the streaming writer.
+        """
         from . import nuscenes_utils
-        nusc = NuScenes(version=self.dataset_cfg.VERSION, dataroot=str(self.root_path), verbose=True)
-        nusc_annos = nuscenes_utils.transform_det_annos_to_nusc_annos(det_annos, nusc)
-        nusc_annos['meta'] = {
-            'use_camera': False,
-            'use_lidar': True,
-            'use_radar': False,
-            'use_map': False,
-            'use_external': False,
-        }
+        nusc_annos = nuscenes_utils.transform_det_annos_to_nusc_annos(det_annos, self.get_eval_nusc())
+        nusc_annos['meta'] = dict(NUSC_RESULTS_META)
+        return nusc_annos
+
+    def evaluation(self, det_annos, class_names, **kwargs):
+        import json
+        nusc_annos = self.convert_det_annos_to_nusc_results(det_annos)
 
         output_path = Path(kwargs['output_path'])
         output_path.mkdir(exist_ok=True, parents=True)
@@ -274,7 +405,47 @@ class NuScenesDataset(DatasetTemplate):
             json.dump(nusc_annos, f)
 
         self.logger.info(f'The predictions of NuScenes have been saved to {res_path}')
+        return self.evaluate_nusc_results(res_path, output_path)
 
+    def evaluation_from_shards(self, shard_dir, class_names, **kwargs):
+        """
+        Evaluates the nuScenes result shards of the streaming prediction writer (*.json in shard_dir) without
+        gathering the predictions first. They are also merged into results_nusc.json one shard at a time.
+        """
+        import json
+        shard_paths = sorted([str(x) for x in Path(shard_dir).glob('*.json')])
+
+        output_path = Path(kwargs['output_path'])
+        output_path.mkdir(exist_ok=True, parents=True)
+        res_path = str(output_path / 'results_nusc.json')
+        written_tokens = set()
+        with open(res_path, 'w') as f:
+            f.write('{"results": {')
+            for shard_path in shard_paths:
+                with open(shard_path, 'r') as shard_file:
+                    shard_results = json.load(shard_file)['results']
+                for token, annos in shard_results.items():
+                    # samples are repeated by the distributed sampler to even out the ranks
+                    if token in written_tokens:
+                        continue
+                    f.write('%s%s: %s' % (', ' if len(written_tokens) > 0 else '', json.dumps(token), json.dumps(annos)))
+                    written_tokens.add(token)
+            f.write('}, "meta": %s}' % json.dumps(NUSC_RESULTS_META))
+
+        self.logger.info(f'The predictions of NuScenes have been saved to {res_path}')
+        return self.evaluate_nusc_results(shard_paths, output_path)
+
+    def evaluate_nusc_results(self, result_path, output_path):
+        """
+        Args:
+            result_path: nuScenes result file or list of result shards
+            output_path:
+
+        Returns:
+            result_str, result_dict
+        """
+        import json
+        from . import nuscenes_utils
         if self.dataset_cfg.VERSION == 'v1.0-test':
             return 'No ground-truth annotations for evaluation', {}
 
@@ -294,12 +465,15 @@ class NuScenesDataset(DatasetTemplate):
             eval_config = config_factory(eval_version)
 
         nusc_eval = NuScenesEval(
-            nusc,
+            self.get_eval_nusc(),
             config=eval_config,
-            result_path=res_path,
+            result_path=result_path,
             eval_set=eval_set_map[self.dataset_cfg.VERSION],
             output_dir=str(output_path),
             verbose=True,
+            num_workers=self.dataset_cfg.get('EVAL_NUM_WORKERS', 0),
+            # opt-in, the dataset root is often read-only or shared
+            gt_cache_dir=self.dataset_cfg.get('EVAL_GT_CACHE_DIR', None),
         )
         metrics_summary = nusc_eval.main(plot_examples=0, render_curves=False)
 
@@ -309,52 +483,211 @@ class NuScenesDataset(DatasetTemplate):
         result_str, result_dict = nuscenes_utils.format_nuscene_results(metrics, self.class_names, version=eval_version)
         return result_str, result_dict
 
-    def create_groundtruth_database(self, used_classes=None, max_sweeps=10):
-        import torch
+    def create_gt_database_of_single_sample(self, sample_idx, max_sweeps=10, used_classes=None):
+        """
+        Args:
+            sample_idx: index into self.infos
+            max_sweeps:
+            used_classes: classes to keep, None keeps all
+
+        Returns:
+            db_infos: list of db infos of the objects in the sample, without global_data_offset
+            gt_points: (M, C) float32, points of these objects relative to their box centers, stacked in db_infos order
+        """
+        info = self.infos[sample_idx]
+        points = self.get_lidar_with_sweeps(sample_idx, max_sweeps=max_sweeps)
+        gt_boxes = info['gt_boxes']
+        gt_names = info['gt_names']
+
+        # group the points by box once instead of masking all points for every box
+        box_idxs_of_pts = box_utils.points_in_boxes_numba(points[:, 0:3], gt_boxes[:, 0:7])
+        order = np.argsort(box_idxs_of_pts, kind='stable')
+        box_starts = np.searchsorted(box_idxs_of_pts[order], np.arange(gt_boxes.shape[0] + 1))
+
+        db_infos = []
+        gt_points_list = []
+        for i in range(gt_boxes.shape[0]):
+            if (used_classes is not None) and gt_names[i] not in used_classes:
+                continue
+            gt_points = points[order[box_starts[i]:box_starts[i + 1]]].astype(np.float32)
+            gt_points[:, :3] -= gt_boxes[i, :3]
+
+            db_infos.append({'name': gt_names[i], 'image_idx': sample_idx, 'gt_idx': i,
+                             'box3d_lidar': gt_boxes[i], 'num_points_in_gt': gt_points.shape[0]})
+            gt_points_list.append(gt_points)
 
-        database_save_path = self.root_path / f'gt_database_{max_sweeps}sweeps_withvelo'
+        if len(gt_points_list) > 0:
+            gt_points = np.concatenate(gt_points_list, axis=0)
+        else:
+            gt_points = np.zeros((0, points.shape[1]), dtype=np.float32)
+        return db_infos, gt_points
+
+    def create_groundtruth_database(self, used_classes=None, max_sweeps=10, num_workers=0):
+        """
+        Creates the GT database directly in the integrated format: the points of all objects are stacked into
+        gt_database_{max_sweeps}sweeps_withvelo_global.npy and each db info stores its 'global_data_offset' into it.
+        There are no per-object files, so instead of 'path' each db info keeps 'global_data_path', the database file
+        relative to the root path, which DataBaseSampler falls back to if the config sets no DB_DATA_PATH.
+        Points in boxes are computed on the CPU, so no GPU is needed.
+        Args:
+            used_classes: classes to keep, None keeps all
+            max_sweeps:
+            num_workers: number of processes, 0 runs in the current process
+        """
+        db_data_save_path = self.root_path / f'gt_database_{max_sweeps}sweeps_withvelo_global.npy'
         db_info_save_path = self.root_path / f'nuscenes_dbinfos_{max_sweeps}sweeps_withvelo.pkl'
+        raw_data_save_path = self.root_path / f'gt_database_{max_sweeps}sweeps_withvelo_global.raw.tmp'
+
+        create_gt_database_of_single_sample = partial(
+            _create_gt_database_worker, max_sweeps=max_sweeps, used_classes=used_classes
+        )
+        sample_indices = range(len(self.infos))
+        db_data_path = str(db_data_save_path.relative_to(self.root_path))
 
-        database_save_path.mkdir(parents=True, exist_ok=True)
         all_db_infos = {}
+        point_offset_cnt = 0
+        num_point_features = 0
+        # the object points are streamed to a raw file, so the database never has to fit into memory at once
+        with open(raw_data_save_path, 'wb') as f:
+            if num_workers > 0:
+                pool = multiprocessing.Pool(num_workers, initializer=_init_gt_database_worker, initargs=(self,))
+                results = pool.imap(create_gt_database_of_single_sample, sample_indices, chunksize=4)
+            else:
+                pool = None
+                results = map(partial(self.create_gt_database_of_single_sample, max_sweeps=max_sweeps,
+                                      used_classes=used_classes), sample_indices)
+
+            for db_infos, gt_points in tqdm(results, total=len(sample_indices)):
+                gt_points.tofile(f)
+                num_point_features = gt_points.shape[1]
+                for db_info in db_infos:
+                    num_points = db_info['num_points_in_gt']
+                    db_info['global_data_path'] = db_data_path
+                    db_info['global_data_offset'] = [point_offset_cnt, point_offset_cnt + num_points]
+                    point_offset_cnt += num_points
+                    all_db_infos.setdefault(db_info['name'], []).append(db_info)
+
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-        for idx in tqdm(range(len(self.infos))):
-            sample_idx = idx
-            info = self.infos[idx]
-            points = self.get_lidar_with_sweeps(idx, max_sweeps=max_sweeps)
-            gt_boxes = info['gt_boxes']
-            gt_names = info['gt_names']
-
-            box_idxs_of_pts = roiaware_pool3d_utils.points_in_boxes_gpu(
-                torch.from_numpy(points[:, 0:3]).unsqueeze(dim=0).float().cuda(),
-                torch.from_numpy(gt_boxes[:, 0:7]).unsqueeze(dim=0).float().cuda()
-            ).long().squeeze(dim=0).cpu().numpy()
-
-            for i in range(gt_boxes.shape[0]):
-                filename = '%s_%s_%d.bin' % (sample_idx, gt_names[i], i)
-                filepath = database_save_path / filename
-                gt_points = points[box_idxs_of_pts == i]
-
-                gt_points[:, :3] -= gt_boxes[i, :3]
-                with open(filepath, 'w') as f:
-                    gt_points.tofile(f)
-
-                if (used_classes is None) or gt_names[i] in used_classes:
-                    db_path = str(filepath.relative_to(self.root_path))  # gt_database/xxxxx.bin
-                    db_info = {'name': gt_names[i], 'path': db_path, 'image_idx': sample_idx, 'gt_idx': i,
-                               'box3d_lidar': gt_boxes[i], 'num_points_in_gt': gt_points.shape[0]}
-                    if gt_names[i] in all_db_infos:
-                        all_db_infos[gt_names[i]].append(db_info)
-                    else:
-                        all_db_infos[gt_names[i]] = [db_info]
         for k, v in all_db_infos.items():
             print('Database %s: %d' % (k, len(v)))
 
+        convert_raw_points_to_npy(raw_data_save_path, db_data_save_path, point_offset_cnt, num_point_features)
+
         with open(db_info_save_path, 'wb') as f:
             pickle.dump(all_db_infos, f)
 
+    def create_sweep_cache(self, num_workers=0):
+        """
+        Writes the key frames and the ego-filtered sweeps referenced by the infos of all splits into one
+        memory-mapped point store with an offset index, which is read by get_lidar_with_sweeps if USE_SWEEP_CACHE.
+        The info files are recorded in manifest.json, NuScenesDataset refuses a cache built from other infos.
+        Args:
+            num_workers: number of processes, 0 runs in the current process
+        """
+        manifest = self.get_sweep_cache_manifest()
+        infos = []
+        for info_path in self.get_sweep_cache_info_paths():
+            with open(info_path, 'rb') as f:
+                infos.extend(pickle.load(f))
 
-def create_nuscenes_info(version, data_path, save_path, max_sweeps=10, with_cam=False):
+        # sweeps are shared by neighbouring samples and are stored once, before their per-sample transform
+        lidar_files = {}
+        for info in infos:
+            lidar_files[('lidar', info['lidar_path'])] = None
+            for sweep_info in info['sweeps']:
+                lidar_files[('sweep', sweep_info['lidar_path'])] = None
+        lidar_files = list(lidar_files.keys())
+
+        # write to a temporary directory first so that concurrent processes never map a partial cache
+        tmp_dir = self.sweep_cache_dir.parent / ('%s.tmp%d' % (self.sweep_cache_dir.name, os.getpid()))
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        raw_data_save_path = tmp_dir / 'points.raw.tmp'
+        load_cache_points = partial(_load_sweep_cache_points, root_path=self.root_path)
+
+        index = {'lidar': {}, 'sweep': {}}
+        point_offset_cnt = 0
+        with open(raw_data_save_path, 'wb') as f:
+            if num_workers > 0:
+                pool = multiprocessing.Pool(num_workers)
+                results = pool.imap(load_cache_points, lidar_files, chunksize=16)
+            else:
+                pool = None
+                results = map(load_cache_points, lidar_files)
+
+            for (kind, lidar_path), points in tqdm(zip(lidar_files, results), total=len(lidar_files)):
+                points.tofile(f)
+                index[kind][lidar_path] = (point_offset_cnt, point_offset_cnt + points.shape[0])
+                point_offset_cnt += points.shape[0]
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        convert_raw_points_to_npy(raw_data_save_path, tmp_dir / 'points.npy', point_offset_cnt, 4)
+        with open(tmp_dir / 'index.pkl', 'wb') as f:
+            pickle.dump(index, f)
+        with open(tmp_dir / 'manifest.json', 'w') as f:
+            json.dump(manifest, f)
+        if self.sweep_cache_dir.exists():
+            shutil.rmtree(self.sweep_cache_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, self.sweep_cache_dir)
+        except OSError:
+            # another process has just published the same cache
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._sweep_cache = None
+        self.logger.info('Sweep cache: %d key frames, %d sweeps, %d points' % (
+            len(index['lidar']), len(index['sweep']), point_offset_cnt))
+
+
+def load_lidar_points(lidar_path, remove_ego=False, center_radius=1.0):
+    points = np.fromfile(str(lidar_path), dtype=np.float32, count=-1).reshape([-1, 5])[:, :4]
+    if remove_ego:
+        mask = ~((np.abs(points[:, 0]) < center_radius) & (np.abs(points[:, 1]) < center_radius))
+        points = points[mask]
+    return points
+
+
+def _load_sweep_cache_points(lidar_file, root_path):
+    kind, lidar_path = lidar_file
+    return load_lidar_points(root_path / lidar_path, remove_ego=kind == 'sweep')
+
+
+def convert_raw_points_to_npy(raw_data_path, npy_data_path, num_points, num_point_features):
+    """
+    Copies points streamed to a raw float32 file into a .npy file chunk by chunk and removes the raw file.
+    """
+    if num_points > 0:
+        raw_data = np.memmap(raw_data_path, dtype=np.float32, mode='r', shape=(num_points, num_point_features))
+        stacked_points = np.lib.format.open_memmap(npy_data_path, mode='w+', dtype=np.float32, shape=raw_data.shape)
+        chunk_size = 1 << 22
+        for start in range(0, num_points, chunk_size):
+            stacked_points[start:start + chunk_size] = raw_data[start:start + chunk_size]
+        stacked_points.flush()
+        del raw_data, stacked_points
+    else:
+        np.save(npy_data_path, np.zeros((0, num_point_features), dtype=np.float32))
+    os.remove(raw_data_path)
+
+
+_worker_dataset = None
+
+
+def _init_gt_database_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _create_gt_database_worker(sample_idx, max_sweeps=10, used_classes=None):
+    return _worker_dataset.create_gt_database_of_single_sample(
+        sample_idx, max_sweeps=max_sweeps, used_classes=used_classes
+    )
+
+
+def create_nuscenes_info(version, data_path, save_path, max_sweeps=10, with_cam=False, workers=0):
     from nuscenes.nuscenes import NuScenes
     from nuscenes.utils import splits
     from . import nuscenes_utils
@@ -384,9 +717,12 @@ def create_nuscenes_info(version, data_path, save_path, max_sweeps=10, with_cam=
 
     print('%s: train scene(%d), val scene(%d)' % (version, len(train_scenes), len(val_scenes)))
 
+    # per-scene infos are kept here so that an interrupted run resumes with the remaining scenes
+    scene_infos_dir = save_path / ('nuscenes_infos_%dsweeps%s_scenes' % (max_sweeps, '_cam' if with_cam else ''))
     train_nusc_infos, val_nusc_infos = nuscenes_utils.fill_trainval_infos(
         data_path=data_path, nusc=nusc, train_scenes=train_scenes, val_scenes=val_scenes,
-        test='test' in version, max_sweeps=max_sweeps, with_cam=with_cam
+        test='test' in version, max_sweeps=max_sweeps, with_cam=with_cam,
+        num_workers=workers, save_dir=scene_infos_dir
     )
 
     if version == 'v1.0-test':
@@ -400,6 +736,9 @@ def create_nuscenes_info(version, data_path, save_path, max_sweeps=10, with_cam=
         with open(save_path / f'nuscenes_infos_{max_sweeps}sweeps_val.pkl', 'wb') as f:
             pickle.dump(val_nusc_infos, f)
 
+    # the per-scene infos are only needed to resume an interrupted run
+    shutil.rmtree(scene_infos_dir)
+
 
 if __name__ == '__main__':
     import yaml
@@ -412,6 +751,8 @@ if __name__ == '__main__':
     parser.add_argument('--func', type=str, default='create_nuscenes_infos', help='')
     parser.add_argument('--version', type=str, default='v1.0-trainval', help='')
     parser.add_argument('--with_cam', action='store_true', default=False, help='use camera or not')
+    parser.add_argument('--workers', type=int, default=min(16, multiprocessing.cpu_count()),
+                        help='number of processes used to create the infos and the GT database, 0 to disable')
     args = parser.parse_args()
 
     if args.func == 'create_nuscenes_infos':
@@ -423,7 +764,8 @@ if __name__ == '__main__':
             data_path=ROOT_DIR / 'data' / 'nuscenes',
             save_path=ROOT_DIR / 'data' / 'nuscenes',
             max_sweeps=dataset_cfg.MAX_SWEEPS,
-            with_cam=args.with_cam
+            with_cam=args.with_cam,
+            workers=args.workers
         )
 
         nuscenes_dataset = NuScenesDataset(
@@ -431,4 +773,15 @@ if __name__ == '__main__':
             root_path=ROOT_DIR / 'data' / 'nuscenes',
             logger=common_utils.create_logger(), training=True
         )
-        nuscenes_dataset.create_groundtruth_database(max_sweeps=dataset_cfg.MAX_SWEEPS)
+        nuscenes_dataset.create_groundtruth_database(max_sweeps=dataset_cfg.MAX_SWEEPS, num_workers=args.workers)
+    elif args.func == 'create_sweep_cache':
+        dataset_cfg = EasyDict(yaml.safe_load(open(args.cfg_file)))
+        ROOT_DIR = (Path(__file__).resolve().parent / '../../../').resolve()
+        dataset_cfg.VERSION = args.version
+        dataset_cfg.USE_SWEEP_CACHE = False  # the cache may be missing or stale, it is built below
+        nuscenes_dataset = NuScenesDataset(
+            dataset_cfg=dataset_cfg, class_names=None,
+            root_path=ROOT_DIR / 'data' / 'nuscenes',
+            logger=common_utils.create_logger(), training=True
+        )
+        nuscenes_dataset.create_sweep_cache(num_workers=args.workers)
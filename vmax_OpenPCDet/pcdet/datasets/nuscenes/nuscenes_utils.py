@@ -3,8 +3,13 @@ The NuScenes data pre-processing and evaluation is modified from
 https://github.com/traveller59/second.pytorch and https://github.com/poodarchu/Det3D
 """
 
+import json
+import multiprocessing
 import operator
-from functools import reduce
+import os
+import pickle
+import shutil
+from functools import partial, reduce
 from pathlib import Path
 
 import numpy as np
@@ -309,163 +314,272 @@ def obtain_sensor2top(
     return sweep
 
 
-def fill_trainval_infos(data_path, nusc, train_scenes, val_scenes, test=False, max_sweeps=10, with_cam=False):
-    train_nusc_infos = []
-    val_nusc_infos = []
-    progress_bar = tqdm.tqdm(total=len(nusc.sample), desc='create_info', dynamic_ncols=True)
-
+def fill_sample_info(data_path, nusc, sample, test=False, max_sweeps=10, with_cam=False):
     ref_chan = 'LIDAR_TOP'  # The radar channel from which we track back n sweeps to aggregate the point cloud.
     chan = 'LIDAR_TOP'  # The reference channel of the current sample_rec that the point clouds are mapped to.
 
-    for index, sample in enumerate(nusc.sample):
-        progress_bar.update()
-
-        ref_sd_token = sample['data'][ref_chan]
-        ref_sd_rec = nusc.get('sample_data', ref_sd_token)
-        ref_cs_rec = nusc.get('calibrated_sensor', ref_sd_rec['calibrated_sensor_token'])
-        ref_pose_rec = nusc.get('ego_pose', ref_sd_rec['ego_pose_token'])
-        ref_time = 1e-6 * int(ref_sd_rec['timestamp'])
+    ref_sd_token = sample['data'][ref_chan]
+    ref_sd_rec = nusc.get('sample_data', ref_sd_token)
+    ref_cs_rec = nusc.get('calibrated_sensor', ref_sd_rec['calibrated_sensor_token'])
+    ref_pose_rec = nusc.get('ego_pose', ref_sd_rec['ego_pose_token'])
+    ref_time = 1e-6 * int(ref_sd_rec['timestamp'])
 
-        ref_lidar_path, ref_boxes, _ = get_sample_data(nusc, ref_sd_token)
+    ref_lidar_path, ref_boxes, _ = get_sample_data(nusc, ref_sd_token)
 
-        # Homogeneous transform from ego car frame to reference frame
-        ref_from_car = transform_matrix(
-            ref_cs_rec['translation'], Quaternion(ref_cs_rec['rotation']), inverse=True
-        )
+    # Homogeneous transform from ego car frame to reference frame
+    ref_from_car = transform_matrix(
+        ref_cs_rec['translation'], Quaternion(ref_cs_rec['rotation']), inverse=True
+    )
 
-        # Homogeneous transformation matrix from global to _current_ ego car frame
-        car_from_global = transform_matrix(
-            ref_pose_rec['translation'], Quaternion(ref_pose_rec['rotation']), inverse=True,
-        )
+    # Homogeneous transformation matrix from global to _current_ ego car frame
+    car_from_global = transform_matrix(
+        ref_pose_rec['translation'], Quaternion(ref_pose_rec['rotation']), inverse=True,
+    )
 
-        info = {
-            'lidar_path': Path(ref_lidar_path).relative_to(data_path).__str__(),
-            'token': sample['token'],
-            'sweeps': [],
-            'ref_from_car': ref_from_car,
-            'car_from_global': car_from_global,
-            'timestamp': ref_time,
-        }
-        if with_cam:
-            ref_cam_front_token = sample['data']['CAM_FRONT']
-            ref_cam_path, _, ref_cam_intrinsic = nusc.get_sample_data(ref_cam_front_token)
-            
-            info['cam_front_path'] = Path(ref_cam_path).relative_to(data_path).__str__()
-            info['cam_intrinsic'] = ref_cam_intrinsic
-
-            info['cams'] = dict()
-            l2e_r = ref_cs_rec["rotation"]
-            l2e_t = ref_cs_rec["translation"],
-            e2g_r = ref_pose_rec["rotation"]
-            e2g_t = ref_pose_rec["translation"]
-            l2e_r_mat = Quaternion(l2e_r).rotation_matrix
-            e2g_r_mat = Quaternion(e2g_r).rotation_matrix
-
-            # obtain 6 image's information per frame
-            camera_types = [
-                "CAM_FRONT",
-                "CAM_FRONT_RIGHT",
-                "CAM_FRONT_LEFT",
-                "CAM_BACK",
-                "CAM_BACK_LEFT",
-                "CAM_BACK_RIGHT",
-            ]
-            for cam in camera_types:
-                cam_token = sample["data"][cam]
-                cam_path, _, camera_intrinsics = nusc.get_sample_data(cam_token)
-                cam_info = obtain_sensor2top(
-                    nusc, cam_token, l2e_t, l2e_r_mat, e2g_t, e2g_r_mat, cam
-                )
-                cam_info['data_path'] = Path(cam_info['data_path']).relative_to(data_path).__str__()
-                cam_info.update(camera_intrinsics=camera_intrinsics)
-                info["cams"].update({cam: cam_info})
+    info = {
+        'lidar_path': Path(ref_lidar_path).relative_to(data_path).__str__(),
+        'token': sample['token'],
+        'sweeps': [],
+        'ref_from_car': ref_from_car,
+        'car_from_global': car_from_global,
+        'timestamp': ref_time,
+    }
+    if with_cam:
+        ref_cam_front_token = sample['data']['CAM_FRONT']
+        ref_cam_path, _, ref_cam_intrinsic = nusc.get_sample_data(ref_cam_front_token)
         
+        info['cam_front_path'] = Path(ref_cam_path).relative_to(data_path).__str__()
+        info['cam_intrinsic'] = ref_cam_intrinsic
+
+        info['cams'] = dict()
+        l2e_r = ref_cs_rec["rotation"]
+        l2e_t = ref_cs_rec["translation"],
+        e2g_r = ref_pose_rec["rotation"]
+        e2g_t = ref_pose_rec["translation"]
+        l2e_r_mat = Quaternion(l2e_r).rotation_matrix
+        e2g_r_mat = Quaternion(e2g_r).rotation_matrix
+
+        # obtain 6 image's information per frame
+        camera_types = [
+            "CAM_FRONT",
+            "CAM_FRONT_RIGHT",
+            "CAM_FRONT_LEFT",
+            "CAM_BACK",
+            "CAM_BACK_LEFT",
+            "CAM_BACK_RIGHT",
+        ]
+        for cam in camera_types:
+            cam_token = sample["data"][cam]
+            cam_path, _, camera_intrinsics = nusc.get_sample_data(cam_token)
+            cam_info = obtain_sensor2top(
+                nusc, cam_token, l2e_t, l2e_r_mat, e2g_t, e2g_r_mat, cam
+            )
+            cam_info['data_path'] = Path(cam_info['data_path']).relative_to(data_path).__str__()
+            cam_info.update(camera_intrinsics=camera_intrinsics)
+            info["cams"].update({cam: cam_info})
+    
 
-        sample_data_token = sample['data'][chan]
-        curr_sd_rec = nusc.get('sample_data', sample_data_token)
-        sweeps = []
-        while len(sweeps) < max_sweeps - 1:
-            if curr_sd_rec['prev'] == '':
-                if len(sweeps) == 0:
-                    sweep = {
-                        'lidar_path': Path(ref_lidar_path).relative_to(data_path).__str__(),
-                        'sample_data_token': curr_sd_rec['token'],
-                        'transform_matrix': None,
-                        'time_lag': int(curr_sd_rec['timestamp']) * 0,
-                    }
-                    sweeps.append(sweep)
-                else:
-                    sweeps.append(sweeps[-1])
+    sample_data_token = sample['data'][chan]
+    curr_sd_rec = nusc.get('sample_data', sample_data_token)
+    sweeps = []
+    while len(sweeps) < max_sweeps - 1:
+        if curr_sd_rec['prev'] == '':
+            if len(sweeps) == 0:
+                sweep = {
+                    'lidar_path': Path(ref_lidar_path).relative_to(data_path).__str__(),
+                    'sample_data_token': curr_sd_rec['token'],
+                    'transform_matrix': None,
+                    'time_lag': int(curr_sd_rec['timestamp']) * 0,
+                }
+                sweeps.append(sweep)
             else:
-                curr_sd_rec = nusc.get('sample_data', curr_sd_rec['prev'])
+                sweeps.append(sweeps[-1])
+        else:
+            curr_sd_rec = nusc.get('sample_data', curr_sd_rec['prev'])
+
+            # Get past pose
+            current_pose_rec = nusc.get('ego_pose', curr_sd_rec['ego_pose_token'])
+            global_from_car = transform_matrix(
+                current_pose_rec['translation'], Quaternion(current_pose_rec['rotation']), inverse=False,
+            )
+
+            # Homogeneous transformation matrix from sensor coordinate frame to ego car frame.
+            current_cs_rec = nusc.get(
+                'calibrated_sensor', curr_sd_rec['calibrated_sensor_token']
+            )
+            car_from_current = transform_matrix(
+                current_cs_rec['translation'], Quaternion(current_cs_rec['rotation']), inverse=False,
+            )
+
+            tm = reduce(np.dot, [ref_from_car, car_from_global, global_from_car, car_from_current])
+
+            lidar_path = nusc.get_sample_data_path(curr_sd_rec['token'])
+
+            time_lag = ref_time - 1e-6 * int(curr_sd_rec['timestamp'])
+
+            sweep = {
+                'lidar_path': Path(lidar_path).relative_to(data_path).__str__(),
+                'sample_data_token': curr_sd_rec['token'],
+                'transform_matrix': tm,
+                'global_from_car': global_from_car,
+                'car_from_current': car_from_current,
+                'time_lag': time_lag,
+            }
+            sweeps.append(sweep)
 
-                # Get past pose
-                current_pose_rec = nusc.get('ego_pose', curr_sd_rec['ego_pose_token'])
-                global_from_car = transform_matrix(
-                    current_pose_rec['translation'], Quaternion(current_pose_rec['rotation']), inverse=False,
-                )
+    info['sweeps'] = sweeps
 
-                # Homogeneous transformation matrix from sensor coordinate frame to ego car frame.
-                current_cs_rec = nusc.get(
-                    'calibrated_sensor', curr_sd_rec['calibrated_sensor_token']
-                )
-                car_from_current = transform_matrix(
-                    current_cs_rec['translation'], Quaternion(current_cs_rec['rotation']), inverse=False,
-                )
+    assert len(info['sweeps']) == max_sweeps - 1, \
+        f"sweep {curr_sd_rec['token']} only has {len(info['sweeps'])} sweeps, " \
+        f"you should duplicate to sweep num {max_sweeps - 1}"
 
-                tm = reduce(np.dot, [ref_from_car, car_from_global, global_from_car, car_from_current])
+    if not test:
+        annotations = [nusc.get('sample_annotation', token) for token in sample['anns']]
 
-                lidar_path = nusc.get_sample_data_path(curr_sd_rec['token'])
+        # the filtering gives 0.5~1 map improvement
+        num_lidar_pts = np.array([anno['num_lidar_pts'] for anno in annotations])
+        num_radar_pts = np.array([anno['num_radar_pts'] for anno in annotations])
+        mask = (num_lidar_pts + num_radar_pts >= 0)
 
-                time_lag = ref_time - 1e-6 * int(curr_sd_rec['timestamp'])
+        locs = np.array([b.center for b in ref_boxes]).reshape(-1, 3)
+        dims = np.array([b.wlh for b in ref_boxes]).reshape(-1, 3)[:, [1, 0, 2]]  # wlh == > dxdydz (lwh)
+        velocity = np.array([b.velocity for b in ref_boxes]).reshape(-1, 3)
+        rots = np.array([quaternion_yaw(b.orientation) for b in ref_boxes]).reshape(-1, 1)
+        names = np.array([b.name for b in ref_boxes])
+        tokens = np.array([b.token for b in ref_boxes])
+        gt_boxes = np.concatenate([locs, dims, rots, velocity[:, :2]], axis=1)
 
-                sweep = {
-                    'lidar_path': Path(lidar_path).relative_to(data_path).__str__(),
-                    'sample_data_token': curr_sd_rec['token'],
-                    'transform_matrix': tm,
-                    'global_from_car': global_from_car,
-                    'car_from_current': car_from_current,
-                    'time_lag': time_lag,
-                }
-                sweeps.append(sweep)
+        assert len(annotations) == len(gt_boxes) == len(velocity)
+
+        info['gt_boxes'] = gt_boxes[mask, :]
+        info['gt_boxes_velocity'] = velocity[mask, :]
+        info['gt_names'] = np.array([map_name_from_general_to_detection[name] for name in names])[mask]
+        info['gt_boxes_token'] = tokens[mask]
+        info['num_lidar_pts'] = num_lidar_pts[mask]
+        info['num_radar_pts'] = num_radar_pts[mask]
 
-        info['sweeps'] = sweeps
+    return info
 
-        assert len(info['sweeps']) == max_sweeps - 1, \
-            f"sweep {curr_sd_rec['token']} only has {len(info['sweeps'])} sweeps, " \
-            f"you should duplicate to sweep num {max_sweeps - 1}"
 
-        if not test:
-            annotations = [nusc.get('sample_annotation', token) for token in sample['anns']]
+_worker_nusc = None
 
-            # the filtering gives 0.5~1 map improvement
-            num_lidar_pts = np.array([anno['num_lidar_pts'] for anno in annotations])
-            num_radar_pts = np.array([anno['num_radar_pts'] for anno in annotations])
-            mask = (num_lidar_pts + num_radar_pts >= 0)
 
-            locs = np.array([b.center for b in ref_boxes]).reshape(-1, 3)
-            dims = np.array([b.wlh for b in ref_boxes]).reshape(-1, 3)[:, [1, 0, 2]]  # wlh == > dxdydz (lwh)
-            velocity = np.array([b.velocity for b in ref_boxes]).reshape(-1, 3)
-            rots = np.array([quaternion_yaw(b.orientation) for b in ref_boxes]).reshape(-1, 1)
-            names = np.array([b.name for b in ref_boxes])
-            tokens = np.array([b.token for b in ref_boxes])
-            gt_boxes = np.concatenate([locs, dims, rots, velocity[:, :2]], axis=1)
+def _init_scene_info_worker(nusc):
+    global _worker_nusc
+    _worker_nusc = nusc
 
-            assert len(annotations) == len(gt_boxes) == len(velocity)
 
-            info['gt_boxes'] = gt_boxes[mask, :]
-            info['gt_boxes_velocity'] = velocity[mask, :]
-            info['gt_names'] = np.array([map_name_from_general_to_detection[name] for name in names])[mask]
-            info['gt_boxes_token'] = tokens[mask]
-            info['num_lidar_pts'] = num_lidar_pts[mask]
-            info['num_radar_pts'] = num_radar_pts[mask]
+def process_single_scene(scene_token, data_path, test=False, max_sweeps=10, with_cam=False, save_dir=None, nusc=None):
+    """
+    Args:
+        scene_token: token of the scene to process
+        data_path: root of the nuScenes version, infos store paths relative to it
+        save_dir: if given, the infos of the scene are cached in save_dir/<scene_token>.pkl and reused on later runs
+        nusc: NuScenes instance, defaults to the one of the current pool worker
 
+    Returns:
+        infos of all samples of the scene, in the order of nusc.sample
+    """
+    if nusc is None:
+        nusc = _worker_nusc
+
+    pkl_file = None
+    if save_dir is not None:
+        pkl_file = Path(save_dir) / ('%s.pkl' % scene_token)
+        if pkl_file.exists():
+            with open(pkl_file, 'rb') as f:
+                return pickle.load(f)
+
+    scene_infos = [
+        fill_sample_info(data_path, nusc, nusc.get('sample', sample_token), test=test, max_sweeps=max_sweeps,
+                         with_cam=with_cam)
+        for sample_token in nusc.field2token('sample', 'scene_token', scene_token)
+    ]
+
+    if pkl_file is not None:
+        # write to a temporary file first so that an interrupted run never leaves a partial scene behind
+        tmp_file = pkl_file.with_suffix('.pkl.%d.tmp' % os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(scene_infos, f)
+        os.replace(tmp_file, pkl_file)
+
+    return scene_infos
+
+
+def get_scene_infos_manifest(data_path, nusc, test=False, max_sweeps=10, with_cam=False):
+    """
+    Everything the per-scene infos depend on, they are only reused if the manifest of the cache matches.
+    """
+    table_stats = []
+    for table in sorted(f for f in os.listdir(nusc.table_root) if f.endswith('.json')):
+        stat = os.stat(os.path.join(nusc.table_root, table))
+        table_stats.append([table, stat.st_mtime_ns, stat.st_size])
+    return {
+        'version': nusc.version, 'data_path': str(data_path), 'test': test, 'max_sweeps': max_sweeps,
+        'with_cam': with_cam, 'tables': table_stats
+    }
+
+
+def prepare_scene_infos_dir(save_dir, manifest):
+    """
+    Creates the folder of the per-scene infos, cached scenes of a run with another manifest are removed first.
+    """
+    save_dir = Path(save_dir)
+    manifest_file = save_dir / 'manifest.json'
+    if save_dir.exists():
+        cached_manifest = None
+        if manifest_file.exists():
+            with open(manifest_file, 'r') as f:
+                cached_manifest = json.load(f)
+        if cached_manifest != manifest:
+            shutil.rmtree(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+
+
+def fill_trainval_infos(data_path, nusc, train_scenes, val_scenes, test=False, max_sweeps=10, with_cam=False,
+                        num_workers=0, save_dir=None):
+    """
+    Args:
+        num_workers: number of processes, the samples are split by scene across them. 0 runs in the current process
+        save_dir: if given, per-scene infos are written there so that an interrupted run can resume. They are only
+            reused if they were built with the same dataset tables and arguments, see get_scene_infos_manifest
+
+    Returns:
+        train_nusc_infos, val_nusc_infos
+    """
+    if save_dir is not None:
+        prepare_scene_infos_dir(save_dir, get_scene_infos_manifest(
+            data_path, nusc, test=test, max_sweeps=max_sweeps, with_cam=with_cam
+        ))
+
+    scene_tokens = [scene['token'] for scene in nusc.scene]
+    process_scene = partial(
+        process_single_scene, data_path=data_path, test=test, max_sweeps=max_sweeps, with_cam=with_cam,
+        save_dir=save_dir
+    )
+
+    if num_workers > 0:
+        with multiprocessing.Pool(num_workers, initializer=_init_scene_info_worker, initargs=(nusc,)) as p:
+            scene_infos = list(tqdm.tqdm(p.imap(process_scene, scene_tokens), total=len(scene_tokens),
+                                         desc='create_info', dynamic_ncols=True))
+    else:
+        scene_infos = [process_scene(scene_token, nusc=nusc)
+                       for scene_token in tqdm.tqdm(scene_tokens, desc='create_info', dynamic_ncols=True)]
+
+    # merge the scenes back into the order of nusc.sample
+    token_to_info = {info['token']: info for infos in scene_infos for info in infos}
+
+    train_nusc_infos = []
+    val_nusc_infos = []
+    for sample in nusc.sample:
+        info = token_to_info[sample['token']]
         if sample['scene_token'] in train_scenes:
             train_nusc_infos.append(info)
         else:
             val_nusc_infos.append(info)
 
-    progress_bar.close()
     return train_nusc_infos, val_nusc_infos
 
 
@@ -1,10 +1,13 @@
+import importlib.util
+import time
 from functools import partial
 
+import numba
 import numpy as np
 from skimage import transform
 import torch
 import torchvision
-from ...utils import box_utils, common_utils
+from ...utils import box_utils, common_utils, pipeline_profiler
 
 tv = None
 try:
@@ -61,6 +64,121 @@ class VoxelGeneratorWrapper():
         return voxels, coordinates, num_points
 
 
+@numba.jit(nopython=True)
+def _assign_points_to_voxels_kernel(points, voxel_size, coors_range, grid_size, band_min_range_sq, band_scales,
+                                    flip_x, flip_y, max_points, max_voxels, hash_keys, hash_vals, coors, num_points,
+                                    point_voxel, point_slot):
+    # open addressing hash from the linear voxel index to the voxel id, voxels are numbered by first appearance
+    hash_mask = hash_keys.shape[0] - 1
+    num_voxels = 0
+    for i in range(points.shape[0]):
+        x = -points[i, 0] if flip_x else points[i, 0]
+        y = -points[i, 1] if flip_y else points[i, 1]
+        fx = np.floor((x - coors_range[0]) / voxel_size[0])
+        fy = np.floor((y - coors_range[1]) / voxel_size[1])
+        fz = np.floor((points[i, 2] - coors_range[2]) / voxel_size[2])
+        if not (0 <= fx < grid_size[0] and 0 <= fy < grid_size[1] and 0 <= fz < grid_size[2]):
+            continue
+        cx, cy, cz = int(fx), int(fy), int(fz)
+        # far points are merged into blocks of scale x scale cells, placed at the center cell of the block
+        scale = 1
+        range_sq = x * x + y * y
+        for b in range(band_scales.shape[0]):
+            if range_sq >= band_min_range_sq[b]:
+                scale = band_scales[b]
+        if scale > 1:
+            cx = min(cx // scale * scale + scale // 2, grid_size[0] - 1)
+            cy = min(cy // scale * scale + scale // 2, grid_size[1] - 1)
+        key = (cz * grid_size[1] + cy) * grid_size[0] + cx
+        h = (key * 2654435761) & hash_mask
+        while hash_keys[h] != -1 and hash_keys[h] != key:
+            h = (h + 1) & hash_mask
+        if hash_keys[h] == -1:
+            if num_voxels >= max_voxels:
+                continue
+            hash_keys[h] = key
+            hash_vals[h] = num_voxels
+            coors[num_voxels, 0] = cz
+            coors[num_voxels, 1] = cy
+            coors[num_voxels, 2] = cx
+            num_voxels += 1
+        voxel_id = hash_vals[h]
+        if num_points[voxel_id] < max_points:
+            point_voxel[i] = voxel_id
+            point_slot[i] = num_points[voxel_id]
+            num_points[voxel_id] += 1
+    return num_voxels
+
+
+@numba.jit(nopython=True)
+def _scatter_points_to_voxels_kernel(points, flip_x, flip_y, point_voxel, point_slot, voxels):
+    for i in range(points.shape[0]):
+        voxel_id = point_voxel[i]
+        if voxel_id < 0:
+            continue
+        slot = point_slot[i]
+        for k in range(points.shape[1]):
+            voxels[voxel_id, slot, k] = points[i, k]
+        if flip_x:
+            voxels[voxel_id, slot, 0] = -points[i, 0]
+        if flip_y:
+            voxels[voxel_id, slot, 1] = -points[i, 1]
+
+
+class NumbaVoxelGenerator():
+    """
+    CPU voxelizer with the outputs of spconv's Point2VoxelCPU3d that needs neither spconv nor cumm.
+    Voxels are numbered by the first point falling into them, points beyond max_num_points_per_voxel and voxels
+    beyond max_num_voxels are dropped.
+
+    With range_bands, a list of [min_range, scale] pairs, points whose xy distance to the origin is at least
+    min_range are voxelized with voxels of scale x scale cells in xy. Such a voxel keeps a single coordinate on the
+    regular grid (the center cell of its block), so the outputs still fit the VFEs and the BEV scatter modules.
+    """
+    def __init__(self, vsize_xyz, coors_range_xyz, num_point_features, max_num_points_per_voxel, max_num_voxels,
+                 range_bands=None):
+        self.voxel_size = np.array(vsize_xyz, dtype=np.float32)
+        self.coors_range = np.array(coors_range_xyz, dtype=np.float32)
+        self.grid_size = np.round((self.coors_range[3:6] - self.coors_range[0:3]) / self.voxel_size).astype(np.int64)
+        self.num_point_features = num_point_features
+        self.max_num_points_per_voxel = max_num_points_per_voxel
+        self.max_num_voxels = max_num_voxels
+        range_bands = sorted(range_bands) if range_bands is not None else []
+        self.band_min_range_sq = np.array([x[0] ** 2 for x in range_bands], dtype=np.float32)
+        self.band_scales = np.array([x[1] for x in range_bands], dtype=np.int64)
+
+    def generate(self, points, flip_x=False, flip_y=False):
+        """
+        Args:
+            points: (N, C) float32
+            flip_x: voxelize the cloud mirrored along the x axis (x -> -x) without copying it
+            flip_y: voxelize the cloud mirrored along the y axis (y -> -y) without copying it
+
+        Returns:
+            voxels: (num_voxels, max_num_points_per_voxel, C) float32, zero padded
+            coordinates: (num_voxels, 3) int32 [z, y, x]
+            num_points: (num_voxels) int32
+        """
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        num_candidates = min(points.shape[0], self.max_num_voxels)
+        hash_size = 1 << int(max(2 * num_candidates, 1) - 1).bit_length()
+        hash_keys = np.full(hash_size, -1, dtype=np.int64)
+        hash_vals = np.empty(hash_size, dtype=np.int32)
+        coors = np.empty((num_candidates, 3), dtype=np.int32)
+        num_points = np.zeros(num_candidates, dtype=np.int32)
+        point_voxel = np.full(points.shape[0], -1, dtype=np.int32)
+        point_slot = np.empty(points.shape[0], dtype=np.int32)
+
+        num_voxels = _assign_points_to_voxels_kernel(
+            points, self.voxel_size, self.coors_range, self.grid_size, self.band_min_range_sq, self.band_scales,
+            flip_x, flip_y, self.max_num_points_per_voxel, self.max_num_voxels, hash_keys, hash_vals, coors, num_points,
+            point_voxel, point_slot
+        )
+        voxels = np.zeros((num_voxels, self.max_num_points_per_voxel, points.shape[1]), dtype=np.float32)
+        _scatter_points_to_voxels_kernel(points, flip_x, flip_y, point_voxel, point_slot, voxels)
+        return voxels, coors[:num_voxels], num_points[:num_voxels]
+
+
 class DataProcessor(object):
     def __init__(self, processor_configs, point_cloud_range, training, num_point_features):
         self.point_cloud_range = point_cloud_range
@@ -140,7 +258,12 @@ class DataProcessor(object):
             return partial(self.transform_points_to_voxels, config=config)
 
         if self.voxel_generator is None:
-            self.voxel_generator = VoxelGeneratorWrapper(
+            # spconv when it is installed, otherwise the built-in voxelizer
+            voxel_generator = config.get(
+                'VOXEL_GENERATOR', 'spconv' if importlib.util.find_spec('spconv') is not None else 'numba'
+            )
+            voxel_generator_cls = {'spconv': VoxelGeneratorWrapper, 'numba': NumbaVoxelGenerator}[voxel_generator]
+            self.voxel_generator = voxel_generator_cls(
                 vsize_xyz=config.VOXEL_SIZE,
                 coors_range_xyz=self.point_cloud_range,
                 num_point_features=self.num_point_features,
@@ -157,11 +280,13 @@ class DataProcessor(object):
 
         if config.get('DOUBLE_FLIP', False):
             voxels_list, voxel_coords_list, voxel_num_points_list = [voxels], [coordinates], [num_points]
-            points_yflip, points_xflip, points_xyflip = self.double_flip(points)
-            points_list = [points_yflip, points_xflip, points_xyflip]
-            keys = ['yflip', 'xflip', 'xyflip']
-            for i, key in enumerate(keys):
-                voxel_output = self.voxel_generator.generate(points_list[i])
+            # yflip, xflip, xyflip
+            flips = [(False, True), (True, False), (True, True)]
+            if isinstance(self.voxel_generator, NumbaVoxelGenerator):
+                voxel_outputs = (self.voxel_generator.generate(points, flip_x=x, flip_y=y) for x, y in flips)
+            else:
+                voxel_outputs = (self.voxel_generator.generate(x) for x in self.double_flip(points))
+            for voxel_output in voxel_outputs:
                 voxels, coordinates, num_points = voxel_output
 
                 if not data_dict['use_lead_xyz']:
@@ -179,6 +304,27 @@ class DataProcessor(object):
             data_dict['voxel_num_points'] = num_points
         return data_dict
 
+    def transform_points_to_voxels_range_adaptive(self, data_dict=None, config=None):
+        """
+        Same as transform_points_to_voxels, but voxels grow with the range as given by RANGE_BANDS, e.g.
+        [[0, 1], [100, 2], [200, 4]] for 2x2 cells from 100 m and 4x4 cells from 200 m. Sparse far points then fill
+        far fewer voxels, so MAX_NUMBER_OF_VOXELS can be lowered accordingly.
+        """
+        if data_dict is None:
+            self.transform_points_to_voxels(config=config)
+            return partial(self.transform_points_to_voxels_range_adaptive, config=config)
+
+        if self.voxel_generator is None:
+            self.voxel_generator = NumbaVoxelGenerator(
+                vsize_xyz=config.VOXEL_SIZE,
+                coors_range_xyz=self.point_cloud_range,
+                num_point_features=self.num_point_features,
+                max_num_points_per_voxel=config.MAX_POINTS_PER_VOXEL,
+                max_num_voxels=config.MAX_NUMBER_OF_VOXELS[self.mode],
+                range_bands=config.RANGE_BANDS
+            )
+        return self.transform_points_to_voxels(data_dict=data_dict, config=config)
+
     def sample_points(self, data_dict=None, config=None):
         if data_dict is None:
             return partial(self.sample_points, config=config)
@@ -298,7 +444,11 @@ class DataProcessor(object):
         Returns:
         """
 
+        stage_times = data_dict.get('stage_times', None)
         for cur_processor in self.data_processor_queue:
+            start_time = time.time()
             data_dict = cur_processor(data_dict=data_dict)
+            if stage_times is not None:
+                stage_times['processor/' + pipeline_profiler.get_stage_name(cur_processor)] = time.time() - start_time
 
         return data_dict
@@ -9,7 +9,6 @@ import copy
 import numpy as np
 import torch
 import multiprocessing
-import SharedArray
 import torch.distributed as dist
 from tqdm import tqdm
 from pathlib import Path
@@ -149,6 +148,7 @@ class WaymoDataset(DatasetTemplate):
             if not os.path.exists(f"/dev/shm/{sa_key}"):
                 continue
 
+            import SharedArray
             SharedArray.delete(f"shm://{sa_key}")
 
         if num_gpus > 1:
@@ -354,6 +354,7 @@ class WaymoDataset(DatasetTemplate):
         }
         if self.use_shared_memory and index < self.shared_memory_file_limit:
             sa_key = f'{sequence_name}___{sample_idx}'
+            import SharedArray
             points = SharedArray.attach(f"shm://{sa_key}").copy()
         else:
             points = self.get_lidar(sequence_name, sample_idx)
@@ -78,11 +78,19 @@ class Voxel_Mamba(nn.Module):
         self.sparse_shape = grid_size[::-1] + [1, 0, 0]
 
         # Build Hilbert tempalte 
+        # curve keys are computed on the fly unless USE_CURVE_TEMPLATE asks for the dense templates
         self.curve_template = {}
         self.hilbert_spatial_size = {}
-        self.load_template(self.model_cfg.INPUT_LAYER.curve_template_path_rank9, 9)
-        self.load_template(self.model_cfg.INPUT_LAYER.curve_template_path_rank8, 8)
-        self.load_template(self.model_cfg.INPUT_LAYER.curve_template_path_rank7, 7)
+        self.curve_key_bits = {}
+        self.use_curve_template = self.model_cfg.INPUT_LAYER.get('USE_CURVE_TEMPLATE', False)
+        for rank in self.model_cfg.INPUT_LAYER.get('CURVE_RANKS', [9, 8, 7]):
+            if self.use_curve_template:
+                self.load_template(self.model_cfg.INPUT_LAYER[f'curve_template_path_rank{rank}'], rank)
+            else:
+                spatial_size = 2 ** rank
+                self.curve_template[f'curve_template_rank{rank}'] = None
+                self.curve_key_bits[f'curve_template_rank{rank}'] = 3 * rank
+                self.hilbert_spatial_size[f'curve_template_rank{rank}'] = (1, spatial_size, spatial_size) #[z, y, x]
 
         factory_kwargs = {"device": self.device, "dtype": self.dtype}
 
@@ -142,6 +150,8 @@ class Voxel_Mamba(nn.Module):
             self.curve_template[f'curve_template_rank{rank}'] = template.reshape(-1)
             spatial_size = 2 ** rank
             self.hilbert_spatial_size[f'curve_template_rank{rank}'] = (1, spatial_size, spatial_size) #[z, y, x]
+        # bit length of the largest key, computed once here instead of syncing with the device in every forward
+        self.curve_key_bits[f'curve_template_rank{rank}'] = int(self.curve_template[f'curve_template_rank{rank}'].max()).bit_length()
 
     def forward(self, batch_dict):
         '''
@@ -168,13 +178,14 @@ class Voxel_Mamba(nn.Module):
         feat_3d = batch_dict['voxel_features']
         voxel_coords = batch_dict['voxel_coords']
         with torch.no_grad():
-            for name, _ in self.curve_template.items():
-                self.curve_template[name] = self.curve_template[name].to(voxel_coords.device)
+            for name, template in self.curve_template.items():
+                if template is not None:
+                    self.curve_template[name] = template.to(voxel_coords.device)
         
         down_sparse_shape = self.sparse_shape
         for i, block in enumerate(self.block_list):
 
-            feat_3d, voxel_coords = block(feat_3d, voxel_coords, batch_size, down_sparse_shape, self.curve_template, self.hilbert_spatial_size, self.pos_embed, i, debug)
+            feat_3d, voxel_coords = block(feat_3d, voxel_coords, batch_size, down_sparse_shape, self.curve_template, self.hilbert_spatial_size, self.curve_key_bits, self.pos_embed, i, debug)
             
             if (i > 0) and (i % 2 == 1):
                 xd = spconv.SparseConvTensor(
@@ -287,6 +298,7 @@ class DSB(nn.Module):
         
         self.sparse_shape = sparse_shape
         self.downsample_lvl = downsample_lvl
+        self.curve_lvl = 'curve_template_rank%d' % hilbert_config.get('CURVE_RANKS', [9, 8, 7])[0]
 
         norm_cls = partial(
             nn.LayerNorm, eps=norm_epsilon, **factory_kwargs
@@ -302,6 +314,7 @@ class DSB(nn.Module):
         curt_spatial_shape,
         curve_template,
         hilbert_spatial_size,
+        curve_key_bits,
         pos_embed,
         num_stage,
         debug=False,
@@ -329,17 +342,19 @@ class DSB(nn.Module):
         feats_s1 = features[0].features
         coords_s1 = features[0].indices
 
-        clvl_cruve_template_s1 = curve_template['curve_template_rank9']
-        clvl_hilbert_spatial_size_s1 = hilbert_spatial_size['curve_template_rank9']
+        clvl_cruve_template_s1 = curve_template[self.curve_lvl]
+        clvl_hilbert_spatial_size_s1 = hilbert_spatial_size[self.curve_lvl]
         index_info_s1 = get_hilbert_index_3d_mamba_lite(clvl_cruve_template_s1, coords_s1, batch_size, x_s1.spatial_shape[0], \
-                                                        clvl_hilbert_spatial_size_s1, shift=(num_stage, num_stage, num_stage))
+                                                        clvl_hilbert_spatial_size_s1, shift=(num_stage, num_stage, num_stage),
+                                                        key_bits=curve_key_bits[self.curve_lvl])
         inds_curt_to_next_s1 = index_info_s1['inds_curt_to_next']
         inds_next_to_curt_s1 = index_info_s1['inds_next_to_curt']
 
         clvl_cruve_template_s2 = curve_template[self.downsample_lvl]
         clvl_hilbert_spatial_size_s2 = hilbert_spatial_size[self.downsample_lvl]
         index_info_s2 = get_hilbert_index_3d_mamba_lite(clvl_cruve_template_s2, coords_s2, batch_size, x_s2.spatial_shape[0], 
-                                                        clvl_hilbert_spatial_size_s2, shift=(num_stage, num_stage, num_stage))
+                                                        clvl_hilbert_spatial_size_s2, shift=(num_stage, num_stage, num_stage),
+                                                        key_bits=curve_key_bits[self.downsample_lvl])
         inds_curt_to_next_s2 = index_info_s2['inds_curt_to_next']
         inds_next_to_curt_s2 = index_info_s2['inds_next_to_curt']
 
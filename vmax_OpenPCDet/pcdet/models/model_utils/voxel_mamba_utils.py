@@ -1,10 +1,90 @@
+import math
+
 import torch
 
-def get_hilbert_index_3d_mamba_lite(template, coors, batch_size, z_dim, hilbert_spatial_size, shift=(0, 0, 0), debug=True):
+
+def hilbert_encode_3d(locs, num_bits):
+    '''
+    Computes Hilbert curve keys without a precomputed template, following
+    convert_to_index in tools/process_tools/create_hilbert_curve.py.
+    locs: (N, 3) integer coordinates ordered as (z, y, x), each in [0, 2 ** num_bits)
+    num_bits: rank of the curve
+    Returns:
+        keys: (N) int64, equal to curve_template_3d_rank_{num_bits}[z * 4 ** num_bits + y * 2 ** num_bits + x]
+    '''
+    num_dims = 3
+    assert num_dims * num_bits < 64
+    locs = locs.long()
+    cols = [locs[:, dim] for dim in range(num_dims)]
+
+    # undo the excess work of the Gray code, from the highest bit down
+    bit_pow = 1 << (num_bits - 1)
+    while bit_pow > 1:
+        mask = bit_pow - 1
+        for dim in range(num_dims):
+            invert = (cols[dim] & bit_pow) > 0
+            cols[0] = cols[0] ^ (invert.long() * mask)
+            to_flip = ((cols[0] ^ cols[dim]) & mask) * (~invert).long()
+            cols[0] = cols[0] ^ to_flip
+            if dim > 0:
+                cols[dim] = cols[dim] ^ to_flip
+        bit_pow >>= 1
+
+    # interleave the bits into one Gray code, lower dims more significant
+    gray_code = torch.zeros_like(cols[0])
+    for bit_current in range(num_bits):
+        for dim in range(num_dims):
+            gray_code |= ((cols[dim] >> bit_current) & 1) << (bit_current * num_dims + num_dims - 1 - dim)
+
+    shift = 1 << (int(math.ceil(math.log2(num_dims * num_bits))) - 1)
+    while shift > 0:
+        gray_code ^= gray_code >> shift
+        shift >>= 1
+    return gray_code
+
+
+def get_batch_sort_index(coors, batch_size, keys, key_bits):
     '''
+    Sorts all batch elements at once by the composite key (batch, keys).
+    coors: (N, 1 + C) [batch_idx, ...]
+    keys: (N) int64 in [0, 2 ** key_bits), unique within each batch element
+    Returns:
+        inds_curt_to_next: dict of batch_idx -> indices that sort coors[coors[:, 0] == batch_idx]
+        inds_next_to_curt: dict of batch_idx -> the inverse permutation
+    '''
+    batch_idx = coors[:, 0].long()
+    order = torch.argsort((batch_idx << key_bits) | keys)
+
+    counts = torch.bincount(batch_idx, minlength=batch_size)
+    batch_start = torch.cumsum(counts, dim=0) - counts
+    batch_order = torch.argsort(batch_idx, stable=True)
+    arange = torch.arange(batch_idx.shape[0], device=order.device)
+
+    # position of every voxel inside its batch element, in input order and in curve order
+    local_idx = torch.empty_like(order)
+    local_idx[batch_order] = arange
+    local_idx -= batch_start[batch_idx]
+    rank_in_batch = torch.empty_like(order)
+    rank_in_batch[order] = arange
+    rank_in_batch -= batch_start[batch_idx]
+
+    counts = counts.tolist()
+    sorted_local_idx = torch.split(local_idx[order], counts)
+    batch_rank = torch.split(rank_in_batch[batch_order], counts)
+
+    inds_curt_to_next = {i: sorted_local_idx[i] for i in range(batch_size)}
+    inds_next_to_curt = {i: batch_rank[i] for i in range(batch_size)}
+    return inds_curt_to_next, inds_next_to_curt
+
+
+def get_hilbert_index_3d_mamba_lite(template, coors, batch_size, z_dim, hilbert_spatial_size, shift=(0, 0, 0), debug=True,
+                                    key_bits=None):
+    '''
+    template: dense curve template, or None to compute the keys with hilbert_encode_3d
     coors: (b, z, y, x)
     shift: (shift_z, shift_y, shift_x)
     hilbert_spatial_size: [z, y, x]
+    key_bits: bit length of template.max(), precomputed when the template is loaded, derived here if None
     '''
     # new 3D
     hil_size_z, hil_size_y, hil_size_x = hilbert_spatial_size
@@ -13,16 +93,17 @@ def get_hilbert_index_3d_mamba_lite(template, coors, batch_size, z_dim, hilbert_
     y = coors[:, 2] + shift[1]
     z = coors[:, 1] + shift[0]
 
-    flat_coors = (z * hil_size_y * hil_size_x + y * hil_size_x + x).long()
-    hil_inds = template[flat_coors].long()
+    if template is None:
+        num_bits = int(math.log2(hil_size_x))
+        hil_inds = hilbert_encode_3d(torch.stack([z, y, x], dim=1), num_bits)
+        key_bits = 3 * num_bits
+    else:
+        flat_coors = (z * hil_size_y * hil_size_x + y * hil_size_x + x).long()
+        hil_inds = template[flat_coors].long()
+        if key_bits is None:
+            key_bits = int(template.max()).bit_length()
 
-    inds_curt_to_next = {}
-    inds_next_to_curt = {}
-    for i in range(batch_size):
-        batch_mask = coors[:, 0] == i
-        inds_curt_to_next[i] = torch.argsort(hil_inds[batch_mask])
-        inds_next_to_curt[i] = torch.argsort(inds_curt_to_next[i])
-        # inds_next_to_curt[name] = torch.argsort(inds_curt_to_next[name])
+    inds_curt_to_next, inds_next_to_curt = get_batch_sort_index(coors, batch_size, hil_inds, key_bits)
 
     index_info = {}
     index_info['inds_curt_to_next'] = inds_curt_to_next
@@ -32,11 +113,13 @@ def get_hilbert_index_3d_mamba_lite(template, coors, batch_size, z_dim, hilbert_
 
 
 
-def get_hilbert_index_2d_mamba_lite(template, coors, batch_size, hilbert_spatial_size, shift=(0, 0), debug=True):
+def get_hilbert_index_2d_mamba_lite(template, coors, batch_size, hilbert_spatial_size, shift=(0, 0), debug=True,
+                                    key_bits=None):
     '''
     coors: (b, z, y, x)
     shift: (shift_z, shift_y, shift_x)
     hilbert_spatial_size: [z, y, x]
+    key_bits: bit length of template.max(), precomputed when the template is loaded, derived here if None
     '''
     # new 3D
     _, hil_size_y, hil_size_x = hilbert_spatial_size
@@ -48,14 +131,10 @@ def get_hilbert_index_2d_mamba_lite(template, coors, batch_size, hilbert_spatial
     # flat_coors = (z * hil_size_y * hil_size_x + y * hil_size_x + x).long()
     flat_coors = (y * hil_size_x + x).long()
     hil_inds = template[flat_coors].long()
+    if key_bits is None:
+        key_bits = int(template.max()).bit_length()
 
-    inds_curt_to_next = {}
-    inds_next_to_curt = {}
-    for i in range(batch_size):
-        batch_mask = coors[:, 0] == i
-        inds_curt_to_next[i] = torch.argsort(hil_inds[batch_mask])
-        inds_next_to_curt[i] = torch.argsort(inds_curt_to_next[i])
-        # inds_next_to_curt[name] = torch.argsort(inds_curt_to_next[name])
+    inds_curt_to_next, inds_next_to_curt = get_batch_sort_index(coors, batch_size, hil_inds, key_bits)
 
     index_info = {}
     index_info['inds_curt_to_next'] = inds_curt_to_next
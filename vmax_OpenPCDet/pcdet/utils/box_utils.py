@@ -1,3 +1,4 @@
+import numba
 import numpy as np
 import scipy
 import torch
@@ -131,6 +132,110 @@ def remove_points_in_boxes3d(points, boxes3d):
     return points.numpy() if is_numpy else points
 
 
+@numba.jit(nopython=True)
+def _points_in_boxes_kernel(points, boxes, box_idxs_of_pts, margin):
+    num_boxes = boxes.shape[0]
+    cos_rz, sin_rz, radius_sq = np.empty(num_boxes), np.empty(num_boxes), np.empty(num_boxes)
+    for k in range(num_boxes):
+        cos_rz[k], sin_rz[k] = np.cos(-boxes[k, 6]), np.sin(-boxes[k, 6])
+        radius_sq[k] = ((boxes[k, 3] / 2.0 + margin) ** 2 + (boxes[k, 4] / 2.0 + margin) ** 2)
+    for i in range(points.shape[0]):
+        x, y, z = points[i, 0], points[i, 1], points[i, 2]
+        for k in range(num_boxes):
+            cx, cy, cz = boxes[k, 0], boxes[k, 1], boxes[k, 2]
+            dx, dy, dz = boxes[k, 3], boxes[k, 4], boxes[k, 5]
+            if abs(z - cz) > dz / 2.0 or (x - cx) ** 2 + (y - cy) ** 2 > radius_sq[k]:
+                continue
+            cosa, sina = cos_rz[k], sin_rz[k]
+            local_x = (x - cx) * cosa - (y - cy) * sina
+            local_y = (x - cx) * sina + (y - cy) * cosa
+            if abs(local_x) < dx / 2.0 + margin and abs(local_y) < dy / 2.0 + margin:
+                box_idxs_of_pts[i] = k
+                break
+
+
+def points_in_boxes_numba(points, boxes, margin=1e-5):
+    """
+    CPU counterpart of roiaware_pool3d_utils.points_in_boxes_gpu that needs neither CUDA nor the compiled ops
+    Args:
+        points: (num_points, 3 + C)
+        boxes: (N, 7 + C) [x, y, z, dx, dy, dz, heading, ...], (x, y, z) is the box center
+        margin: tolerance added to the half extents in x and y, 1e-5 like points_in_boxes_gpu,
+            1e-2 like points_in_boxes_cpu
+
+    Returns:
+        box_idxs_of_pts: (num_points), index of the first box containing each point, -1 for background
+    """
+    points = np.ascontiguousarray(points[:, 0:3], dtype=np.float32)
+    boxes = np.ascontiguousarray(boxes[:, 0:7], dtype=np.float32)
+    box_idxs_of_pts = np.full(points.shape[0], -1, dtype=np.int64)
+    _points_in_boxes_kernel(points, boxes, box_idxs_of_pts, margin)
+    return box_idxs_of_pts
+
+
+@numba.jit(nopython=True)
+def _bev_corners_separated(corners_a, corners_b, margin):
+    # separating axis test on the two edge normals of corners_a
+    for e in range(2):
+        axis_x = corners_a[e + 1, 1] - corners_a[e, 1]
+        axis_y = corners_a[e, 0] - corners_a[e + 1, 0]
+        min_a = max_a = corners_a[0, 0] * axis_x + corners_a[0, 1] * axis_y
+        min_b = max_b = corners_b[0, 0] * axis_x + corners_b[0, 1] * axis_y
+        for k in range(1, 4):
+            proj_a = corners_a[k, 0] * axis_x + corners_a[k, 1] * axis_y
+            proj_b = corners_b[k, 0] * axis_x + corners_b[k, 1] * axis_y
+            min_a, max_a = min(min_a, proj_a), max(max_a, proj_a)
+            min_b, max_b = min(min_b, proj_b), max(max_b, proj_b)
+        scaled_margin = margin * np.sqrt(axis_x * axis_x + axis_y * axis_y)
+        if max_a <= min_b + scaled_margin or max_b <= min_a + scaled_margin:
+            return True
+    return False
+
+
+@numba.jit(nopython=True)
+def _bev_overlap_kernel(corners, x_min, y_min, x_max, y_max, order, overlaps, margin):
+    # sweep and prune along x: only pairs whose axis-aligned extents intersect reach the exact test
+    num_boxes = order.shape[0]
+    for a in range(num_boxes):
+        i = order[a]
+        for b in range(a + 1, num_boxes):
+            j = order[b]
+            if x_min[j] >= x_max[i]:
+                break
+            if y_min[j] >= y_max[i] or y_min[i] >= y_max[j]:
+                continue
+            if _bev_corners_separated(corners[i], corners[j], margin) or \
+                    _bev_corners_separated(corners[j], corners[i], margin):
+                continue
+            overlaps[i, j] = overlaps[j, i] = True
+
+
+def boxes_bev_overlap_numba(boxes, margin=1e-5):
+    """
+    Pairwise BEV collision test, equivalent to boxes_bev_iou_cpu(boxes, boxes) > 0 without the compiled ops
+    Args:
+        boxes: (N, 7 + C) [x, y, z, dx, dy, dz, heading, ...]
+        margin: overlaps thinner than this are treated as touching
+
+    Returns:
+        overlaps: (N, N) bool, False on the diagonal
+    """
+    boxes = boxes[:, 0:7].astype(np.float32).astype(np.float64)
+    template = np.array([[1, 1], [1, -1], [-1, -1], [-1, 1]], dtype=np.float64) / 2
+    local_corners = boxes[:, None, 3:5] * template[None, :, :]
+    cosa, sina = np.cos(boxes[:, 6:7]), np.sin(boxes[:, 6:7])
+    corners = np.stack((
+        local_corners[:, :, 0] * cosa - local_corners[:, :, 1] * sina + boxes[:, 0:1],
+        local_corners[:, :, 0] * sina + local_corners[:, :, 1] * cosa + boxes[:, 1:2],
+    ), axis=-1)
+    x_min, y_min = corners[:, :, 0].min(axis=1), corners[:, :, 1].min(axis=1)
+    x_max, y_max = corners[:, :, 0].max(axis=1), corners[:, :, 1].max(axis=1)
+    order = np.argsort(x_min, kind='stable')
+    overlaps = np.zeros((boxes.shape[0], boxes.shape[0]), dtype=np.bool_)
+    _bev_overlap_kernel(np.ascontiguousarray(corners), x_min, y_min, x_max, y_max, order, overlaps, margin)
+    return overlaps
+
+
 def boxes3d_kitti_camera_to_lidar(boxes3d_camera, calib):
     """
     Args:
@@ -0,0 +1,278 @@
+import json
+import os
+import pickle
+import shutil
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+import numpy as np
+
+COLUMNAR_INFOS_FORMAT = 1
+
+
+class ColumnarInfos(Sequence):
+    """
+    Read-only columnar storage of a list of info dicts. Each key is kept in flat NumPy arrays, so a saved store is
+    memory-mapped and shared by all dataloader workers through the page cache instead of being unpickled and copied
+    into every process. Indexing returns a lightweight InfoView that reads the columns on access.
+
+    Column kinds:
+        fixed: values of one shape and dtype stacked into (N, ...), strings as bytes, None allowed for arrays
+        ragged: arrays with a variable first dim (gt_boxes, gt_names, ...) concatenated, with (N + 1) offsets
+        records: lists of dicts (sweeps) stored as a nested ColumnarInfos, with (N + 1) offsets
+        pickled: anything else (e.g. the nested cams dicts), pickled per row into a uint8 buffer, with (N + 1) offsets
+    """
+    def __init__(self, schema, columns, indices=None, path=None):
+        self.schema = schema
+        self.columns = columns
+        self.indices = indices
+        self.path = path
+        self._num_rows = len(columns['__rows__'])
+
+    @classmethod
+    def from_infos(cls, infos):
+        keys = []
+        for info in infos:
+            keys.extend([key for key in info.keys() if key not in keys])
+
+        schema, columns = {}, {'__rows__': np.zeros(len(infos), dtype=np.uint8)}
+        for key in keys:
+            values = [info.get(key, None) for info in infos]
+            schema[key] = _infer_kind(values)
+            columns.update(_build_column(key, schema[key], values))
+        return cls(schema, columns)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, column in self.columns.items():
+            if isinstance(column, ColumnarInfos):
+                column.save(path / name)
+            else:
+                np.save(str(path / (name + '.npy')), column)
+        with open(path / 'schema.json', 'w') as f:
+            json.dump({'format': COLUMNAR_INFOS_FORMAT, 'schema': self.schema}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        path = Path(path)
+        with open(path / 'schema.json', 'r') as f:
+            schema = json.load(f)['schema']
+        columns = {}
+        for name in ['__rows__'] + [key + suffix for key in schema for suffix in _column_suffixes(schema[key])]:
+            if (path / name).is_dir():
+                columns[name] = cls.load(path / name, mmap_mode=mmap_mode)
+            else:
+                columns[name] = np.load(str(path / (name + '.npy')), mmap_mode=mmap_mode)
+        return cls(schema, columns, path=path)
+
+    def take(self, indices):
+        """
+        Returns a store that shares the columns and holds the given rows, e.g. for resampling.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.indices is not None:
+            indices = self.indices[indices]
+        return ColumnarInfos(self.schema, self.columns, indices=indices, path=self.path)
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        # saved stores are mapped again in the receiving process instead of pickling the columns
+        if self.path is not None:
+            d['columns'] = None
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        if self.columns is None:
+            self.columns = ColumnarInfos.load(self.path).columns
+
+    def __len__(self):
+        return self._num_rows if self.indices is None else len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('info index %d out of range' % index)
+        return InfoView(self, int(index if self.indices is None else self.indices[index]))
+
+    def get_value(self, row, key):
+        kind = self.schema[key]
+        if kind == 'fixed':
+            value = self.columns[key][row]
+            if isinstance(value, np.bytes_):
+                return value.decode()
+            if isinstance(value, np.ndarray):
+                return value.view(np.ndarray)
+            return value.item()
+        if kind == 'fixed_optional':
+            return self.columns[key][row].view(np.ndarray) if self.columns[key + '.mask'][row] else None
+        start, end = self.columns[key + '.offsets'][row:row + 2]
+        if kind == 'ragged':
+            return self.columns[key][start:end].view(np.ndarray)
+        if kind == 'records':
+            return RecordsView(self.columns[key], int(start), int(end))
+        if kind == 'pickled':
+            return pickle.loads(self.columns[key][start:end].tobytes())
+        raise ValueError('unknown column kind %s' % kind)
+
+
+class InfoView(Mapping):
+    """
+    Dict-like view of one info of a ColumnarInfos. Arrays are read-only views, copy them before modifying.
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        if key not in self.store.schema:
+            raise KeyError(key)
+        return self.store.get_value(self.row, key)
+
+    def __contains__(self, key):
+        # optional keys are stored as None for the infos that lack them, like the dicts this replaces
+        return key in self.store.schema and self.store.get_value(self.row, key) is not None
+
+    def __iter__(self):
+        return iter(self.store.schema)
+
+    def __len__(self):
+        return len(self.store.schema)
+
+    def __repr__(self):
+        return 'InfoView(%s)' % dict(self)
+
+
+class RecordsView(Sequence):
+    __slots__ = ('store', 'start', 'end')
+
+    def __init__(self, store, start, end):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[k] for k in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index %d out of range' % index)
+        return InfoView(self.store, self.start + index)
+
+
+def _column_suffixes(kind):
+    return {
+        'fixed': [''], 'fixed_optional': ['', '.mask'], 'ragged': ['', '.offsets'],
+        'records': ['', '.offsets'], 'pickled': ['', '.offsets'],
+    }[kind]
+
+
+def _infer_kind(values):
+    present = [x for x in values if x is not None]
+    if len(present) == 0:
+        return 'pickled'
+    if all(isinstance(x, np.ndarray) for x in present):
+        if len(set((x.dtype.kind, x.shape) for x in present)) == 1 and present[0].dtype.kind != 'O':
+            return 'fixed' if len(present) == len(values) else 'fixed_optional'
+        # empty arrays are often created without a dtype, so only the non-empty ones decide it
+        non_empty = [x for x in present if x.size > 0] or present
+        if len(present) == len(values) and all(x.ndim > 0 for x in values) and \
+                len(set(x.shape[1:] for x in values)) == 1 and len(set(x.dtype.kind for x in non_empty)) == 1 and \
+                non_empty[0].dtype.kind != 'O':
+            return 'ragged'
+    elif len(present) == len(values):
+        if all(isinstance(x, str) for x in values) or \
+                all(isinstance(x, (bool, int, float, np.number, np.bool_)) for x in values):
+            return 'fixed'
+        if all(isinstance(x, list) and all(isinstance(r, dict) for r in x) for x in values):
+            return 'records'
+    return 'pickled'
+
+
+def _build_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _build_column(key, kind, values):
+    if kind == 'fixed':
+        if isinstance(values[0], str):
+            try:
+                return {key: np.array([x.encode('ascii') for x in values])}
+            except UnicodeEncodeError:
+                return {key: np.array(values)}
+        return {key: np.stack(values) if isinstance(values[0], np.ndarray) else np.array(values)}
+    if kind == 'fixed_optional':
+        template = next(x for x in values if x is not None)
+        mask = np.array([x is not None for x in values])
+        column = np.zeros((len(values),) + template.shape, dtype=template.dtype)
+        column[mask] = np.stack([x for x in values if x is not None])
+        return {key: column, key + '.mask': mask}
+    if kind == 'ragged':
+        dtype = np.result_type(*([x for x in values if x.size > 0] or values))
+        return {
+            key: np.concatenate([x.astype(dtype, copy=False) for x in values], axis=0),
+            key + '.offsets': _build_offsets([len(x) for x in values])
+        }
+    if kind == 'records':
+        return {
+            key: ColumnarInfos.from_infos([record for x in values for record in x]),
+            key + '.offsets': _build_offsets([len(x) for x in values])
+        }
+    buffers = [np.frombuffer(pickle.dumps(x), dtype=np.uint8) for x in values]
+    return {key: np.concatenate(buffers), key + '.offsets': _build_offsets([len(x) for x in buffers])}
+
+
+def load_columnar_infos(info_paths, cache_dir, logger=None):
+    """
+    Loads the info pkl files as one memory-mapped ColumnarInfos, converting them once into cache_dir.
+    Args:
+        info_paths: list of info pkl files, concatenated in order
+        cache_dir: directory of the converted store, rebuilt when the pkl files change
+        logger:
+
+    Returns:
+        infos: ColumnarInfos
+    """
+    cache_dir = Path(cache_dir)
+    manifest = {
+        'format': COLUMNAR_INFOS_FORMAT,
+        'sources': [[str(p), os.path.getmtime(p), os.path.getsize(p)] for p in info_paths]
+    }
+    manifest_path = cache_dir / 'manifest.json'
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            if json.load(f) == manifest:
+                return ColumnarInfos.load(cache_dir)
+
+    if logger is not None:
+        logger.info('Converting infos to columnar format: %s' % cache_dir)
+    infos = []
+    for info_path in info_paths:
+        with open(info_path, 'rb') as f:
+            infos.extend(pickle.load(f))
+
+    # write to a temporary directory first so that concurrent processes never map a partial store
+    tmp_dir = cache_dir.parent / ('%s.tmp%d' % (cache_dir.name, os.getpid()))
+    ColumnarInfos.from_infos(infos).save(tmp_dir)
+    with open(tmp_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f)
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # another process has just published the same store
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return ColumnarInfos.load(cache_dir)
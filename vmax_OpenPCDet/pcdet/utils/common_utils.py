@@ -4,7 +4,6 @@ import pickle
 import random
 import shutil
 import subprocess
-import SharedArray
 
 import numpy as np
 import torch
@@ -271,6 +270,8 @@ def generate_voxel2pinds(sparse_tensor):
 
 
 def sa_create(name, var):
+    import SharedArray
+
     x = SharedArray.create(name, var.shape, dtype=var.dtype)
     x[...] = var[...]
     x.flags.writeable = False
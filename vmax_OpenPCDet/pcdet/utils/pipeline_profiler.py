@@ -0,0 +1,119 @@
+from functools import partial
+
+import numpy as np
+
+# latency histogram bins in ms, 10 per decade from 1 us to 100 s
+HISTOGRAM_EDGES_MS = np.logspace(-3, 5, 81)
+
+
+def get_stage_name(stage):
+    """
+    Name of an augmentor or processor stage, either a bound method wrapped by partial or a callable object.
+    """
+    if isinstance(stage, partial):
+        return stage.func.__name__
+    return type(stage).__name__
+
+
+class PipelineProfiler(object):
+    """
+    Per-stage latency histograms of the data pipeline.
+
+    With DATA_CONFIG.PROFILE_PIPELINE, each sample carries a 'stage_times' dict of {stage name: seconds} that is filled
+    in the dataloader workers (loading, DataAugmentor and DataProcessor stages, ...) and collated into a list per
+    batch, so the histograms are collected in the main process for all the workers and merged across ranks by
+    all_reduce().
+    """
+    def __init__(self):
+        self.stages = {}
+
+    def reset(self):
+        self.stages = {}
+
+    def _get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                'counts': np.zeros(len(HISTOGRAM_EDGES_MS) + 1, dtype=np.int64),
+                'sum': 0.0, 'sum_squares': 0.0, 'min': np.inf, 'max': 0.0
+            }
+        return self.stages[name]
+
+    def update(self, stage_times):
+        """
+        Args:
+            stage_times: list of {stage name: seconds}, e.g. batch['stage_times']
+        """
+        for cur_times in stage_times:
+            for name, seconds in cur_times.items():
+                stage = self._get_stage(name)
+                ms = seconds * 1000
+                stage['counts'][np.searchsorted(HISTOGRAM_EDGES_MS, ms, side='right')] += 1
+                stage['sum'] += ms
+                stage['sum_squares'] += ms * ms
+                stage['min'] = min(stage['min'], ms)
+                stage['max'] = max(stage['max'], ms)
+
+    def merge(self, other_stages):
+        for name, other in other_stages.items():
+            stage = self._get_stage(name)
+            stage['counts'] += other['counts']
+            stage['sum'] += other['sum']
+            stage['sum_squares'] += other['sum_squares']
+            stage['min'] = min(stage['min'], other['min'])
+            stage['max'] = max(stage['max'], other['max'])
+
+    def all_reduce(self):
+        """
+        Merges the histograms of all ranks, every rank has to call it.
+        """
+        from . import commu_utils
+        gathered = commu_utils.all_gather(self.stages)
+        if len(gathered) > 1:
+            self.reset()
+            for cur_stages in gathered:
+                self.merge(cur_stages)
+
+    @staticmethod
+    def _percentile(counts, q):
+        # interpolated inside the log-spaced bin, the under- and overflow bins are clamped to the outer edges
+        target = q / 100 * counts.sum()
+        idx = int(np.searchsorted(np.cumsum(counts), target, side='left'))
+        if idx == 0:
+            return HISTOGRAM_EDGES_MS[0]
+        if idx == len(HISTOGRAM_EDGES_MS):
+            return HISTOGRAM_EDGES_MS[-1]
+        frac = (target - counts[:idx].sum()) / max(counts[idx], 1)
+        low, high = np.log(HISTOGRAM_EDGES_MS[idx - 1]), np.log(HISTOGRAM_EDGES_MS[idx])
+        return float(np.exp(low + frac * (high - low)))
+
+    def summary(self):
+        """
+        Returns:
+            {stage name: {count, mean_ms, p50_ms, p95_ms, p99_ms, min_ms, max_ms}}, sorted by the total time
+        """
+        ret = {}
+        for name, stage in sorted(self.stages.items(), key=lambda x: -x[1]['sum']):
+            count = int(stage['counts'].sum())
+            if count == 0:
+                continue
+            ret[name] = {
+                'count': count, 'mean_ms': stage['sum'] / count,
+                'p50_ms': self._percentile(stage['counts'], 50),
+                'p95_ms': self._percentile(stage['counts'], 95),
+                'p99_ms': self._percentile(stage['counts'], 99),
+                'min_ms': stage['min'], 'max_ms': stage['max'],
+            }
+        return ret
+
+    def log_to_tensorboard(self, tb_log, step):
+        for name, stats in self.summary().items():
+            stage = self.stages[name]
+            for key in ['mean_ms', 'p50_ms', 'p95_ms']:
+                tb_log.add_scalar('data_pipeline/%s/%s' % (name, key), stats[key], step)
+            # the overflow bin is merged into the last bin to keep the limits finite
+            counts = np.concatenate([stage['counts'][:-2], [stage['counts'][-2:].sum()]])
+            tb_log.add_histogram_raw(
+                'data_pipeline/%s' % name, min=stats['min_ms'], max=stats['max_ms'], num=stats['count'],
+                sum=stage['sum'], sum_squares=stage['sum_squares'],
+                bucket_limits=HISTOGRAM_EDGES_MS.tolist(), bucket_counts=counts.tolist(), global_step=step
+            )
@@ -0,0 +1,53 @@
+import _init_path
+import argparse
+import time
+
+import numpy as np
+
+from pcdet.datasets.dataset import DatasetTemplate
+from pcdet.datasets.processor.data_processor import NumbaVoxelGenerator
+from pcdet.utils import common_utils
+from eval_voxelization_time import generate_cloud
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--batch_size', type=int, default=8, help='number of samples per batch')
+    parser.add_argument('--num_points', type=int, default=300000, help='number of points per synthetic cloud')
+    parser.add_argument('--max_range', type=float, default=300.0, help='max range of the synthetic clouds in meters')
+    parser.add_argument('--num_batches', type=int, default=20, help='number of batches to time')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_config()
+    logger = common_utils.create_logger()
+
+    rng = np.random.RandomState(0)
+    voxel_generator = NumbaVoxelGenerator(
+        vsize_xyz=[0.2, 0.2, 0.2], coors_range_xyz=[-84, -300, -5, 300, 300, 3], num_point_features=5,
+        max_num_points_per_voxel=10, max_num_voxels=200000
+    )
+    batch_list = []
+    for k in range(args.batch_size):
+        points = generate_cloud(rng, args.num_points, args.max_range)
+        voxels, coordinates, num_points = voxel_generator.generate(points)
+        batch_list.append({
+            'points': points, 'voxels': voxels, 'voxel_coords': coordinates, 'voxel_num_points': num_points,
+            'gt_boxes': rng.randn(rng.randint(1, 150), 10).astype(np.float32), 'use_lead_xyz': True,
+            'frame_id': '%06d' % k, 'metadata': {'token': '%06d' % k},
+        })
+
+    times = []
+    for _ in range(args.num_batches):
+        start_time = time.time()
+        DatasetTemplate.collate_batch(batch_list)
+        times.append((time.time() - start_time) * 1000)
+    times = np.array(times)
+    logger.info('collate_batch of %d clouds with %d points: mean %.2f ms, p50 %.2f ms, p95 %.2f ms' % (
+        args.batch_size, args.num_points, times.mean(), np.percentile(times, 50), np.percentile(times, 95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import _init_path
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import tqdm
+
+from pcdet.config import cfg, cfg_from_list, cfg_from_yaml_file
+from pcdet.datasets import build_dataloader
+from pcdet.datasets.augmentor.database_sampler import DataBaseSampler
+from pcdet.utils import common_utils
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--cfg_file', type=str, default=None, help='specify the config for training')
+    parser.add_argument('--num_samples', type=int, default=500, help='number of training samples to time')
+    parser.add_argument('--set', dest='set_cfgs', default=None, nargs=argparse.REMAINDER,
+                        help='set extra config keys if needed')
+
+    args = parser.parse_args()
+
+    cfg_from_yaml_file(args.cfg_file, cfg)
+    cfg.TAG = Path(args.cfg_file).stem
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs, cfg)
+
+    np.random.seed(1024)
+    return args, cfg
+
+
+class TimedSampler(object):
+    def __init__(self, db_sampler, time_meter, num_sampled_meter):
+        self.db_sampler = db_sampler
+        self.time_meter = time_meter
+        self.num_sampled_meter = num_sampled_meter
+
+    def __call__(self, data_dict):
+        num_boxes = data_dict['gt_boxes_mask'].sum()
+        start_time = time.time()
+        data_dict = self.db_sampler(data_dict)
+        self.time_meter.update((time.time() - start_time) * 1000)
+        self.num_sampled_meter.update(data_dict['gt_boxes'].shape[0] - num_boxes)
+        return data_dict
+
+
+def main():
+    args, cfg = parse_config()
+    logger = common_utils.create_logger()
+
+    train_set, _, _ = build_dataloader(
+        dataset_cfg=cfg.DATA_CONFIG,
+        class_names=cfg.CLASS_NAMES,
+        batch_size=1, dist=False, workers=0, logger=logger, training=True
+    )
+
+    time_meter = common_utils.AverageMeter()
+    num_sampled_meter = common_utils.AverageMeter()
+    queue = train_set.data_augmentor.data_augmentor_queue
+    sampler_idx = [k for k, x in enumerate(queue) if isinstance(x, DataBaseSampler)]
+    assert len(sampler_idx) > 0, 'gt_sampling is not enabled in %s' % args.cfg_file
+    for k in sampler_idx:
+        queue[k] = TimedSampler(queue[k], time_meter, num_sampled_meter)
+
+    num_samples = min(args.num_samples, len(train_set))
+    sample_times = []
+    for idx in tqdm.tqdm(np.random.permutation(len(train_set))[:num_samples], desc='gt_sampling', dynamic_ncols=True):
+        last_sum = time_meter.sum
+        train_set[idx]
+        sample_times.append(time_meter.sum - last_sum)
+
+    sample_times = np.array(sample_times)
+    logger.info('GT sampling over %d samples: mean %.2f ms, p50 %.2f ms, p95 %.2f ms, %.1f objects pasted per sample' % (
+        num_samples, sample_times.mean(), np.percentile(sample_times, 50), np.percentile(sample_times, 95),
+        num_sampled_meter.avg))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import _init_path
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import tqdm
+
+from pcdet.config import cfg, cfg_from_list, cfg_from_yaml_file
+from pcdet.datasets import build_dataloader
+from pcdet.utils import common_utils
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--cfg_file', type=str, default=None, help='specify the config for training')
+    parser.add_argument('--num_samples', type=int, default=500, help='number of samples to load per path')
+    parser.add_argument('--set', dest='set_cfgs', default=None, nargs=argparse.REMAINDER,
+                        help='set extra config keys if needed')
+
+    args = parser.parse_args()
+
+    cfg_from_yaml_file(args.cfg_file, cfg)
+    cfg.TAG = Path(args.cfg_file).stem
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs, cfg)
+
+    return args, cfg
+
+
+def time_loading(dataset, sample_indices, max_sweeps, desc):
+    np.random.seed(1024)
+    start_time = time.time()
+    for idx in tqdm.tqdm(sample_indices, desc=desc, dynamic_ncols=True):
+        dataset.get_lidar_with_sweeps(idx, max_sweeps=max_sweeps)
+    return len(sample_indices) / (time.time() - start_time)
+
+
+def main():
+    args, cfg = parse_config()
+    logger = common_utils.create_logger()
+
+    train_set, _, _ = build_dataloader(
+        dataset_cfg=cfg.DATA_CONFIG,
+        class_names=cfg.CLASS_NAMES,
+        batch_size=1, dist=False, workers=0, logger=logger, training=True
+    )
+    assert hasattr(train_set, 'get_sweep_cache'), 'the sweep cache is only supported by NuScenesDataset'
+    assert (train_set.sweep_cache_dir / 'index.pkl').exists(), \
+        'create the sweep cache first: python -m pcdet.datasets.nuscenes.nuscenes_dataset --func create_sweep_cache'
+
+    sample_indices = np.random.RandomState(0).permutation(len(train_set.infos))[:args.num_samples]
+    max_sweeps = cfg.DATA_CONFIG.MAX_SWEEPS
+
+    train_set.use_sweep_cache = False
+    file_speed = time_loading(train_set, sample_indices, max_sweeps, 'files')
+    train_set.use_sweep_cache = True
+    cache_speed = time_loading(train_set, sample_indices, max_sweeps, 'sweep cache')
+
+    logger.info('Loading %d samples with %d sweeps: files %.1f samples/s, sweep cache %.1f samples/s (%.2fx)' % (
+        len(sample_indices), max_sweeps, file_speed, cache_speed, cache_speed / file_speed))
+
+
+if __name__ == '__main__':
+    main()
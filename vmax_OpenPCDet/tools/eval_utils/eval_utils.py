@@ -1,5 +1,10 @@
+import json
 import pickle
+import re
 import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import numpy as np
 import torch
@@ -9,6 +14,85 @@ from pcdet.models import load_data_to_gpu
 from pcdet.utils import common_utils
 
 
+class PredictionShardWriter(object):
+    """
+    Streams the det_annos of one rank to shard_dir in chunks of chunk_size samples instead of keeping them in memory.
+    Each chunk is saved as rank<rank>_<chunk>.pkl and, with convert_fn (e.g. the nuScenes result conversion), as
+    rank<rank>_<chunk>.json, both by a background thread while the evaluation continues.
+    """
+    def __init__(self, shard_dir, rank, world_size=1, chunk_size=256, convert_fn=None, max_pending_chunks=2):
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        # shards of a previous evaluation, rank 0 also removes the ones of ranks that do not exist anymore
+        for stale_path in self.shard_dir.glob('rank*_*'):
+            stale_rank = int(re.match(r'rank(\d+)_', stale_path.name).group(1))
+            if stale_rank == rank or (rank == 0 and stale_rank >= world_size):
+                stale_path.unlink()
+        self.rank = rank
+        self.chunk_size = chunk_size
+        self.convert_fn = convert_fn
+        self.max_pending_chunks = max_pending_chunks
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_chunks = deque()
+        self.annos = []
+        self.num_chunks = 0
+        self.num_samples = 0
+        self.num_objects = 0
+
+    def add(self, annos):
+        self.annos.extend(annos)
+        self.num_samples += len(annos)
+        self.num_objects += sum([len(anno['name']) for anno in annos])
+        if len(self.annos) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.annos) == 0:
+            return
+        # bound the number of chunks in memory if the conversion is slower than the inference
+        while len(self.pending_chunks) >= self.max_pending_chunks:
+            self.pending_chunks.popleft().result()
+        chunk_path = self.shard_dir / ('rank%d_%05d' % (self.rank, self.num_chunks))
+        self.pending_chunks.append(self.executor.submit(self._write_chunk, chunk_path, self.annos))
+        self.annos = []
+        self.num_chunks += 1
+
+    def _write_chunk(self, chunk_path, annos):
+        with open(str(chunk_path) + '.pkl', 'wb') as f:
+            pickle.dump(annos, f)
+        if self.convert_fn is not None:
+            with open(str(chunk_path) + '.json', 'w') as f:
+                json.dump(self.convert_fn(annos), f)
+
+    def close(self):
+        self.flush()
+        while len(self.pending_chunks) > 0:
+            self.pending_chunks.popleft().result()
+        self.executor.shutdown()
+
+
+def load_prediction_shards(shard_dir, size):
+    """
+    Loads the det_annos of the PredictionShardWriter of all ranks in the order of the dataset, as merge_results_dist.
+    """
+    rank_paths = defaultdict(list)
+    for path in sorted(Path(shard_dir).glob('rank*.pkl')):
+        rank_paths[int(re.match(r'rank(\d+)_', path.name).group(1))].append(path)
+
+    part_list = []
+    for rank in sorted(rank_paths.keys()):
+        part_list.append([])
+        for path in rank_paths[rank]:
+            with open(path, 'rb') as f:
+                part_list[-1].extend(pickle.load(f))
+
+    ordered_results = []
+    for res in zip(*part_list):
+        ordered_results.extend(list(res))
+    return ordered_results[:size]
+
+
 def statistics_info(cfg, ret_dict, metric, disp_dict):
     for cur_thresh in cfg.MODEL.POST_PROCESSING.RECALL_THRESH_LIST:
         metric['recall_roi_%s' % str(cur_thresh)] += ret_dict.get('roi_%s' % str(cur_thresh), 0)
@@ -37,6 +121,16 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
     class_names = dataset.class_names
     det_annos = []
 
+    # with STREAM_PREDICTIONS, every rank writes its predictions to its own shards instead of gathering them
+    prediction_writer = None
+    if dataset.dataset_cfg.get('STREAM_PREDICTIONS', False):
+        rank, world_size = common_utils.get_dist_info()
+        prediction_writer = PredictionShardWriter(
+            result_dir / 'prediction_shards', rank=rank, world_size=world_size,
+            chunk_size=dataset.dataset_cfg.get('STREAM_PREDICTIONS_CHUNK_SIZE', 256),
+            convert_fn=getattr(dataset, 'convert_det_annos_to_nusc_results', None)
+        )
+
     if getattr(args, 'infer_time', False):
         start_iter = int(len(dataloader) * 0.1)
         infer_time_meter = common_utils.AverageMeter()
@@ -77,7 +171,10 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
             batch_dict, pred_dicts, class_names,
             output_path=final_output_dir if args.save_to_file else None
         )
-        det_annos += annos
+        if prediction_writer is not None:
+            prediction_writer.add(annos)
+        else:
+            det_annos += annos
         if cfg.LOCAL_RANK == 0:
             progress_bar.set_postfix(disp_dict)
             progress_bar.update()
@@ -85,9 +182,16 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
     if cfg.LOCAL_RANK == 0:
         progress_bar.close()
 
+    if prediction_writer is not None:
+        prediction_writer.close()
+        metric['num_samples'] = prediction_writer.num_samples
+        metric['num_pred_objects'] = prediction_writer.num_objects
+
     if dist_test:
         rank, world_size = common_utils.get_dist_info()
-        det_annos = common_utils.merge_results_dist(det_annos, len(dataset), tmpdir=result_dir / 'tmpdir')
+        if prediction_writer is None:
+            det_annos = common_utils.merge_results_dist(det_annos, len(dataset), tmpdir=result_dir / 'tmpdir')
+        # also waits for the prediction shards of all ranks
         metric = common_utils.merge_results_dist([metric], world_size, tmpdir=result_dir / 'tmpdir')
 
     logger.info('*************** Performance of EPOCH %s *****************' % epoch_id)
@@ -113,20 +217,33 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
         ret_dict['recall/roi_%s' % str(cur_thresh)] = cur_roi_recall
         ret_dict['recall/rcnn_%s' % str(cur_thresh)] = cur_rcnn_recall
 
-    total_pred_objects = 0
-    for anno in det_annos:
-        total_pred_objects += anno['name'].__len__()
+    if prediction_writer is not None:
+        num_samples, total_pred_objects = metric['num_samples'], metric['num_pred_objects']
+    else:
+        num_samples, total_pred_objects = len(det_annos), 0
+        for anno in det_annos:
+            total_pred_objects += anno['name'].__len__()
     logger.info('Average predicted number of objects(%d samples): %.3f'
-                % (len(det_annos), total_pred_objects / max(1, len(det_annos))))
+                % (num_samples, total_pred_objects / max(1, num_samples)))
 
-    with open(result_dir / 'result.pkl', 'wb') as f:
-        pickle.dump(det_annos, f)
+    if prediction_writer is not None and hasattr(dataset, 'evaluation_from_shards'):
+        result_str, result_dict = dataset.evaluation_from_shards(
+            prediction_writer.shard_dir, class_names,
+            eval_metric=cfg.MODEL.POST_PROCESSING.EVAL_METRIC,
+            output_path=final_output_dir
+        )
+    else:
+        if prediction_writer is not None:
+            det_annos = load_prediction_shards(prediction_writer.shard_dir, len(dataset))
+        else:
+            with open(result_dir / 'result.pkl', 'wb') as f:
+                pickle.dump(det_annos, f)
 
-    result_str, result_dict = dataset.evaluation(
-        det_annos, class_names,
-        eval_metric=cfg.MODEL.POST_PROCESSING.EVAL_METRIC,
-        output_path=final_output_dir
-    )
+        result_str, result_dict = dataset.evaluation(
+            det_annos, class_names,
+            eval_metric=cfg.MODEL.POST_PROCESSING.EVAL_METRIC,
+            output_path=final_output_dir
+        )
 
     logger.info(result_str)
     ret_dict.update(result_dict)
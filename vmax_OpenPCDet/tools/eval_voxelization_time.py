@@ -0,0 +1,98 @@
+import _init_path
+import argparse
+import importlib.util
+import time
+
+import numpy as np
+
+from pcdet.datasets.processor.data_processor import NumbaVoxelGenerator, VoxelGeneratorWrapper
+from pcdet.utils import common_utils
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--num_points', type=int, default=300000, help='number of points per synthetic cloud')
+    parser.add_argument('--max_range', type=float, default=300.0, help='max range of the synthetic clouds in meters')
+    parser.add_argument('--voxel_size', type=float, nargs=3, default=[0.2, 0.2, 0.2], help='voxel size xyz')
+    parser.add_argument('--point_cloud_range', type=float, nargs=6, default=[-300, -300, -5, 300, 300, 3],
+                        help='point cloud range')
+    parser.add_argument('--max_points_per_voxel', type=int, default=10, help='max points per voxel')
+    parser.add_argument('--max_voxels', type=int, default=300000, help='max number of voxels')
+    parser.add_argument('--range_bands', type=float, nargs='*', default=[0, 1, 100, 2, 200, 4],
+                        help='flattened [min_range, scale] pairs of the range adaptive voxelizer, empty to skip it')
+    parser.add_argument('--num_clouds', type=int, default=20, help='number of clouds to time')
+    args = parser.parse_args()
+    return args
+
+
+def generate_cloud(rng, num_points, max_range):
+    # rotating lidar: 32 beams, point density falling off with the range
+    azimuth = rng.uniform(-np.pi, np.pi, num_points)
+    elevation = np.deg2rad(rng.randint(-25, 8, num_points) + rng.normal(0, 0.05, num_points))
+    distance = np.minimum(np.abs(rng.standard_cauchy(num_points)) * 10 + 1, max_range)
+    points = np.stack([
+        distance * np.cos(elevation) * np.cos(azimuth),
+        distance * np.cos(elevation) * np.sin(azimuth),
+        np.maximum(distance * np.sin(elevation), -1.8),
+        rng.uniform(0, 255, num_points),
+        np.zeros(num_points),
+    ], axis=1)
+    return points.astype(np.float32)
+
+
+def time_generator(voxel_generator, clouds, double_flip):
+    times = []
+    for points in clouds:
+        start_time = time.time()
+        voxel_generator.generate(points)
+        if double_flip and isinstance(voxel_generator, NumbaVoxelGenerator):
+            for flip_x, flip_y in [(False, True), (True, False), (True, True)]:
+                voxel_generator.generate(points, flip_x=flip_x, flip_y=flip_y)
+        elif double_flip:
+            for flip_x, flip_y in [(False, True), (True, False), (True, True)]:
+                flipped_points = points.copy()
+                flipped_points[:, 0] *= -1 if flip_x else 1
+                flipped_points[:, 1] *= -1 if flip_y else 1
+                voxel_generator.generate(flipped_points)
+        times.append((time.time() - start_time) * 1000)
+    return np.array(times)
+
+
+def main():
+    args = parse_config()
+    logger = common_utils.create_logger()
+
+    rng = np.random.RandomState(0)
+    clouds = [generate_cloud(rng, args.num_points, args.max_range) for _ in range(args.num_clouds)]
+    generator_kwargs = dict(
+        vsize_xyz=args.voxel_size, coors_range_xyz=args.point_cloud_range, num_point_features=5,
+        max_num_points_per_voxel=args.max_points_per_voxel, max_num_voxels=args.max_voxels
+    )
+    voxel_generators = {'numba': NumbaVoxelGenerator(**generator_kwargs)}
+    if importlib.util.find_spec('spconv') is not None:
+        voxel_generators['spconv'] = VoxelGeneratorWrapper(**generator_kwargs)
+    else:
+        logger.info('spconv is not installed, only timing the numba voxelizer')
+    if len(args.range_bands) > 0:
+        range_bands = np.array(args.range_bands).reshape(-1, 2).tolist()
+        voxel_generators['numba range adaptive'] = NumbaVoxelGenerator(range_bands=range_bands, **generator_kwargs)
+
+    # warm up the jit and check that the backends agree
+    outputs = {name: generator.generate(clouds[0]) for name, generator in voxel_generators.items()}
+    if 'spconv' in outputs:
+        for name, x, y in zip(['voxels', 'coordinates', 'num_points'], outputs['numba'], outputs['spconv']):
+            assert np.array_equal(x, y), '%s differ between numba and spconv' % name
+    for name, (voxels, _, num_points) in outputs.items():
+        logger.info('%s: %d voxels (%.1f MB) holding %d of %d points' % (
+            name, voxels.shape[0], voxels.nbytes / 2 ** 20, num_points.sum(), clouds[0].shape[0]))
+
+    for double_flip in [False, True]:
+        for name, voxel_generator in voxel_generators.items():
+            times = time_generator(voxel_generator, clouds, double_flip)
+            logger.info('%s%s: mean %.2f ms, p50 %.2f ms, p95 %.2f ms' % (
+                name, ' (double flip)' if double_flip else '', times.mean(), np.percentile(times, 50),
+                np.percentile(times, 95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import _init_path
+import argparse
+import time
+
+import numpy as np
+from easydict import EasyDict
+
+from pcdet.datasets.augmentor.data_augmentor import DataAugmentor
+from pcdet.utils import common_utils
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--num_points', type=int, default=300000, help='number of points per synthetic cloud')
+    parser.add_argument('--num_boxes', type=int, default=100, help='number of gt boxes per synthetic cloud')
+    parser.add_argument('--num_clouds', type=int, default=50, help='number of clouds to time')
+    args = parser.parse_args()
+    return args
+
+
+WORLD_AUG_CONFIG = {
+    'ALONG_AXIS_LIST': ['x', 'y'],
+    'WORLD_ROT_ANGLE': [-0.78539816, 0.78539816],
+    'WORLD_SCALE_RANGE': [0.9, 1.1],
+    'NOISE_TRANSLATE_STD': [0.5, 0.5, 0.5],
+}
+
+
+def time_augmentor(augmentor, clouds, boxes):
+    np.random.seed(1024)
+    elapsed = 0
+    for points, gt_boxes in zip(clouds, boxes):
+        data_dict = {'points': points.copy(), 'gt_boxes': gt_boxes.copy()}
+        start_time = time.time()
+        augmentor.forward(data_dict)
+        elapsed += time.time() - start_time
+    return sum([x.shape[0] for x in clouds]) / elapsed
+
+
+def main():
+    args = parse_config()
+    logger = common_utils.create_logger()
+
+    rng = np.random.RandomState(0)
+    clouds = [(rng.randn(args.num_points, 5) * [30, 30, 1, 1, 1]).astype(np.float32) for _ in range(args.num_clouds)]
+    boxes = [(rng.randn(args.num_boxes, 9) * [30, 30, 1, 2, 2, 1, 3, 5, 5]).astype(np.float32)
+             for _ in range(args.num_clouds)]
+
+    chain_configs = [
+        EasyDict(NAME='random_world_flip', ALONG_AXIS_LIST=WORLD_AUG_CONFIG['ALONG_AXIS_LIST']),
+        EasyDict(NAME='random_world_rotation', WORLD_ROT_ANGLE=WORLD_AUG_CONFIG['WORLD_ROT_ANGLE']),
+        EasyDict(NAME='random_world_scaling', WORLD_SCALE_RANGE=WORLD_AUG_CONFIG['WORLD_SCALE_RANGE']),
+        EasyDict(NAME='random_world_translation', NOISE_TRANSLATE_STD=WORLD_AUG_CONFIG['NOISE_TRANSLATE_STD']),
+    ]
+    fused_configs = [EasyDict(NAME='random_world_transform', **WORLD_AUG_CONFIG)]
+
+    chain_speed = time_augmentor(DataAugmentor(None, chain_configs, []), clouds, boxes)
+    fused_speed = time_augmentor(DataAugmentor(None, fused_configs, []), clouds, boxes)
+    logger.info('World augmentation of %d points: separate %.2f Mpoints/s, fused %.2f Mpoints/s (%.2fx)' % (
+        args.num_points, chain_speed / 1e6, fused_speed / 1e6, fused_speed / chain_speed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import json
 import os
 
 import torch
@@ -6,12 +7,14 @@ import time
 import glob
 from torch.nn.utils import clip_grad_norm_
 from pcdet.utils import common_utils, commu_utils
+from pcdet.utils.pipeline_profiler import PipelineProfiler
 
 
 def train_one_epoch(model, optimizer, train_loader, model_func, lr_scheduler, accumulated_iter, optim_cfg,
                     rank, tbar, total_it_each_epoch, dataloader_iter, tb_log=None, leave_pbar=False, 
                     use_logger_to_record=False, logger=None, logger_iter_interval=50, cur_epoch=None, 
-                    total_epochs=None, ckpt_save_dir=None, ckpt_save_time_interval=300, show_gpu_stat=False, use_amp=False):
+                    total_epochs=None, ckpt_save_dir=None, ckpt_save_time_interval=300, show_gpu_stat=False, use_amp=False,
+                    pipeline_profiler=None):
     if total_it_each_epoch == len(train_loader):
         dataloader_iter = iter(train_loader)
 
@@ -39,6 +42,10 @@ def train_one_epoch(model, optimizer, train_loader, model_func, lr_scheduler, ac
         data_timer = time.time()
         cur_data_time = data_timer - end
 
+        stage_times = batch.pop('stage_times', None)
+        if pipeline_profiler is not None and stage_times is not None:
+            pipeline_profiler.update(stage_times + [{'dataloader_wait': cur_data_time}])
+
         lr_scheduler.step(accumulated_iter, cur_epoch)
 
         try:
@@ -154,6 +161,10 @@ def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_
                 use_logger_to_record=False, logger=None, logger_iter_interval=None, ckpt_save_time_interval=None, show_gpu_stat=False, cfg=None):
     accumulated_iter = start_iter
 
+    # per-stage data pipeline timings, enabled by DATA_CONFIG.PROFILE_PIPELINE
+    pipeline_profiler = PipelineProfiler() if getattr(train_loader.dataset, 'profile_pipeline', False) else None
+    pipeline_profiles = []
+
     # use for disable data augmentation hook
     hook_config = cfg.get('HOOK', None) 
     augment_disable_flag = False
@@ -191,9 +202,20 @@ def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_
                 logger=logger, logger_iter_interval=logger_iter_interval,
                 ckpt_save_dir=ckpt_save_dir, ckpt_save_time_interval=ckpt_save_time_interval, 
                 show_gpu_stat=show_gpu_stat,
-                use_amp=use_amp
+                use_amp=use_amp,
+                pipeline_profiler=pipeline_profiler
             )
 
+            if pipeline_profiler is not None:
+                pipeline_profiler.all_reduce()
+                if rank == 0:
+                    if tb_log is not None:
+                        pipeline_profiler.log_to_tensorboard(tb_log, accumulated_iter)
+                    pipeline_profiles.append({'epoch': cur_epoch + 1, 'stages': pipeline_profiler.summary()})
+                    with open(ckpt_save_dir.parent / 'pipeline_profile.json', 'w') as f:
+                        json.dump(pipeline_profiles, f, indent=2)
+                pipeline_profiler.reset()
+
             # save trained model
             trained_epoch = cur_epoch + 1
             if trained_epoch % ckpt_save_interval == 0 and rank == 0:
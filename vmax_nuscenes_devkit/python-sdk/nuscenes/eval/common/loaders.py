@@ -1,13 +1,16 @@
 # nuScenes dev-kit.
 # Code written by Oscar Beijbom, 2019.
 
+import hashlib
 import json
-from typing import Dict, List, Tuple
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import tqdm
 from nuscenes import NuScenes
 from nuscenes.eval.common.data_classes import EvalBoxes
+from nuscenes.eval.detection.constants import ATTRIBUTE_NAMES, DETECTION_NAMES
 from nuscenes.eval.detection.data_classes import DetectionBox
 from nuscenes.eval.detection.utils import category_to_detection_name
 from nuscenes.eval.tracking.data_classes import TrackingBox
@@ -17,36 +20,211 @@ from nuscenes.utils.splits import create_splits_scenes, get_scenes_of_custom_spl
 from pyquaternion import Quaternion
 
 
-def load_prediction(result_path: str, max_boxes_per_sample: int, box_cls, verbose: bool = False) \
-        -> Tuple[EvalBoxes, Dict]:
+# Result files are parsed in chunks of this many characters, see _iterate_result_file.
+RESULT_CHUNK_SIZE = 1 << 20
+
+
+def _iterate_result_file(path: str, meta: Dict[str, Any], chunk_size: int = RESULT_CHUNK_SIZE) \
+        -> Iterator[Tuple[str, List[dict]]]:
     """
-    Loads object predictions from file.
-    :param result_path: Path to the .json result file provided by the user.
+    Parses a result file incrementally and yields the boxes of one sample at a time, so that neither the json text nor
+    the parsed results of the whole file have to be in memory.
+    :param path: Path to a .json result file.
+    :param meta: Dictionary the meta data of the file is stored in, under 'meta' once it is parsed.
+    :param chunk_size: Number of characters that are read at once.
+    :return: The sample tokens and serialized boxes in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buffer, pos, eof = '', 0, False
+
+        def peek() -> str:
+            # Skips whitespace and returns the next character without consuming it, '' at the end of the file.
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return buffer[pos:pos + 1]
+                buffer, pos = f.read(chunk_size), 0
+                eof = len(buffer) == 0
+
+        def expect(chars: str) -> str:
+            nonlocal pos
+            char = peek()
+            if char == '' or char not in chars:
+                raise json.JSONDecodeError('Expecting one of %r' % chars, buffer, pos)
+            pos += 1
+            return char
+
+        def decode() -> Any:
+            # A value is only complete if it is followed by a delimiter, e.g. a number cut at the end of the buffer
+            # like '12.' or '12.5e' is decoded as 12 or 12.5 and continues in the next chunk. Larger values read larger
+            # chunks, so each retry at least doubles the buffer and the total parsing time stays linear.
+            nonlocal buffer, pos, eof
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    if eof or (end < len(buffer) and buffer[end] in ',:}] \t\n\r'):
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(max(chunk_size, len(buffer) - pos))
+                buffer, pos, eof = buffer[pos:] + chunk, 0, len(chunk) == 0
+
+        def members() -> Iterator[str]:
+            # Yields the keys of an object, the caller decodes each value before the next key is parsed.
+            expect('{')
+            if peek() == '}':
+                expect('}')
+                return
+            while True:
+                key = decode()
+                expect(':')
+                yield key
+                if expect(',}') == '}':
+                    return
+
+        has_results = False
+        for key in members():
+            if key == 'results':
+                assert peek() == '{', 'Error: results must be a dict.'
+                has_results = True
+                for sample_token in members():
+                    yield sample_token, decode()
+            elif key == 'meta':
+                meta['meta'] = decode()
+            else:
+                decode()
+
+    assert has_results, 'Error: No field `results` in result file. Please note that the result format ' \
+                        'changed. See https://www.nuscenes.org/object-detection for more information.'
+
+
+def _sample_boxes_to_arrays(sample_token: str, boxes: List[dict], box_cls) -> Dict[str, np.ndarray]:
+    """
+    Converts the serialized boxes of one sample to the columns of eval_boxes_to_arrays, with the same defaults as
+    box_cls.deserialize and the same checks as the box constructors.
+    :param sample_token: The sample the boxes belong to.
+    :param boxes: The serialized boxes.
+    :param box_cls: Type of the boxes, e.g. DetectionBox or TrackingBox.
+    :return: A dictionary of column arrays without the sample tokens and counts.
+    """
+    n = len(boxes)
+    assert all(box['sample_token'] == sample_token for box in boxes), \
+        'Error: The boxes of sample %s have a different sample_token!' % sample_token
+
+    arrays = {}
+    for field, width in _CACHE_VECTOR_FIELDS.items():
+        if field == 'ego_translation':
+            values = [box.get(field, (0.0, 0.0, 0.0)) for box in boxes]
+        else:
+            values = [box[field] for box in boxes]
+        try:
+            column = np.array(values, dtype=np.float64).reshape(n, -1) if n > 0 else np.zeros((0, width))
+        except ValueError:
+            column = None
+        assert column is not None and column.shape[1] == width, \
+            'Error: %s must have %d elements!' % (field.capitalize(), width)
+        # Velocity can be NaN from our database for certain annotations.
+        assert field == 'velocity' or not np.any(np.isnan(column)), 'Error: %s may not be NaN!' % field.capitalize()
+        arrays[field] = column
+    arrays['num_pts'] = np.array([int(box['num_pts']) if 'num_pts' in box else -1 for box in boxes], dtype=np.int64)
+
+    if box_cls == DetectionBox:
+        name_field, valid_names = 'detection_name', DETECTION_NAMES
+    elif box_cls == TrackingBox:
+        # Import locally, the tracking names are only known once the TrackingConfig is created.
+        from nuscenes.eval.tracking import data_classes as tracking_data_classes
+        name_field, valid_names = 'tracking_name', tracking_data_classes.TRACKING_NAMES
+    else:
+        raise NotImplementedError('Error: Invalid box_cls %s!' % box_cls)
+
+    str_fields, float_fields = _CACHE_BOX_FIELDS[box_cls.__name__]
+    for field in str_fields:
+        values = [box[field] for box in boxes]
+        if field == name_field:
+            unknown = set(values).difference(valid_names)
+            assert len(unknown) == 0, 'Error: Unknown %s %s' % (field, unknown.pop())
+        elif field == 'attribute_name':
+            unknown = set(values).difference(ATTRIBUTE_NAMES + [''])
+            assert len(unknown) == 0, 'Error: Unknown attribute_name %s' % unknown.pop()
+        arrays[field] = np.array(values, dtype=str)
+    for field in float_fields:
+        arrays[field] = np.array([float(box[field]) if field in box else -1.0 for box in boxes], dtype=np.float64)
+        assert not np.any(np.isnan(arrays[field])), 'Error: %s may not be NaN!' % field
+
+    return arrays
+
+
+def load_prediction_arrays(result_path: Union[str, List[str]],
+                           max_boxes_per_sample: int,
+                           box_cls,
+                           sample_tokens: Optional[List[str]] = None,
+                           verbose: bool = False) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    Loads object predictions from file into the columnar layout of eval_boxes_to_arrays.
+    The files are parsed incrementally and each sample is checked and packed into typed arrays as soon as it is read,
+    so the memory needed is dominated by the packed boxes rather than the json text and its Python objects.
+    :param result_path: Path to the .json result file provided by the user, or a list of result files (e.g. shards
+        written by several processes) that are merged. Samples found in several files are taken from the first one.
     :param max_boxes_per_sample: Maximim number of boxes allowed per sample.
     :param box_cls: Type of box to load, e.g. DetectionBox or TrackingBox.
+    :param sample_tokens: Optional sample tokens to load, in this order. All of them must be in the results.
     :param verbose: Whether to print messages to stdout.
-    :return: The deserialized results and meta data.
+    :return: The packed results and meta data. The meta data is taken from the first file.
     """
+    remaining_tokens = None if sample_tokens is None else set(sample_tokens)
+    samples, meta = {}, None
+    for cur_path in ([result_path] if isinstance(result_path, str) else result_path):
+        cur_meta = {}
+        for sample_token, boxes in _iterate_result_file(cur_path, cur_meta):
+            if sample_token in samples or (remaining_tokens is not None and sample_token not in remaining_tokens):
+                continue
+            # Check that each sample has no more than x predicted boxes.
+            assert len(boxes) <= max_boxes_per_sample, \
+                "Error: Only <= %d boxes per sample allowed!" % max_boxes_per_sample
+            samples[sample_token] = _sample_boxes_to_arrays(sample_token, boxes, box_cls)
+        meta = cur_meta.get('meta') if meta is None else meta
+
+    if sample_tokens is not None:
+        missing_tokens = [sample_token for sample_token in sample_tokens if sample_token not in samples]
+        if len(missing_tokens) > 0:
+            raise KeyError(missing_tokens[0])
+    else:
+        sample_tokens = list(samples.keys())
+    if verbose:
+        print("Loaded results from {}. Found detections for {} samples.".format(result_path, len(sample_tokens)))
 
-    # Load from file and check that the format is correct.
-    with open(result_path) as f:
-        data = json.load(f)
-    assert 'results' in data, 'Error: No field `results` in result file. Please note that the result format changed.' \
-                              'See https://www.nuscenes.org/object-detection for more information.'
+    arrays = {
+        'sample_tokens': np.array(sample_tokens, dtype=str),
+        'counts': np.array([len(samples[sample_token]['num_pts']) for sample_token in sample_tokens], dtype=np.int64),
+    }
+    for field, empty_column in _sample_boxes_to_arrays('', [], box_cls).items():
+        # Pop the columns of each sample so that they are freed as soon as they are concatenated.
+        columns = [samples[sample_token].pop(field) for sample_token in sample_tokens]
+        arrays[field] = np.concatenate(columns) if len(columns) > 0 else empty_column
+
+    return arrays, meta
 
-    # Deserialize results and get meta data.
-    all_results = EvalBoxes.deserialize(data['results'], box_cls)
-    meta = data['meta']
-    if verbose:
-        print("Loaded results from {}. Found detections for {} samples."
-              .format(result_path, len(all_results.sample_tokens)))
 
-    # Check that each sample has no more than x predicted boxes.
-    for sample_token in all_results.sample_tokens:
-        assert len(all_results.boxes[sample_token]) <= max_boxes_per_sample, \
-            "Error: Only <= %d boxes per sample allowed!" % max_boxes_per_sample
+def load_prediction(result_path: Union[str, List[str]], max_boxes_per_sample: int, box_cls, verbose: bool = False) \
+        -> Tuple[EvalBoxes, Dict]:
+    """
+    Loads object predictions from file.
+    :param result_path: Path to the .json result file provided by the user, or a list of result files (e.g. shards
+        written by several processes) that are merged. Samples found in several files are taken from the first one.
+    :param max_boxes_per_sample: Maximim number of boxes allowed per sample.
+    :param box_cls: Type of box to load, e.g. DetectionBox or TrackingBox.
+    :param verbose: Whether to print messages to stdout.
+    :return: The deserialized results and meta data.
+    """
+    arrays, meta = load_prediction_arrays(result_path, max_boxes_per_sample, box_cls, verbose=verbose)
 
-    return all_results, meta
+    return eval_boxes_from_arrays(arrays, box_cls), meta
 
 
 def load_gt(nusc: NuScenes, eval_split: str, box_cls, verbose: bool = False) -> EvalBoxes:
@@ -64,9 +242,7 @@ def load_gt(nusc: NuScenes, eval_split: str, box_cls, verbose: bool = False) ->
 
     if verbose:
         print('Loading annotations for {} split from nuScenes version: {}'.format(eval_split, nusc.version))
-    # Read out all sample_tokens in DB.
-    sample_tokens_all = [s['token'] for s in nusc.sample]
-    assert len(sample_tokens_all) > 0, "Error: Database has no samples!"
+    assert len(nusc.sample) > 0, "Error: Database has no samples!"
 
     # Only keep samples from this split.
     splits = create_splits_scenes()
@@ -91,12 +267,7 @@ def load_gt(nusc: NuScenes, eval_split: str, box_cls, verbose: bool = False) ->
         assert len(nusc.sample_annotation) > 0, \
             'Error: You are trying to evaluate on the test set but you do not have the annotations!'
 
-    sample_tokens = []
-    for sample_token in sample_tokens_all:
-        scene_token = nusc.get('sample', sample_token)['scene_token']
-        scene_record = nusc.get('scene', scene_token)
-        if scene_record['name'] in splits[eval_split]:
-            sample_tokens.append(sample_token)
+    sample_tokens = get_samples_of_scenes(scene_names=splits[eval_split], nusc=nusc)
 
     all_annotations = EvalBoxes()
 
@@ -260,6 +431,77 @@ def filter_eval_boxes(nusc: NuScenes,
     return eval_boxes
 
 
+def add_center_dist_arrays(nusc: NuScenes, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Adds the center distances like add_center_dist, to boxes in the columnar layout of load_prediction_arrays.
+    :param nusc: The NuScenes instance.
+    :param arrays: The packed boxes, either GT or predictions.
+    :return: arrays with the ego_translation column replaced.
+    """
+    ego_positions = np.zeros((len(arrays['sample_tokens']), 3))
+    for ind, sample_token in enumerate(arrays['sample_tokens'].tolist()):
+        sample_rec = nusc.get('sample', sample_token)
+        sd_record = nusc.get('sample_data', sample_rec['data']['LIDAR_TOP'])
+        ego_positions[ind] = nusc.get('ego_pose', sd_record['ego_pose_token'])['translation']
+
+    arrays['ego_translation'] = arrays['translation'] - np.repeat(ego_positions, arrays['counts'], axis=0)
+    return arrays
+
+
+def filter_box_arrays(nusc: NuScenes,
+                      arrays: Dict[str, np.ndarray],
+                      max_dist: Dict[str, float],
+                      box_cls,
+                      verbose: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Applies the filtering of filter_eval_boxes to boxes in the columnar layout of load_prediction_arrays.
+    :param nusc: An instance of the NuScenes class.
+    :param arrays: The packed boxes, with center distances.
+    :param max_dist: Maps the class name to the eval distance threshold for that class.
+    :param box_cls: Type of the boxes, e.g. DetectionBox or TrackingBox.
+    :param verbose: Whether to print to stdout.
+    :return: The packed boxes that are kept.
+    """
+    class_field = 'detection_name' if box_cls == DetectionBox else 'tracking_name'
+    class_names = arrays[class_field]
+    sample_ind = np.repeat(np.arange(len(arrays['counts'])), arrays['counts'])
+
+    # Filter on distance first.
+    ego_dist = np.sqrt(np.sum(arrays['ego_translation'][:, :2] ** 2, axis=1))
+    class_max_dist = np.array([max_dist[class_name] for class_name in class_names.tolist()], dtype=np.float64)
+    keep = ego_dist < class_max_dist
+    dist_filter = int(np.sum(keep))
+
+    # Then remove boxes with zero points in them. Eval boxes have -1 points by default.
+    keep &= arrays['num_pts'] != 0
+    point_filter = int(np.sum(keep))
+
+    # Perform bike-rack filtering. Only samples with remaining bicycles or motorcycles need the bike racks.
+    is_cycle = keep & np.isin(class_names, ['bicycle', 'motorcycle'])
+    sample_tokens = arrays['sample_tokens'].tolist()
+    sample_starts = np.cumsum(arrays['counts']) - arrays['counts']
+    for ind in np.unique(sample_ind[is_cycle]).tolist():
+        sample_anns = nusc.get('sample', sample_tokens[ind])['anns']
+        bikerack_recs = [nusc.get('sample_annotation', ann) for ann in sample_anns if
+                         nusc.get('sample_annotation', ann)['category_name'] == 'static_object.bicycle_rack']
+        start = sample_starts[ind]
+        rows = start + np.flatnonzero(is_cycle[start:start + arrays['counts'][ind]])
+        for rec in bikerack_recs:
+            bikerack_box = Box(rec['translation'], rec['size'], Quaternion(rec['rotation']))
+            keep[rows[points_in_box(bikerack_box, arrays['translation'][rows].T)]] = False
+
+    if verbose:
+        print("=> Original number of boxes: %d" % len(keep))
+        print("=> After distance based filtering: %d" % dist_filter)
+        print("=> After LIDAR and RADAR points based filtering: %d" % point_filter)
+        print("=> After bike rack filtering: %d" % int(np.sum(keep)))
+
+    filtered = {field: value[keep] for field, value in arrays.items() if field not in ('sample_tokens', 'counts')}
+    filtered['sample_tokens'] = arrays['sample_tokens']
+    filtered['counts'] = np.bincount(sample_ind[keep], minlength=len(arrays['counts'])).astype(np.int64)
+    return filtered
+
+
 def _get_box_class_field(eval_boxes: EvalBoxes) -> str:
     """
     Retrieve the name of the class field in the boxes.
@@ -283,43 +525,24 @@ def _get_box_class_field(eval_boxes: EvalBoxes) -> str:
 
     return class_field
 
-def load_prediction_of_sample_tokens(result_path: str, max_boxes_per_sample: int, box_cls,
+def load_prediction_of_sample_tokens(result_path: Union[str, List[str]], max_boxes_per_sample: int, box_cls,
                                      sample_tokens: List[str], verbose: bool = False) \
         -> Tuple[EvalBoxes, Dict]:
     """
     Loads object predictions from file.
-    :param result_path: Path to the .json result file provided by the user.
+    :param result_path: Path to the .json result file provided by the user, or a list of result files that are merged
+        as in load_prediction.
     :param max_boxes_per_sample: Maximim number of boxes allowed per sample.
     :param box_cls: Type of box to load, e.g. DetectionBox or TrackingBox.
+    :param sample_tokens: The sample tokens to load, in this order. All of them must be in the results.
     :param verbose: Whether to print messages to stdout.
-    :param limit_to_split: Optional split name to filter the predictions by.
-    :param nusc: Optional NuScenes instance needed for filtering by split.
     :return: The deserialized results and meta data.
     """
+    # Samples of other splits are skipped while parsing, so they are never deserialized.
+    arrays, meta = load_prediction_arrays(result_path, max_boxes_per_sample, box_cls, sample_tokens=sample_tokens,
+                                          verbose=verbose)
 
-    # Load from file and check that the format is correct.
-    with open(result_path) as f:
-        data = json.load(f)
-    assert 'results' in data, 'Error: No field `results` in result file. Please note that the result format changed.' \
-                              'See https://www.nuscenes.org/object-detection for more information.'
-    assert isinstance(data['results'], dict), 'Error: results must be a dict.'
-
-     # Filter by sample tokens.
-    results_of_split : dict = {sample_token: data['results'][sample_token] for sample_token in sample_tokens}
-
-    # Deserialize results and get meta data.
-    boxes_of_split : EvalBoxes = EvalBoxes.deserialize(results_of_split, box_cls)
-    meta = data['meta']
-    if verbose:
-        print("Loaded results from {}. Found detections for {} samples."
-              .format(result_path, len(boxes_of_split.sample_tokens)))
-
-    # Check that each sample has no more than x predicted boxes.
-    for sample_token in boxes_of_split.sample_tokens:
-        assert len(boxes_of_split.boxes[sample_token]) <= max_boxes_per_sample, \
-            "Error: Only <= %d boxes per sample allowed!" % max_boxes_per_sample
-
-    return boxes_of_split, meta
+    return eval_boxes_from_arrays(arrays, box_cls), meta
 
 
 def load_gt_of_sample_tokens(nusc: NuScenes, sample_tokens: List[str], box_cls,
@@ -428,13 +651,179 @@ def get_samples_of_custom_split(split_name: str, nusc : NuScenes) -> List[str]:
 def get_samples_of_scenes(scene_names: List[str], nusc: NuScenes) -> List[str]:
     """Given a list of scene names, returns the sample tokens of these scenes."""
 
-    all_sample_tokens = [s['token'] for s in nusc.sample]
-    assert len(all_sample_tokens) > 0, "Error: Database has no samples!"
+    assert len(nusc.sample) > 0, "Error: Database has no samples!"
 
+    # Look up the samples through the secondary indexes instead of scanning the sample table for each scene.
     filtered_sample_tokens : List[str] = []
-    for sample_token in all_sample_tokens:
-        scene_token = nusc.get('sample', sample_token)['scene_token']
-        scene_record = nusc.get('scene', scene_token)
-        if scene_record['name'] in scene_names:
-            filtered_sample_tokens.append(sample_token)
-    return filtered_sample_tokens
+    for scene_name in set(scene_names):
+        for scene_token in nusc.field2token('scene', 'name', scene_name):
+            filtered_sample_tokens.extend(nusc.field2token('sample', 'scene_token', scene_token))
+
+    # Keep the order of the sample table.
+    return sorted(filtered_sample_tokens, key=lambda sample_token: nusc.getind('sample', sample_token))
+
+
+# Bump whenever the processing in load_gt / add_center_dist / filter_eval_boxes or the cache layout changes.
+GT_CACHE_FORMAT = 2
+
+# Columns of the GT cache that are shared by all box types and their widths.
+_CACHE_VECTOR_FIELDS = {'translation': 3, 'size': 3, 'rotation': 4, 'velocity': 2, 'ego_translation': 3}
+
+# Type specific columns of the GT cache: (string fields, float fields).
+_CACHE_BOX_FIELDS = {
+    'DetectionBox': (('detection_name', 'attribute_name'), ('detection_score',)),
+    'TrackingBox': (('tracking_id', 'tracking_name'), ('tracking_score',)),
+}
+
+
+def gt_cache_key(nusc: NuScenes,
+                 eval_split: str,
+                 box_cls,
+                 max_dist: Dict[str, float],
+                 sample_tokens: Optional[List[str]] = None) -> str:
+    """
+    Computes the key under which the prepared GT boxes of a split are cached.
+    The key changes whenever the dataset version, the scenes of the split, the mapping from categories to classes, the
+    class ranges or any table file changes.
+    :param nusc: A NuScenes instance.
+    :param eval_split: The evaluation split.
+    :param box_cls: Type of box to load, e.g. DetectionBox or TrackingBox.
+    :param max_dist: Maps the class name to the eval distance threshold for that class.
+    :param sample_tokens: Optional sample tokens of a custom split.
+    :return: A hex digest identifying the cache entry.
+    """
+    tables = sorted(f for f in os.listdir(nusc.table_root) if f.endswith('.json'))
+    table_stats = []
+    for table in tables:
+        stat = os.stat(os.path.join(nusc.table_root, table))
+        table_stats.append([table, stat.st_mtime_ns, stat.st_size])
+
+    # The class of each category, so that changes of the label mapping invalidate the cache.
+    if box_cls == DetectionBox:
+        category_to_class_name = category_to_detection_name
+    else:
+        # Import locally to avoid errors when motmetrics package is not installed.
+        from nuscenes.eval.tracking.utils import category_to_tracking_name
+        category_to_class_name = category_to_tracking_name
+    class_names = {category['name']: category_to_class_name(category['name']) for category in nusc.category}
+
+    content = {
+        'format': GT_CACHE_FORMAT,
+        'version': nusc.version,
+        'eval_split': eval_split,
+        'split_scenes': sorted(create_splits_scenes().get(eval_split, [])),
+        'box_cls': box_cls.__name__,
+        'class_names': class_names,
+        'max_dist': max_dist,
+        'tables': table_stats,
+    }
+    digest = hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8'))
+    if sample_tokens is not None:
+        digest.update('\n'.join(sample_tokens).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def load_gt_cached(nusc: NuScenes,
+                   eval_split: str,
+                   box_cls,
+                   max_dist: Dict[str, float],
+                   cache_dir: Optional[str] = None,
+                   sample_tokens: Optional[List[str]] = None,
+                   verbose: bool = False) -> EvalBoxes:
+    """
+    Loads the GT boxes of a split, adds the center distances and filters them, like load_gt, add_center_dist and
+    filter_eval_boxes in sequence. If a cache folder is given, the result is stored there in a columnar .npz file
+    and reused as long as the dataset tables, the split and the class ranges are unchanged.
+    :param nusc: A NuScenes instance.
+    :param eval_split: The evaluation split for which we load GT boxes.
+    :param box_cls: Type of box to load, e.g. DetectionBox or TrackingBox.
+    :param max_dist: Maps the class name to the eval distance threshold for that class.
+    :param cache_dir: Folder of the GT cache or None to disable caching.
+    :param sample_tokens: Sample tokens of a custom split or None to load a predefined split.
+    :param verbose: Whether to print to stdout.
+    :return: The prepared GT boxes.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        key = gt_cache_key(nusc, eval_split, box_cls, max_dist, sample_tokens=sample_tokens)
+        cache_path = os.path.join(cache_dir, 'gt_{}_{}_{}.npz'.format(nusc.version, eval_split, key))
+        if os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as arrays:
+                gt_boxes = eval_boxes_from_arrays(arrays, box_cls)
+            if verbose:
+                print('Loaded prepared ground truth of {} samples from {}'
+                      .format(len(gt_boxes.sample_tokens), cache_path))
+            return gt_boxes
+
+    if sample_tokens is None:
+        gt_boxes = load_gt(nusc, eval_split, box_cls, verbose=verbose)
+    else:
+        gt_boxes = load_gt_of_sample_tokens(nusc, sample_tokens, box_cls, verbose=verbose)
+    gt_boxes = add_center_dist(nusc, gt_boxes)
+    if verbose:
+        print('Filtering ground truth annotations')
+    gt_boxes = filter_eval_boxes(nusc, gt_boxes, max_dist, verbose=verbose)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so that concurrent evaluations never read a partial cache.
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **eval_boxes_to_arrays(gt_boxes, box_cls))
+        os.replace(tmp_path, cache_path)
+        if verbose:
+            print('Saved prepared ground truth to {}'.format(cache_path))
+
+    return gt_boxes
+
+
+def eval_boxes_to_arrays(eval_boxes: EvalBoxes, box_cls) -> Dict[str, np.ndarray]:
+    """
+    Packs boxes into flat columns, e.g. to store them in an .npz file.
+    :param eval_boxes: The boxes to pack.
+    :param box_cls: Type of the boxes, e.g. DetectionBox or TrackingBox.
+    :return: A dictionary of column arrays.
+    """
+    str_fields, float_fields = _CACHE_BOX_FIELDS[box_cls.__name__]
+    sample_tokens = eval_boxes.sample_tokens
+    boxes = eval_boxes.all
+
+    arrays = {
+        'sample_tokens': np.array(sample_tokens, dtype=str),
+        'counts': np.array([len(eval_boxes[sample_token]) for sample_token in sample_tokens], dtype=np.int64),
+        'num_pts': np.array([box.num_pts for box in boxes], dtype=np.int64),
+    }
+    for field, width in _CACHE_VECTOR_FIELDS.items():
+        arrays[field] = np.array([getattr(box, field) for box in boxes], dtype=np.float64).reshape(len(boxes), width)
+    for field in str_fields:
+        arrays[field] = np.array([getattr(box, field) for box in boxes], dtype=str)
+    for field in float_fields:
+        arrays[field] = np.array([getattr(box, field) for box in boxes], dtype=np.float64)
+
+    return arrays
+
+
+def eval_boxes_from_arrays(arrays, box_cls) -> EvalBoxes:
+    """
+    Inverse of eval_boxes_to_arrays.
+    :param arrays: A dictionary of column arrays, e.g. an opened .npz file.
+    :param box_cls: Type of the boxes, e.g. DetectionBox or TrackingBox.
+    :return: The unpacked boxes.
+    """
+    str_fields, float_fields = _CACHE_BOX_FIELDS[box_cls.__name__]
+    columns = {field: [tuple(row) for row in arrays[field].tolist()] for field in _CACHE_VECTOR_FIELDS}
+    columns['num_pts'] = arrays['num_pts'].tolist()
+    for field in str_fields + float_fields:
+        columns[field] = arrays[field].tolist()
+
+    eval_boxes = EvalBoxes()
+    start = 0
+    for sample_token, count in zip(arrays['sample_tokens'].tolist(), arrays['counts'].tolist()):
+        eval_boxes.add_boxes(sample_token, [
+            box_cls(sample_token=sample_token, **{field: values[i] for field, values in columns.items()})
+            for i in range(start, start + count)
+        ])
+        start += count
+
+    return eval_boxes
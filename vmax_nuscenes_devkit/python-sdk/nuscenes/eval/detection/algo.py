@@ -1,13 +1,15 @@
 # nuScenes dev-kit.
 # Code written by Oscar Beijbom, 2019.
 
-from typing import Callable
+import multiprocessing
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 
 from nuscenes.eval.common.data_classes import EvalBoxes
 from nuscenes.eval.common.utils import center_distance, scale_iou, yaw_diff, velocity_l2, attr_acc, cummean
-from nuscenes.eval.detection.data_classes import DetectionMetricData
+from nuscenes.eval.detection.constants import DETECTION_NAMES
+from nuscenes.eval.detection.data_classes import DetectionBoxArrays, DetectionMetricData, DetectionMetricDataList
 
 
 def accumulate(gt_boxes: EvalBoxes,
@@ -119,6 +121,416 @@ def accumulate(gt_boxes: EvalBoxes,
     if len(match_data['trans_err']) == 0:
         return DetectionMetricData.no_predictions()
 
+    return _interpolate_metric_data(tp, fp, conf, npos, match_data)
+
+
+def accumulate_columnar(gt_boxes: DetectionBoxArrays,
+                        pred_boxes: DetectionBoxArrays,
+                        class_name: str,
+                        dist_th: float,
+                        verbose: bool = False) -> DetectionMetricData:
+    """
+    Columnar version of accumulate() for the center_distance matching function.
+    Instead of scanning every GT box of a sample for every prediction, all (prediction, GT) pairs closer than dist_th
+    are found with a batched distance computation and sorted. The greedy matching then only visits these candidate
+    pairs and the TP metrics are computed on the matched arrays. The result is identical to accumulate().
+    :param gt_boxes: The packed GT boxes.
+    :param pred_boxes: The packed predicted boxes.
+    :param class_name: Class to compute AP on.
+    :param dist_th: Distance threshold for a match.
+    :param verbose: If true, print debug messages.
+    :return: The raw data for a number of metrics.
+    """
+    return accumulate_columnar_thresholds(gt_boxes, pred_boxes, class_name, [dist_th], verbose=verbose)[dist_th]
+
+
+def accumulate_columnar_thresholds(gt_boxes: DetectionBoxArrays,
+                                   pred_boxes: DetectionBoxArrays,
+                                   class_name: str,
+                                   dist_ths: List[float],
+                                   verbose: bool = False) -> Dict[float, DetectionMetricData]:
+    """
+    Runs accumulate_columnar() for several distance thresholds of the same class in one sweep.
+    The class filtering, the ranking of the predictions and the pairwise distances are computed once for the largest
+    threshold. The candidate pairs of a smaller threshold are a subset of these pairs in the same order, so only the
+    greedy matching is repeated per threshold.
+    :param gt_boxes: The packed GT boxes.
+    :param pred_boxes: The packed predicted boxes.
+    :param class_name: Class to compute AP on.
+    :param dist_ths: Distance thresholds for a match.
+    :param verbose: If true, print debug messages.
+    :return: The raw metric data for each distance threshold.
+    """
+    return _accumulate_columnar(gt_boxes, pred_boxes, class_name, dist_ths, None, verbose=verbose)[0]
+
+
+def accumulate_columnar_bins(gt_boxes: DetectionBoxArrays,
+                             pred_boxes: DetectionBoxArrays,
+                             class_name: str,
+                             dist_ths: List[float],
+                             dist_bins: List[Tuple[float, float]],
+                             verbose: bool = False) -> List[Dict[float, DetectionMetricData]]:
+    """
+    Runs accumulate_columnar_thresholds() for a set of ego distance bins, reusing a single matching pass.
+    The predictions are matched against all GT boxes once. A GT box belongs to the bin of its ego distance. A matched
+    prediction is counted in the bin of its GT box, an unmatched prediction in the bin of its own ego distance. Hence
+    matches across a bin border are neither lost nor counted twice.
+    :param gt_boxes: The packed GT boxes.
+    :param pred_boxes: The packed predicted boxes.
+    :param class_name: Class to compute AP on.
+    :param dist_ths: Distance thresholds for a match.
+    :param dist_bins: (min, max) ego distance of each bin in meters, where min is inclusive and max exclusive.
+    :param verbose: If true, print debug messages.
+    :return: For each bin, the raw metric data for each distance threshold.
+    """
+    return _accumulate_columnar(gt_boxes, pred_boxes, class_name, dist_ths, dist_bins, verbose=verbose)
+
+
+def _accumulate_columnar(gt_boxes: DetectionBoxArrays,
+                         pred_boxes: DetectionBoxArrays,
+                         class_name: str,
+                         dist_ths: List[float],
+                         dist_bins: Optional[List[Tuple[float, float]]],
+                         verbose: bool = False) -> List[Dict[float, DetectionMetricData]]:
+    """
+    Shared implementation of accumulate_columnar_thresholds() and accumulate_columnar_bins().
+    If dist_bins is None, a single unbinned result is returned.
+    """
+    class_id = DETECTION_NAMES.index(class_name)
+    nbins = 1 if dist_bins is None else len(dist_bins)
+
+    # Count the positives.
+    gt_inds = np.flatnonzero(gt_boxes.class_ids == class_id)
+    npos = len(gt_inds)
+    if verbose:
+        print("Found {} GT of class {} out of {} total across {} samples.".
+              format(npos, class_name, len(gt_boxes), len(gt_boxes.sample_tokens)))
+
+    # For missing classes in the GT, return a data structure corresponding to no predictions.
+    if npos == 0:
+        return [{dist_th: DetectionMetricData.no_predictions() for dist_th in dist_ths} for _ in range(nbins)]
+
+    pred_inds = np.flatnonzero(pred_boxes.class_ids == class_id)
+    if verbose:
+        print("Found {} PRED of class {} out of {} total across {} samples.".
+              format(len(pred_inds), class_name, len(pred_boxes), len(pred_boxes.sample_tokens)))
+
+    # Sort by confidence. Like in accumulate(), ties are resolved by descending position in the prediction list.
+    pred_inds = pred_inds[np.argsort(pred_boxes.scores[pred_inds], kind='stable')[::-1]]
+
+    # Find the candidate pairs of the largest threshold once.
+    pair_pred, pair_gt, pair_dist = _candidate_pairs(gt_boxes, gt_inds, pred_boxes, pred_inds, max(dist_ths))
+
+    # Assign the boxes to the bins once.
+    if dist_bins is not None:
+        gt_bin = _bin_index(gt_boxes.ego_dist[gt_inds], dist_bins)
+        pred_own_bin = _bin_index(pred_boxes.ego_dist[pred_inds], dist_bins)
+        bin_npos = np.bincount(gt_bin[gt_bin >= 0], minlength=nbins)
+
+    # Match the candidate pairs of each threshold.
+    metric_data = [{} for _ in range(nbins)]
+    for dist_th in dist_ths:
+        mask = pair_dist < dist_th
+        match_pair = _greedy_match(pair_pred[mask], pair_gt[mask], len(pred_inds))
+        if dist_bins is None:
+            metric_data[0][dist_th] = _columnar_metric_data(gt_boxes, pred_boxes, class_name, npos, gt_inds,
+                                                            pred_inds, pair_gt[mask], pair_dist[mask], match_pair)
+            continue
+
+        is_match = match_pair >= 0
+        pred_bin = pred_own_bin.copy()
+        pred_bin[is_match] = gt_bin[pair_gt[mask][match_pair[is_match]]]
+        for bin_ind in range(nbins):
+            if bin_npos[bin_ind] == 0:
+                metric_data[bin_ind][dist_th] = DetectionMetricData.no_predictions()
+                continue
+            in_bin = pred_bin == bin_ind
+            metric_data[bin_ind][dist_th] = _columnar_metric_data(gt_boxes, pred_boxes, class_name,
+                                                                  int(bin_npos[bin_ind]), gt_inds, pred_inds[in_bin],
+                                                                  pair_gt[mask], pair_dist[mask], match_pair[in_bin])
+
+    return metric_data
+
+
+def accumulate_classes(gt_boxes: DetectionBoxArrays,
+                       pred_boxes: DetectionBoxArrays,
+                       class_names: List[str],
+                       dist_ths: List[float],
+                       num_workers: int = 0) -> DetectionMetricDataList:
+    """
+    Builds the full metric data table with accumulate_columnar_thresholds(), optionally spreading the classes across
+    a process pool. Every worker receives the packed boxes once.
+    :param gt_boxes: The packed GT boxes.
+    :param pred_boxes: The packed predicted boxes.
+    :param class_names: Classes to compute AP on.
+    :param dist_ths: Distance thresholds for a match.
+    :param num_workers: Number of worker processes. If 0, all classes are processed in the calling process.
+    :return: The raw metric data for each class and distance threshold.
+    """
+    return _accumulate_classes(gt_boxes, pred_boxes, class_names, dist_ths, None, num_workers)[0]
+
+
+def accumulate_classes_bins(gt_boxes: DetectionBoxArrays,
+                            pred_boxes: DetectionBoxArrays,
+                            class_names: List[str],
+                            dist_ths: List[float],
+                            dist_bins: List[Tuple[float, float]],
+                            num_workers: int = 0) -> List[DetectionMetricDataList]:
+    """
+    Binned version of accumulate_classes(), see accumulate_columnar_bins().
+    :param gt_boxes: The packed GT boxes.
+    :param pred_boxes: The packed predicted boxes.
+    :param class_names: Classes to compute AP on.
+    :param dist_ths: Distance thresholds for a match.
+    :param dist_bins: (min, max) ego distance of each bin in meters, where min is inclusive and max exclusive.
+    :param num_workers: Number of worker processes. If 0, all classes are processed in the calling process.
+    :return: For each bin, the raw metric data for each class and distance threshold.
+    """
+    return _accumulate_classes(gt_boxes, pred_boxes, class_names, dist_ths, dist_bins, num_workers)
+
+
+def _accumulate_classes(gt_boxes: DetectionBoxArrays,
+                        pred_boxes: DetectionBoxArrays,
+                        class_names: List[str],
+                        dist_ths: List[float],
+                        dist_bins: Optional[List[Tuple[float, float]]],
+                        num_workers: int) -> List[DetectionMetricDataList]:
+    """ Shared implementation of accumulate_classes() and accumulate_classes_bins(). """
+    class_names = list(class_names)
+    if num_workers > 0 and len(class_names) > 1:
+        with multiprocessing.Pool(min(num_workers, len(class_names)), initializer=_init_accumulate_worker,
+                                  initargs=(gt_boxes, pred_boxes)) as pool:
+            results = pool.starmap(_accumulate_worker,
+                                   [(class_name, dist_ths, dist_bins) for class_name in class_names])
+    else:
+        results = [_accumulate_columnar(gt_boxes, pred_boxes, class_name, dist_ths, dist_bins)
+                   for class_name in class_names]
+
+    nbins = 1 if dist_bins is None else len(dist_bins)
+    metric_data_lists = [DetectionMetricDataList() for _ in range(nbins)]
+    for class_name, class_metric_data in zip(class_names, results):
+        for metric_data_list, bin_metric_data in zip(metric_data_lists, class_metric_data):
+            for dist_th in dist_ths:
+                metric_data_list.set(class_name, dist_th, bin_metric_data[dist_th])
+
+    return metric_data_lists
+
+
+# Packed boxes of a worker process in _accumulate_classes().
+_worker_boxes = None
+
+
+def _init_accumulate_worker(gt_boxes: DetectionBoxArrays, pred_boxes: DetectionBoxArrays) -> None:
+    global _worker_boxes
+    _worker_boxes = (gt_boxes, pred_boxes)
+
+
+def _accumulate_worker(class_name: str,
+                       dist_ths: List[float],
+                       dist_bins: Optional[List[Tuple[float, float]]]) -> List[Dict[float, DetectionMetricData]]:
+    gt_boxes, pred_boxes = _worker_boxes
+    return _accumulate_columnar(gt_boxes, pred_boxes, class_name, dist_ths, dist_bins)
+
+
+def _bin_index(dists: np.ndarray, dist_bins: List[Tuple[float, float]]) -> np.ndarray:
+    """
+    Assigns distances to bins.
+    :param dists: The distances to assign.
+    :param dist_bins: (min, max) of each bin, where min is inclusive and max exclusive.
+    :return: <int64: n>. The index of the first bin that contains each distance, -1 if there is none.
+    """
+    bin_ind = np.full(len(dists), -1, dtype=np.int64)
+    for i, (bin_min, bin_max) in reversed(list(enumerate(dist_bins))):
+        bin_ind[(dists >= bin_min) & (dists < bin_max)] = i
+    return bin_ind
+
+
+def _candidate_pairs(gt_boxes: DetectionBoxArrays,
+                     gt_inds: np.ndarray,
+                     pred_boxes: DetectionBoxArrays,
+                     pred_inds: np.ndarray,
+                     max_dist: float,
+                     max_pairs: int = 2 ** 22) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds all (prediction, GT) pairs of the same sample whose center distance is below max_dist.
+    :param gt_boxes: The packed GT boxes.
+    :param gt_inds: Indices of the GT boxes to consider, in ascending order.
+    :param pred_boxes: The packed predicted boxes.
+    :param pred_inds: Indices of the predictions to consider, in ranking order.
+    :param max_dist: Only pairs that are strictly closer than this are returned.
+    :param max_pairs: Maximum number of pairs whose distance is computed at once. Limits the memory usage.
+    :return: (pair_pred, pair_gt, pair_dist). Positions in pred_inds and gt_inds and the center distance of each pair,
+        sorted by prediction rank, then distance, then GT position.
+    """
+    # Map the prediction samples to GT samples. Predictions of samples without GT get no pairs.
+    if pred_boxes.sample_tokens == gt_boxes.sample_tokens:
+        pred_sample_ind = pred_boxes.sample_ind[pred_inds]
+    else:
+        token_to_ind = {sample_token: i for i, sample_token in enumerate(gt_boxes.sample_tokens)}
+        lut = np.array([token_to_ind.get(sample_token, -1) for sample_token in pred_boxes.sample_tokens],
+                       dtype=np.int64)
+        pred_sample_ind = lut[pred_boxes.sample_ind[pred_inds]]
+
+    # GT boxes are grouped by sample, so the GT of a sample form a contiguous range of gt_inds.
+    gt_counts = np.bincount(gt_boxes.sample_ind[gt_inds], minlength=len(gt_boxes.sample_tokens))
+    gt_starts = np.cumsum(gt_counts) - gt_counts
+    has_sample = pred_sample_ind >= 0
+    pred_sample_ind = np.where(has_sample, pred_sample_ind, 0)
+    pair_counts = np.where(has_sample, gt_counts[pred_sample_ind], 0)
+    pair_starts = gt_starts[pred_sample_ind]
+
+    gt_xy = gt_boxes.translation[gt_inds, :2]
+    pred_xy = pred_boxes.translation[pred_inds, :2]
+
+    pair_pred, pair_gt, pair_dist = [], [], []
+    cum_counts = np.cumsum(pair_counts)
+    start = 0
+    while start < len(pred_inds):
+        # Take as many predictions as possible without exceeding max_pairs (but at least one).
+        offset = cum_counts[start - 1] if start > 0 else 0
+        end = max(int(np.searchsorted(cum_counts, offset + max_pairs, side='right')), start + 1)
+        counts = pair_counts[start:end]
+        chunk_pred = np.repeat(np.arange(start, end), counts)
+        chunk_gt = np.repeat(pair_starts[start:end], counts) + \
+            np.arange(len(chunk_pred)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        # Same arithmetic as center_distance().
+        delta = pred_xy[chunk_pred] - gt_xy[chunk_gt]
+        chunk_dist = np.sqrt(np.sum(delta * delta, axis=1))
+        keep = chunk_dist < max_dist
+        pair_pred.append(chunk_pred[keep])
+        pair_gt.append(chunk_gt[keep])
+        pair_dist.append(chunk_dist[keep])
+        start = end
+
+    if len(pair_pred) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    pair_pred, pair_gt, pair_dist = np.concatenate(pair_pred), np.concatenate(pair_gt), np.concatenate(pair_dist)
+
+    order = np.lexsort((pair_gt, pair_dist, pair_pred))
+    return pair_pred[order], pair_gt[order], pair_dist[order]
+
+
+def _greedy_match(pair_pred: np.ndarray, pair_gt: np.ndarray, npred: int) -> np.ndarray:
+    """
+    Greedily matches each prediction, in ranking order, to the closest GT box that is not taken yet.
+    Since the candidate pairs are sorted by prediction rank, distance and GT position, the first free pair of a
+    prediction is the same match that accumulate() finds by scanning all GT boxes.
+    :param pair_pred: Prediction rank of each candidate pair.
+    :param pair_gt: GT position of each candidate pair.
+    :param npred: Number of predictions.
+    :return: <int64: npred>. Index of the matched pair for each prediction, -1 if unmatched.
+    """
+    match_pair = np.full(npred, -1, dtype=np.int64)
+    taken = set()
+    matched_pred = -1
+    for pair_ind, (pred_ind, gt_ind) in enumerate(zip(pair_pred.tolist(), pair_gt.tolist())):
+        if pred_ind == matched_pred or gt_ind in taken:
+            continue
+        taken.add(gt_ind)
+        matched_pred = pred_ind
+        match_pair[pred_ind] = pair_ind
+
+    return match_pair
+
+
+def _columnar_metric_data(gt_boxes: DetectionBoxArrays,
+                          pred_boxes: DetectionBoxArrays,
+                          class_name: str,
+                          npos: int,
+                          gt_inds: np.ndarray,
+                          pred_inds: np.ndarray,
+                          pair_gt: np.ndarray,
+                          pair_dist: np.ndarray,
+                          match_pair: np.ndarray) -> DetectionMetricData:
+    """
+    Computes the TP errors of the matched pairs and the interpolated metric data.
+    :param gt_boxes: The packed GT boxes.
+    :param pred_boxes: The packed predicted boxes.
+    :param class_name: Class to compute the metrics on.
+    :param npos: Number of GT boxes of this class.
+    :param gt_inds: Indices of the GT boxes of this class.
+    :param pred_inds: Indices of the predictions of this class in ranking order.
+    :param pair_gt: GT position of each candidate pair.
+    :param pair_dist: Center distance of each candidate pair.
+    :param match_pair: Index of the matched pair for each prediction, -1 if unmatched.
+    :return: The raw data for a number of metrics.
+    """
+    is_match = match_pair >= 0
+
+    # Check if we have any matches. If not, just return a "no predictions" array.
+    if not np.any(is_match):
+        return DetectionMetricData.no_predictions()
+
+    tp = is_match.astype(int)
+    fp = 1 - tp
+    conf = pred_boxes.scores[pred_inds]
+
+    matched_pairs = match_pair[is_match]
+    pred_match = pred_inds[is_match]
+    gt_match = gt_inds[pair_gt[matched_pairs]]
+
+    # Barrier orientation is only determined up to 180 degree. (For cones orientation is discarded later)
+    period = np.pi if class_name == 'barrier' else 2 * np.pi
+
+    match_data = {'trans_err': pair_dist[matched_pairs],
+                  'vel_err': _l2(pred_boxes.velocity[pred_match] - gt_boxes.velocity[gt_match]),
+                  'scale_err': 1 - _scale_iou(gt_boxes.size[gt_match], pred_boxes.size[pred_match]),
+                  'orient_err': np.abs(_angle_diff(gt_boxes.yaw(gt_match), pred_boxes.yaw(pred_match), period)),
+                  'attr_err': 1 - _attr_acc(gt_boxes.attribute_ids[gt_match], pred_boxes.attribute_ids[pred_match]),
+                  'conf': conf[is_match]}
+
+    return _interpolate_metric_data(tp, fp, conf, npos, match_data)
+
+
+def _l2(delta: np.ndarray) -> np.ndarray:
+    """ Row-wise version of the L2 norm used in center_distance() and velocity_l2(). """
+    return np.sqrt(np.sum(delta * delta, axis=1))
+
+
+def _scale_iou(gt_size: np.ndarray, pred_size: np.ndarray) -> np.ndarray:
+    """ Row-wise version of scale_iou(). """
+    assert np.all(gt_size > 0), 'Error: sample_annotation sizes must be >0.'
+    assert np.all(pred_size > 0), 'Error: sample_result sizes must be >0.'
+
+    min_wlh = np.minimum(gt_size, pred_size)
+    volume_annotation = np.prod(gt_size, axis=1)
+    volume_result = np.prod(pred_size, axis=1)
+    intersection = np.prod(min_wlh, axis=1)
+    union = volume_annotation + volume_result - intersection
+
+    return intersection / union
+
+
+def _angle_diff(x: np.ndarray, y: np.ndarray, period: float) -> np.ndarray:
+    """ Element-wise version of angle_diff(). """
+    diff = (x - y + period / 2) % period - period / 2
+    return np.where(diff > np.pi, diff - (2 * np.pi), diff)
+
+
+def _attr_acc(gt_attribute_ids: np.ndarray, pred_attribute_ids: np.ndarray) -> np.ndarray:
+    """ Element-wise version of attr_acc(). GT boxes without attribute get an accuracy of nan. """
+    acc = (gt_attribute_ids == pred_attribute_ids).astype(float)
+    acc[gt_attribute_ids == -1] = np.nan
+    return acc
+
+
+def _interpolate_metric_data(tp: Union[List[int], np.ndarray],
+                             fp: Union[List[int], np.ndarray],
+                             conf: Union[List[float], np.ndarray],
+                             npos: int,
+                             match_data: Dict[str, Union[List[float], np.ndarray]]) -> DetectionMetricData:
+    """
+    Accumulates the matching results and interpolates them at the predefined recall thresholds.
+    :param tp: For each prediction in ranking order, whether it is a true positive.
+    :param fp: For each prediction in ranking order, whether it is a false positive.
+    :param conf: The confidence of each prediction in ranking order.
+    :param npos: Number of GT boxes.
+    :param match_data: The TP errors and confidences of the matched predictions in ranking order.
+    :return: The raw data for a number of metrics.
+    """
+    match_data = dict(match_data)
+
     # ---------------------------------------------
     # Calculate and interpolate precision and recall
     # ---------------------------------------------
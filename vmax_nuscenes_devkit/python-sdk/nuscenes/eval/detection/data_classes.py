@@ -2,12 +2,13 @@
 # Code written by Oscar Beijbom, 2019.
 
 from collections import defaultdict
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 
 import numpy as np
+from pyquaternion import Quaternion
 
-from nuscenes.eval.common.data_classes import MetricData, EvalBox
-from nuscenes.eval.common.utils import center_distance
+from nuscenes.eval.common.data_classes import MetricData, EvalBox, EvalBoxes
+from nuscenes.eval.common.utils import center_distance, quaternion_yaw
 from nuscenes.eval.detection.constants import DETECTION_NAMES, ATTRIBUTE_NAMES, TP_METRICS
 
 
@@ -22,10 +23,14 @@ class DetectionConfig:
                  min_recall: float,
                  min_precision: float,
                  max_boxes_per_sample: int,
-                 mean_ap_weight: int):
+                 mean_ap_weight: int,
+                 dist_bins: List[Tuple[float, Optional[float]]] = ()):
 
         assert set(class_range.keys()) == set(DETECTION_NAMES), "Class count mismatch."
         assert dist_th_tp in dist_ths, "dist_th_tp must be in set of dist_ths."
+        for dist_bin in dist_bins:
+            assert len(dist_bin) == 2, "Distance bins must be given as [min, max]."
+            assert dist_bin[1] is None or dist_bin[0] < dist_bin[1], "Distance bins must have min < max."
 
         self.class_range = class_range
         self.dist_fcn = dist_fcn
@@ -35,6 +40,7 @@ class DetectionConfig:
         self.min_precision = min_precision
         self.max_boxes_per_sample = max_boxes_per_sample
         self.mean_ap_weight = mean_ap_weight
+        self.dist_bins = [list(dist_bin) for dist_bin in dist_bins]  # An open upper end is stored as None.
 
         self.class_names = self.class_range.keys()
 
@@ -54,7 +60,8 @@ class DetectionConfig:
             'min_recall': self.min_recall,
             'min_precision': self.min_precision,
             'max_boxes_per_sample': self.max_boxes_per_sample,
-            'mean_ap_weight': self.mean_ap_weight
+            'mean_ap_weight': self.mean_ap_weight,
+            'dist_bins': self.dist_bins
         }
 
     @classmethod
@@ -67,7 +74,13 @@ class DetectionConfig:
                    content['min_recall'],
                    content['min_precision'],
                    content['max_boxes_per_sample'],
-                   content['mean_ap_weight'])
+                   content['mean_ap_weight'],
+                   content.get('dist_bins', ()))
+
+    @property
+    def dist_bin_ranges(self) -> List[Tuple[float, float]]:
+        """ Return the (min, max) ego distance of each bin, with inf for an open upper end. """
+        return [(bin_min, float('inf') if bin_max is None else bin_max) for bin_min, bin_max in self.dist_bins]
 
     @property
     def dist_fcn_callable(self):
@@ -386,6 +399,139 @@ class DetectionBox(EvalBox):
                    attribute_name=content['attribute_name'])
 
 
+class DetectionBoxArrays:
+    """
+    Columnar view of an EvalBoxes instance of DetectionBoxes.
+    All boxes are packed once into flat NumPy arrays, grouped by sample in the order of EvalBoxes.sample_tokens and
+    in list order within each sample, i.e. row i corresponds to EvalBoxes.all[i].
+    """
+
+    def __init__(self,
+                 sample_tokens: List[str],
+                 sample_ind: np.ndarray,
+                 translation: np.ndarray,
+                 size: np.ndarray,
+                 rotation: np.ndarray,
+                 velocity: np.ndarray,
+                 ego_translation: np.ndarray,
+                 num_pts: np.ndarray,
+                 class_ids: np.ndarray,
+                 scores: np.ndarray,
+                 attribute_ids: np.ndarray):
+        """
+        :param sample_tokens: The sample tokens in order of their first appearance.
+        :param sample_ind: <int64: n>. Index into sample_tokens for each box.
+        :param translation: <float64: n, 3>. Box centers.
+        :param size: <float64: n, 3>. Box sizes (wlh).
+        :param rotation: <float64: n, 4>. Box orientations as quaternions.
+        :param velocity: <float64: n, 2>. Box velocities (may be NaN).
+        :param ego_translation: <float64: n, 3>. Box centers relative to the ego vehicle.
+        :param num_pts: <int64: n>. Number of LIDAR + RADAR points, -1 for predictions.
+        :param class_ids: <int64: n>. Index into DETECTION_NAMES.
+        :param scores: <float64: n>. Detection scores, -1 for GT.
+        :param attribute_ids: <int64: n>. Index into ATTRIBUTE_NAMES, -1 for boxes without attribute.
+        """
+        n = len(sample_ind)
+        assert translation.shape == (n, 3) and size.shape == (n, 3) and rotation.shape == (n, 4), \
+            'Error: Inconsistent box array shapes!'
+        assert velocity.shape == (n, 2) and ego_translation.shape == (n, 3), 'Error: Inconsistent box array shapes!'
+        assert len(num_pts) == n and len(class_ids) == n and len(scores) == n and len(attribute_ids) == n, \
+            'Error: Inconsistent box array shapes!'
+
+        self.sample_tokens = sample_tokens
+        self.sample_ind = sample_ind
+        self.translation = translation
+        self.size = size
+        self.rotation = rotation
+        self.velocity = velocity
+        self.ego_translation = ego_translation
+        self.num_pts = num_pts
+        self.class_ids = class_ids
+        self.scores = scores
+        self.attribute_ids = attribute_ids
+
+        # Yaw angles are only needed for matched boxes, so they are computed on demand and cached.
+        self._yaw = np.full(n, np.nan)
+        self._yaw_valid = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.sample_ind)
+
+    @property
+    def ego_dist(self) -> np.ndarray:
+        """ Compute the distance from each box to the ego vehicle in 2D. """
+        return np.sqrt(np.sum(self.ego_translation[:, :2] ** 2, axis=1))
+
+    def yaw(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Returns the yaw angles of a subset of boxes. Uses the same quaternion conversion as DetectionBox based code.
+        :param indices: Indices of the boxes of interest.
+        :return: <float64: len(indices)>. Yaw angles in radians.
+        """
+        missing = np.unique(indices[~self._yaw_valid[indices]])
+        for ind in missing.tolist():
+            self._yaw[ind] = quaternion_yaw(Quaternion(self.rotation[ind]))
+        self._yaw_valid[missing] = True
+        return self._yaw[indices]
+
+    @classmethod
+    def from_eval_boxes(cls, eval_boxes: EvalBoxes):
+        """
+        Packs an EvalBoxes instance of DetectionBoxes.
+        :param eval_boxes: The boxes to pack.
+        :return: A DetectionBoxArrays instance.
+        """
+        class_to_id = {name: i for i, name in enumerate(DETECTION_NAMES)}
+        attribute_to_id = {name: i for i, name in enumerate(ATTRIBUTE_NAMES)}
+        attribute_to_id[''] = -1
+
+        sample_tokens = eval_boxes.sample_tokens
+        boxes = eval_boxes.all
+        counts = [len(eval_boxes[sample_token]) for sample_token in sample_tokens]
+
+        def column(values, width: int, dtype=float) -> np.ndarray:
+            return np.array(values, dtype=dtype).reshape(len(boxes), width)
+
+        return cls(sample_tokens=sample_tokens,
+                   sample_ind=np.repeat(np.arange(len(sample_tokens), dtype=np.int64), counts),
+                   translation=column([box.translation for box in boxes], 3),
+                   size=column([box.size for box in boxes], 3),
+                   rotation=column([box.rotation for box in boxes], 4),
+                   velocity=column([box.velocity for box in boxes], 2),
+                   ego_translation=column([box.ego_translation for box in boxes], 3),
+                   num_pts=np.array([box.num_pts for box in boxes], dtype=np.int64),
+                   class_ids=np.array([class_to_id[box.detection_name] for box in boxes], dtype=np.int64),
+                   scores=np.array([box.detection_score for box in boxes], dtype=float),
+                   attribute_ids=np.array([attribute_to_id[box.attribute_name] for box in boxes], dtype=np.int64))
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]):
+        """
+        Packs DetectionBoxes that are already in the columnar layout of load_prediction_arrays, without creating a
+        DetectionBox for each of them.
+        :param arrays: The column arrays, with the sample tokens and the number of boxes per sample.
+        :return: A DetectionBoxArrays instance.
+        """
+        class_names, class_ids = np.unique(arrays['detection_name'], return_inverse=True)
+        attribute_names, attribute_ids = np.unique(arrays['attribute_name'], return_inverse=True)
+        attribute_to_id = {name: i for i, name in enumerate(ATTRIBUTE_NAMES)}
+        attribute_to_id[''] = -1
+
+        return cls(sample_tokens=arrays['sample_tokens'].tolist(),
+                   sample_ind=np.repeat(np.arange(len(arrays['counts']), dtype=np.int64), arrays['counts']),
+                   translation=arrays['translation'],
+                   size=arrays['size'],
+                   rotation=arrays['rotation'],
+                   velocity=arrays['velocity'],
+                   ego_translation=arrays['ego_translation'],
+                   num_pts=arrays['num_pts'].astype(np.int64),
+                   class_ids=np.array([DETECTION_NAMES.index(name) for name in class_names.tolist()],
+                                      dtype=np.int64)[class_ids].reshape(-1),
+                   scores=arrays['detection_score'].astype(np.float64),
+                   attribute_ids=np.array([attribute_to_id[name] for name in attribute_names.tolist()],
+                                          dtype=np.int64)[attribute_ids].reshape(-1))
+
+
 class DetectionMetricDataList:
     """ This stores a set of MetricData in a dict indexed by (name, match-distance). """
 
@@ -6,25 +6,25 @@ import json
 import os
 import random
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Tuple, Union
 
 import numpy as np
 from nuscenes import NuScenes
 from nuscenes.eval.common.config import config_factory
 from nuscenes.eval.common.data_classes import EvalBoxes
 from nuscenes.eval.common.loaders import (
-    add_center_dist,
-    filter_eval_boxes,
+    add_center_dist_arrays,
+    eval_boxes_from_arrays,
+    filter_box_arrays,
     get_samples_of_custom_split,
-    load_gt,
-    load_gt_of_sample_tokens,
-    load_prediction,
-    load_prediction_of_sample_tokens,
+    load_gt_cached,
+    load_prediction_arrays,
 )
-from nuscenes.eval.detection.algo import accumulate, calc_ap, calc_tp
+from nuscenes.eval.detection.algo import accumulate, accumulate_classes, accumulate_classes_bins, calc_ap, calc_tp
 from nuscenes.eval.detection.constants import TP_METRICS
 from nuscenes.eval.detection.data_classes import (
     DetectionBox,
+    DetectionBoxArrays,
     DetectionConfig,
     DetectionMetricDataList,
     DetectionMetrics,
@@ -56,18 +56,23 @@ class DetectionEval:
     def __init__(self,
                  nusc: NuScenes,
                  config: DetectionConfig,
-                 result_path: str,
+                 result_path: Union[str, List[str]],
                  eval_set: str,
                  output_dir: str = None,
-                 verbose: bool = True):
+                 verbose: bool = True,
+                 num_workers: int = 0,
+                 gt_cache_dir: str = None):
         """
         Initialize a DetectionEval object.
         :param nusc: A NuScenes object.
         :param config: A DetectionConfig object.
-        :param result_path: Path of the nuScenes JSON result file.
+        :param result_path: Path of the nuScenes JSON result file, or a list of result files that are merged.
         :param eval_set: The dataset split to evaluate on, e.g. train, val or test.
         :param output_dir: Folder to save plots and results to.
         :param verbose: Whether to print to stdout.
+        :param num_workers: Number of processes used to accumulate the classes in parallel. 0 disables the pool.
+        :param gt_cache_dir: Folder to cache the prepared GT boxes in, so that repeated evaluations of the same split
+            skip loading and filtering them. None disables the cache.
         """
         self.nusc = nusc
         self.result_path = result_path
@@ -75,9 +80,11 @@ class DetectionEval:
         self.output_dir = output_dir
         self.verbose = verbose
         self.cfg = config
+        self.num_workers = num_workers
 
         # Check result file exists.
-        assert os.path.exists(result_path), 'Error: The result file does not exist!'
+        assert all(os.path.exists(x) for x in ([result_path] if isinstance(result_path, str) else result_path)), \
+            'Error: The result file does not exist!'
 
         # Make dirs.
         self.plot_dir = os.path.join(self.output_dir, 'plots')
@@ -90,62 +97,42 @@ class DetectionEval:
         if verbose:
             print('Initializing nuScenes detection evaluation')
 
+        # The predictions stay in typed arrays, the DetectionBoxes are only created if pred_boxes is used.
         if is_predefined_split(split_name=eval_set):
-            self.pred_boxes, self.meta = load_prediction(self.result_path, self.cfg.max_boxes_per_sample, DetectionBox,
-                                                        verbose=verbose)
-            self.gt_boxes = load_gt(self.nusc, self.eval_set, DetectionBox, verbose=verbose)
+            sample_tokens_of_custom_split = None
         else:
             sample_tokens_of_custom_split : List[str] = get_samples_of_custom_split(split_name=eval_set, nusc=nusc)
-            self.pred_boxes, self.meta = load_prediction_of_sample_tokens(self.result_path, self.cfg.max_boxes_per_sample,
-                DetectionBox, sample_tokens=sample_tokens_of_custom_split, verbose=verbose)
-            self.gt_boxes = load_gt_of_sample_tokens(nusc, sample_tokens_of_custom_split, DetectionBox, verbose=verbose)
+        self._pred_arrays, self.meta = load_prediction_arrays(self.result_path, self.cfg.max_boxes_per_sample,
+                                                              DetectionBox, sample_tokens=sample_tokens_of_custom_split,
+                                                              verbose=verbose)
+        self._pred_boxes = None
 
-        assert set(self.pred_boxes.sample_tokens) == set(self.gt_boxes.sample_tokens), \
+        # Load, add center distances to and filter the GT boxes, possibly from the cache.
+        self.gt_boxes = load_gt_cached(nusc, self.eval_set, DetectionBox, self.cfg.class_range,
+                                       cache_dir=gt_cache_dir, sample_tokens=sample_tokens_of_custom_split,
+                                       verbose=verbose)
+
+        assert set(self._pred_arrays['sample_tokens'].tolist()) == set(self.gt_boxes.sample_tokens), \
             "Samples in split doesn't match samples in predictions."
 
         # Add center distances.
-        self.pred_boxes = add_center_dist(nusc, self.pred_boxes)
-        self.gt_boxes = add_center_dist(nusc, self.gt_boxes)
+        self._pred_arrays = add_center_dist_arrays(nusc, self._pred_arrays)
 
         # Filter boxes (distance, points per box, etc.).
         if verbose:
             print('Filtering predictions')
-        self.pred_boxes = filter_eval_boxes(nusc, self.pred_boxes, self.cfg.class_range, verbose=verbose)
-        if verbose:
-            print('Filtering ground truth annotations')
-        self.gt_boxes = filter_eval_boxes(nusc, self.gt_boxes, self.cfg.class_range, verbose=verbose)
+        self._pred_arrays = filter_box_arrays(nusc, self._pred_arrays, self.cfg.class_range, DetectionBox,
+                                              verbose=verbose)
 
         self.sample_tokens = self.gt_boxes.sample_tokens
+        self._box_arrays = None
 
-    def filter_boxes_by_distance_range(self, gt_boxes, min_distance, max_distance):
-        """
-        Filters ground truth boxes by a specified distance range.
-        :param gt_boxes: List of ground truth boxes.
-        :param min_distance: Minimum distance for the filter.
-        :param max_distance: Maximum distance for the filter.
-        :return: Filtered list of GT boxes within the specified distance range.
-        """
-        filtered_boxes = EvalBoxes()  # Create a new EvalBoxes instance to store filtered boxes.
-
-        for sample_token in gt_boxes.sample_tokens:
-            for box in gt_boxes[sample_token]:
-                distance = np.linalg.norm(box.translation)  # Calculate Euclidean distance to the box center.
-                if min_distance <= distance < max_distance:
-                    filtered_boxes.add_boxes(sample_token, [box])  # Add box to filtered_boxes if within range.
-
-        return filtered_boxes
-    
-
-    def filter_boxes_by_sample(self, gt_boxes: EvalBoxes, pred_boxes: EvalBoxes) -> EvalBoxes:
-        keys = {box.sample_token for box in gt_boxes.all}
-        filtered_pred_boxes = EvalBoxes()
-
-        for box in pred_boxes.all:
-            if box.sample_token in keys:
-                filtered_pred_boxes.add_boxes(box.sample_token, [box])
-
-        return filtered_pred_boxes
-    
+    @property
+    def pred_boxes(self) -> EvalBoxes:
+        """ The filtered predictions as DetectionBoxes, which are created on first access. """
+        if self._pred_boxes is None:
+            self._pred_boxes = eval_boxes_from_arrays(self._pred_arrays, DetectionBox)
+        return self._pred_boxes
 
     def evaluate(self) -> Tuple[DetectionMetrics, DetectionMetricDataList]:
         """
@@ -159,101 +146,57 @@ class DetectionEval:
         # -----------------------------------
         if self.verbose:
             print('Accumulating metric data...')
-        metric_data_list = DetectionMetricDataList()
-        for class_name in self.cfg.class_names:
-            for dist_th in self.cfg.dist_ths:
-                md = accumulate(self.gt_boxes, self.pred_boxes, class_name, self.cfg.dist_fcn_callable, dist_th)
-                metric_data_list.set(class_name, dist_th, md)
+        if self.cfg.dist_fcn == 'center_distance':
+            # Use the columnar matching on the packed boxes, which gives identical results.
+            # All distance thresholds of a class share one matching pass.
+            gt_arrays, pred_arrays = self.box_arrays()
+            metric_data_list = accumulate_classes(gt_arrays, pred_arrays, self.cfg.class_names, self.cfg.dist_ths,
+                                                  num_workers=self.num_workers)
+        else:
+            metric_data_list = DetectionMetricDataList()
+            for class_name in self.cfg.class_names:
+                for dist_th in self.cfg.dist_ths:
+                    md = accumulate(self.gt_boxes, self.pred_boxes, class_name, self.cfg.dist_fcn_callable, dist_th)
+                    metric_data_list.set(class_name, dist_th, md)
 
         # -----------------------------------
         # Step 2: Calculate metrics from the data.
         # -----------------------------------
         if self.verbose:
             print('Calculating metrics...')
-        metrics = DetectionMetrics(self.cfg)
-        for class_name in self.cfg.class_names:
-            # Compute APs.
-            for dist_th in self.cfg.dist_ths:
-                metric_data = metric_data_list[(class_name, dist_th)]
-                ap = calc_ap(metric_data, self.cfg.min_recall, self.cfg.min_precision)
-                metrics.add_label_ap(class_name, dist_th, ap)
-
-            # Compute TP metrics.
-            for metric_name in TP_METRICS:
-                metric_data = metric_data_list[(class_name, self.cfg.dist_th_tp)]
-                if class_name in ['traffic_cone'] and metric_name in ['attr_err', 'vel_err', 'orient_err']:
-                    tp = np.nan
-                elif class_name in ['barrier'] and metric_name in ['attr_err', 'vel_err']:
-                    tp = np.nan
-                else:
-                    tp = calc_tp(metric_data, self.cfg.min_recall, metric_name)
-                metrics.add_label_tp(class_name, metric_name, tp)
+        metrics = self.calc_metrics(metric_data_list)
 
         # Compute evaluation time.
         metrics.add_runtime(time.time() - start_time)
 
         return metrics, metric_data_list
-    
 
-    def evaluate_bins(self) -> Tuple[List[DetectionMetrics], List[DetectionMetricDataList]]:
+    def evaluate_bins(self) -> Tuple[Dict[str, DetectionMetrics], Dict[str, DetectionMetricDataList]]:
         """
-        Performs the actual evaluation with AP for different distance bins.
+        Performs the actual evaluation with AP for the ego distance bins of the config.
+        The boxes are assigned to the bins by their ego distance and matched in a single pass, see
+        accumulate_columnar_bins() for details.
+        :return: A tuple of high-level and the raw metric data, each indexed by '<bin_min>-<bin_max>'.
         """
         start_time = time.time()
+        assert self.cfg.dist_fcn == 'center_distance', \
+            'Error: Distance bins are only supported for center_distance, not %s!' % self.cfg.dist_fcn
 
-        # Define distance bins as needed.
-        distance_bins = [(0, 80), (80, 130), (130, float('inf'))]
-
-        # Prepare containers for metric data and results by distance bin
-        metric_data_lists = {f"{bin_min}-{bin_max}": DetectionMetricDataList() for bin_min, bin_max in distance_bins}
-        metrics_by_bin = {f"{bin_min}-{bin_max}": DetectionMetrics(self.cfg) for bin_min, bin_max in distance_bins}
-
-        # -----------------------------------
-        # Single loop to accumulate and calculate metrics per class, distance threshold, and distance bin.
-        # -----------------------------------
         if self.verbose:
-            print('Accumulating and calculating metrics...')
+            print('Accumulating metric data for distance bins...')
+        dist_bins = self.cfg.dist_bin_ranges
+        gt_arrays, pred_arrays = self.box_arrays()
+        bin_metric_data_lists = accumulate_classes_bins(gt_arrays, pred_arrays, self.cfg.class_names,
+                                                        self.cfg.dist_ths, dist_bins, num_workers=self.num_workers)
 
-        for class_name in self.cfg.class_names:
-            for dist_th in self.cfg.dist_ths:
-                for bin_min, bin_max in distance_bins:
-                    bin_key = f"{bin_min}-{bin_max}"
-
-                    # Debug this -> why do we get good results for gt_boxes, but bad ones with filte_boxes_by_distance
-                    # md_ = accumulate(self.gt_boxes, self.pred_boxes, class_name, self.cfg.dist_fcn_callable, dist_th)
-
-                    # bad results here
-                    filtered_gt_boxes = self.filter_boxes_by_distance_range(self.gt_boxes, bin_min, bin_max)
-                    filtered_pred_boxes = self.filter_boxes_by_sample(filtered_gt_boxes, self.pred_boxes)
-                    md = accumulate(filtered_gt_boxes, filtered_pred_boxes, class_name, self.cfg.dist_fcn_callable, dist_th)
-                    
-                    metric_data_lists[bin_key].set(class_name, dist_th, md)
-
-
-        # -----------------------------------
-        # Compute mAP and TP metrics after accumulating data in a single loop.
-        # -----------------------------------
-        for bin_min, bin_max in distance_bins:
+        if self.verbose:
+            print('Calculating metrics for distance bins...')
+        metric_data_lists = {}
+        metrics_by_bin = {}
+        for (bin_min, bin_max), metric_data_list in zip(dist_bins, bin_metric_data_lists):
             bin_key = f"{bin_min}-{bin_max}"
-            metrics = metrics_by_bin[bin_key]
-            metric_data_list = metric_data_lists[bin_key]
-
-            for class_name in self.cfg.class_names:
-                for dist_th in self.cfg.dist_ths:
-                    metric_data = metric_data_list[(class_name, dist_th)]
-                    ap = calc_ap(metric_data, self.cfg.min_recall, self.cfg.min_precision)
-                    metrics.add_label_ap(class_name, dist_th, ap)
-
-                # Compute TP metrics
-                for metric_name in TP_METRICS:
-                    metric_data = metric_data_lists[bin_key][(class_name, self.cfg.dist_th_tp)]
-                    if class_name in ['traffic_cone'] and metric_name in ['attr_err', 'vel_err', 'orient_err']:
-                        tp = np.nan
-                    elif class_name in ['barrier'] and metric_name in ['attr_err', 'vel_err']:
-                        tp = np.nan
-                    else:
-                        tp = calc_tp(metric_data, self.cfg.min_recall, metric_name)
-                    metrics.add_label_tp(class_name, metric_name, tp)
+            metric_data_lists[bin_key] = metric_data_list
+            metrics_by_bin[bin_key] = self.calc_metrics(metric_data_list)
 
         # Add evaluation time to all metrics
         total_time = time.time() - start_time
@@ -262,6 +205,43 @@ class DetectionEval:
 
         return metrics_by_bin, metric_data_lists
 
+    def box_arrays(self) -> Tuple[DetectionBoxArrays, DetectionBoxArrays]:
+        """
+        Packs the GT and predicted boxes into arrays. The result is cached, so it is shared between evaluate() and
+        evaluate_bins().
+        :return: The packed GT and predicted boxes.
+        """
+        if self._box_arrays is None:
+            self._box_arrays = (DetectionBoxArrays.from_eval_boxes(self.gt_boxes),
+                                DetectionBoxArrays.from_arrays(self._pred_arrays))
+        return self._box_arrays
+
+    def calc_metrics(self, metric_data_list: DetectionMetricDataList) -> DetectionMetrics:
+        """
+        Calculates the APs and TP metrics from the raw metric data.
+        :param metric_data_list: The raw metric data for all classes and distance thresholds.
+        :return: The high-level metrics, without runtime.
+        """
+        metrics = DetectionMetrics(self.cfg)
+        for class_name in self.cfg.class_names:
+            # Compute APs.
+            for dist_th in self.cfg.dist_ths:
+                metric_data = metric_data_list[(class_name, dist_th)]
+                ap = calc_ap(metric_data, self.cfg.min_recall, self.cfg.min_precision)
+                metrics.add_label_ap(class_name, dist_th, ap)
+
+            # Compute TP metrics.
+            for metric_name in TP_METRICS:
+                metric_data = metric_data_list[(class_name, self.cfg.dist_th_tp)]
+                if class_name in ['traffic_cone'] and metric_name in ['attr_err', 'vel_err', 'orient_err']:
+                    tp = np.nan
+                elif class_name in ['barrier'] and metric_name in ['attr_err', 'vel_err']:
+                    tp = np.nan
+                else:
+                    tp = calc_tp(metric_data, self.cfg.min_recall, metric_name)
+                metrics.add_label_tp(class_name, metric_name, tp)
+
+        return metrics
 
     def render(self, metrics: DetectionMetrics, md_list: DetectionMetricDataList) -> None:
         """
@@ -321,7 +301,7 @@ class DetectionEval:
         # Run evaluation by bins
         print('===================================================')
         print('Evaluation by distance bins')
-        metrics, metric_data_list = self.evaluate_bins()
+        metrics, metric_data_list = self.evaluate_bins() if len(self.cfg.dist_bins) > 0 else ({}, {})
         for bin_key in metrics.keys():
             print(bin_key)
             print("---------------------------------------------")
@@ -441,6 +421,10 @@ if __name__ == "__main__":
                         help='Whether to render PR and TP curves to disk.')
     parser.add_argument('--verbose', type=int, default=1,
                         help='Whether to print to stdout.')
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help='Number of processes used to accumulate the classes in parallel.')
+    parser.add_argument('--gt_cache_dir', type=str, default='',
+                        help='Folder to cache the prepared ground truth in. Empty disables the cache.')
     args = parser.parse_args()
 
     result_path_ = os.path.expanduser(args.result_path)
@@ -452,6 +436,8 @@ if __name__ == "__main__":
     plot_examples_ = args.plot_examples
     render_curves_ = bool(args.render_curves)
     verbose_ = bool(args.verbose)
+    num_workers_ = args.num_workers
+    gt_cache_dir_ = os.path.expanduser(args.gt_cache_dir) if args.gt_cache_dir else None
 
     if config_path == '':
         cfg_ = config_factory('detection_a2rl_2025')
@@ -461,5 +447,6 @@ if __name__ == "__main__":
 
     nusc_ = NuScenes(version=version_, verbose=verbose_, dataroot=dataroot_)
     nusc_eval = DetectionEval(nusc_, config=cfg_, result_path=result_path_, eval_set=eval_set_,
-                              output_dir=output_dir_, verbose=verbose_)
+                              output_dir=output_dir_, verbose=verbose_, num_workers=num_workers_,
+                              gt_cache_dir=gt_cache_dir_)
     nusc_eval.main(plot_examples=plot_examples_, render_curves=render_curves_)
@@ -11,10 +11,11 @@ from pyquaternion import Quaternion
 from nuscenes.eval.common.config import config_factory
 from nuscenes.eval.common.data_classes import EvalBoxes
 from nuscenes.eval.common.utils import center_distance
-from nuscenes.eval.detection.algo import accumulate, calc_ap, calc_tp
-from nuscenes.eval.detection.constants import TP_METRICS
+from nuscenes.eval.detection.algo import accumulate, accumulate_classes, accumulate_columnar, accumulate_columnar_bins, \
+    calc_ap, calc_tp
+from nuscenes.eval.detection.constants import ATTRIBUTE_NAMES, TP_METRICS
 from nuscenes.eval.detection.data_classes import DetectionMetrics, DetectionMetricData, DetectionBox, \
-    DetectionMetricDataList
+    DetectionMetricDataList, DetectionBoxArrays
 from nuscenes.eval.detection.utils import detection_name_to_rel_attributes
 
 
@@ -424,5 +425,123 @@ class TestTPSimple(unittest.TestCase):
                       target_error=1.0, metric_name='trans_err')
 
 
+class TestAccumulateColumnar(unittest.TestCase):
+    """ Tests that the columnar accumulate gives exactly the same results as the box based accumulate. """
+
+    class_names = ['car', 'pedestrian', 'barrier']
+
+    @staticmethod
+    def _random_boxes(sample_tokens: List[str], max_boxes: int, is_gt: bool) -> EvalBoxes:
+        eval_boxes = EvalBoxes()
+        for sample_token in sample_tokens:
+            boxes = []
+            for _ in range(np.random.randint(0, max_boxes + 1)):
+                # Coarse coordinates and scores produce ties in distance and confidence.
+                translation_xy = np.round(np.random.rand(2) * 20, 1)
+                velocity = (np.nan, np.nan) if is_gt and np.random.rand() < 0.1 else tuple(np.random.rand(2) * 4)
+                boxes.append(DetectionBox(
+                    sample_token=sample_token,
+                    translation=(translation_xy[0], translation_xy[1], 0.0),
+                    size=tuple(np.random.rand(3) * 4 + 0.1),
+                    rotation=tuple(np.random.rand(4)),
+                    velocity=velocity,
+                    detection_name=random.choice(TestAccumulateColumnar.class_names),
+                    detection_score=-1.0 if is_gt else float(np.round(np.random.rand(), 2)),
+                    attribute_name=random.choice(ATTRIBUTE_NAMES + ['']),
+                    ego_translation=(random.random() * 10, 0, 0),
+                ))
+            eval_boxes.add_boxes(sample_token, boxes)
+        return eval_boxes
+
+    def test_random(self):
+        """ Compares both paths on random inputs, including predictions for samples without GT. """
+        random.seed(42)
+        np.random.seed(42)
+
+        for itt in range(10):
+            sample_tokens = [str(i) for i in range(20)]
+            gt = self._random_boxes(sample_tokens, 8, is_gt=True)
+            random.shuffle(sample_tokens)
+            pred = self._random_boxes(sample_tokens + ['no_gt'], 30, is_gt=False)
+
+            gt_arrays = DetectionBoxArrays.from_eval_boxes(gt)
+            pred_arrays = DetectionBoxArrays.from_eval_boxes(pred)
+            for class_name in self.class_names:
+                for dist_th in [0.5, 1.0, 2.0, 4.0]:
+                    md_ref = accumulate(gt, pred, class_name, center_distance, dist_th)
+                    md = accumulate_columnar(gt_arrays, pred_arrays, class_name, dist_th)
+                    for key, value in md_ref.serialize().items():
+                        np.testing.assert_array_equal(value, getattr(md, key).tolist())
+
+    def test_classes(self):
+        """ Tests the single-pass accumulation of all classes and thresholds, with and without a process pool. """
+        random.seed(42)
+        np.random.seed(42)
+
+        sample_tokens = [str(i) for i in range(20)]
+        gt = self._random_boxes(sample_tokens, 8, is_gt=True)
+        pred = self._random_boxes(sample_tokens, 30, is_gt=False)
+        gt_arrays = DetectionBoxArrays.from_eval_boxes(gt)
+        pred_arrays = DetectionBoxArrays.from_eval_boxes(pred)
+
+        dist_ths = [0.5, 1.0, 2.0, 4.0]
+        for num_workers in [0, 2]:
+            mdl = accumulate_classes(gt_arrays, pred_arrays, self.class_names, dist_ths, num_workers=num_workers)
+            for class_name in self.class_names:
+                for dist_th in dist_ths:
+                    md_ref = accumulate(gt, pred, class_name, center_distance, dist_th)
+                    for key, value in md_ref.serialize().items():
+                        np.testing.assert_array_equal(value, getattr(mdl[(class_name, dist_th)], key).tolist())
+
+    def test_bins(self):
+        """ Tests the ego distance bins. """
+        random.seed(42)
+        np.random.seed(42)
+
+        sample_tokens = [str(i) for i in range(20)]
+        gt = self._random_boxes(sample_tokens, 8, is_gt=True)
+        pred = self._random_boxes(sample_tokens, 30, is_gt=False)
+        gt_arrays = DetectionBoxArrays.from_eval_boxes(gt)
+        pred_arrays = DetectionBoxArrays.from_eval_boxes(pred)
+
+        # A single bin that covers all distances is the same as no binning.
+        dist_ths = [0.5, 2.0]
+        binned = accumulate_columnar_bins(gt_arrays, pred_arrays, 'car', dist_ths, [(0, float('inf'))])
+        for dist_th in dist_ths:
+            self.assertEqual(accumulate_columnar(gt_arrays, pred_arrays, 'car', dist_th), binned[0][dist_th])
+
+        # A prediction that is matched across a bin border counts in the bin of its GT box.
+        gt = EvalBoxes()
+        gt.add_boxes('a', [DetectionBox(sample_token='a', translation=(0, 0, 0), size=(1, 1, 1),
+                                        ego_translation=(79.5, 0, 0)),
+                           DetectionBox(sample_token='a', translation=(10, 0, 0), size=(1, 1, 1),
+                                        ego_translation=(100, 0, 0))])
+        pred = EvalBoxes()
+        pred.add_boxes('a', [DetectionBox(sample_token='a', translation=(0.6, 0, 0), size=(1, 1, 1),
+                                          ego_translation=(80.1, 0, 0), detection_score=0.9),
+                             DetectionBox(sample_token='a', translation=(50, 0, 0), size=(1, 1, 1),
+                                          ego_translation=(90, 0, 0), detection_score=0.8)])
+        binned = accumulate_columnar_bins(DetectionBoxArrays.from_eval_boxes(gt),
+                                          DetectionBoxArrays.from_eval_boxes(pred), 'car', [2.0],
+                                          [(0, 80), (80, 130), (130, float('inf'))])
+        self.assertEqual(1.0, binned[0][2.0].max_recall)
+        self.assertEqual(1.0, binned[0][2.0].precision[0])
+        self.assertEqual(0.0, binned[1][2.0].max_recall)
+        self.assertEqual(DetectionMetricData.no_predictions(), binned[2][2.0])
+
+    def test_empty(self):
+        """ Tests classes without GT or predictions. """
+        gt = EvalBoxes()
+        gt.add_boxes('a', [DetectionBox(sample_token='a', size=(1, 1, 1), detection_name='car')])
+        pred = EvalBoxes()
+        pred.add_boxes('a', [])
+
+        gt_arrays = DetectionBoxArrays.from_eval_boxes(gt)
+        pred_arrays = DetectionBoxArrays.from_eval_boxes(pred)
+        for class_name in ['car', 'bus']:
+            md = accumulate_columnar(gt_arrays, pred_arrays, class_name, 2.0)
+            self.assertEqual(DetectionMetricData.no_predictions(), md)
+
+
 if __name__ == '__main__':
     unittest.main()
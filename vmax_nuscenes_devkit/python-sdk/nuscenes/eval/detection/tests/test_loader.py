@@ -1,15 +1,24 @@
 # nuScenes dev-kit.
 # Code written by Sourabh Vora, 2019.
 
+import json
 import os
+import tempfile
 import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
 
 from nuscenes import NuScenes
 from nuscenes.eval.common.config import config_factory
 from nuscenes.eval.common.data_classes import EvalBoxes
-from nuscenes.eval.common.loaders import filter_eval_boxes
+from nuscenes.eval.common.loaders import add_center_dist, add_center_dist_arrays, filter_box_arrays, filter_eval_boxes
 from nuscenes.eval.detection.data_classes import DetectionBox
-from nuscenes.eval.common.loaders import _get_box_class_field
+from nuscenes.eval.common.loaders import _get_box_class_field, _iterate_result_file, eval_boxes_from_arrays, \
+    eval_boxes_to_arrays, gt_cache_key, load_prediction, load_prediction_arrays, load_prediction_of_sample_tokens
+from nuscenes.eval.tracking.data_classes import TrackingBox
+from nuscenes.utils.splits import create_splits_scenes
 
 
 class TestLoader(unittest.TestCase):
@@ -189,6 +198,185 @@ class TestLoader(unittest.TestCase):
         class_field = _get_box_class_field(eval_boxes)
         self.assertEqual(class_field, 'detection_name')
 
+    def test_gt_cache_arrays(self):
+        """ Checks that boxes survive the columnar GT cache format unchanged. """
+        eval_boxes = EvalBoxes()
+        eval_boxes.add_boxes('a', [
+            DetectionBox(sample_token='a', translation=(1.5, 2.0, 0.5), size=(1, 2, 3), rotation=(1, 0, 0, 0),
+                         velocity=(np.nan, np.nan), ego_translation=(3.0, 4.0, 0.0), num_pts=5,
+                         detection_name='bicycle', attribute_name='cycle.with_rider'),
+            DetectionBox(sample_token='a', translation=(0.1, 0.2, 0.3), detection_name='car', num_pts=1)
+        ])
+        eval_boxes.add_boxes('b', [])
+        eval_boxes.add_boxes('c', [DetectionBox(sample_token='c', velocity=(1.0, -1.0), detection_name='pedestrian')])
+
+        with tempfile.TemporaryFile() as f:
+            np.savez(f, **eval_boxes_to_arrays(eval_boxes, DetectionBox))
+            f.seek(0)
+            with np.load(f, allow_pickle=False) as arrays:
+                loaded = eval_boxes_from_arrays(arrays, DetectionBox)
+
+        self.assertEqual(loaded.sample_tokens, ['a', 'b', 'c'])
+        self.assertEqual(len(loaded['b']), 0)
+        self.assertEqual(eval_boxes.serialize().keys(), loaded.serialize().keys())
+        for box, loaded_box in zip(eval_boxes.all, loaded.all):
+            expected, actual = box.serialize(), loaded_box.serialize()
+            np.testing.assert_array_equal(expected.pop('velocity'), actual.pop('velocity'))
+            self.assertEqual(json.loads(json.dumps(expected)), json.loads(json.dumps(actual)))
+            self.assertEqual(box.ego_translation, loaded_box.ego_translation)
+            self.assertEqual(box.num_pts, loaded_box.num_pts)
+
+        # Tracking boxes. Loading the config registers the tracking names.
+        config_factory('tracking_nips_2019')
+        eval_boxes = EvalBoxes()
+        eval_boxes.add_boxes('a', [TrackingBox(sample_token='a', tracking_id='t1', tracking_name='car')])
+        loaded = eval_boxes_from_arrays(eval_boxes_to_arrays(eval_boxes, TrackingBox), TrackingBox)
+        self.assertEqual(loaded['a'][0].tracking_id, 't1')
+        self.assertEqual(loaded['a'][0].tracking_name, 'car')
+
+    def test_gt_cache_key(self):
+        """ Checks that the GT cache key changes with the split, the label mapping, the class ranges and the tables. """
+        cfg = config_factory('detection_cvpr_2019')
+        with tempfile.TemporaryDirectory() as table_root:
+            table_path = os.path.join(table_root, 'sample.json')
+            with open(table_path, 'w') as f:
+                f.write('[]')
+            nusc = SimpleNamespace(version='v1.0-mini', table_root=table_root,
+                                   category=[{'name': 'vehicle.car'}, {'name': 'vehicle.emergency.police'}])
+
+            key = gt_cache_key(nusc, 'mini_val', DetectionBox, cfg.class_range)
+            self.assertEqual(key, gt_cache_key(nusc, 'mini_val', DetectionBox, dict(cfg.class_range)))
+            self.assertNotEqual(key, gt_cache_key(nusc, 'mini_train', DetectionBox, cfg.class_range))
+            self.assertNotEqual(key, gt_cache_key(nusc, 'mini_val', TrackingBox, cfg.class_range))
+            self.assertNotEqual(key, gt_cache_key(nusc, 'mini_val', DetectionBox, dict(cfg.class_range, car=1.0)))
+            self.assertNotEqual(key, gt_cache_key(nusc, 'mini_val', DetectionBox, cfg.class_range,
+                                                  sample_tokens=['a']))
+
+            splits = create_splits_scenes()
+            with mock.patch('nuscenes.eval.common.loaders.create_splits_scenes',
+                            return_value=dict(splits, mini_val=splits['mini_val'][1:])):
+                self.assertNotEqual(key, gt_cache_key(nusc, 'mini_val', DetectionBox, cfg.class_range))
+            with mock.patch('nuscenes.eval.common.loaders.category_to_detection_name', return_value='car'):
+                self.assertNotEqual(key, gt_cache_key(nusc, 'mini_val', DetectionBox, cfg.class_range))
+
+            stat = os.stat(table_path)
+            os.utime(table_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            self.assertNotEqual(key, gt_cache_key(nusc, 'mini_val', DetectionBox, cfg.class_range))
+
+    def test_load_prediction_shards(self):
+        """ Checks that a list of result files is merged into the same boxes as a single file. """
+        def box(sample_token, score):
+            return DetectionBox(sample_token=sample_token, detection_name='car', detection_score=score).serialize()
+
+        meta = {'use_lidar': True}
+        shards = [
+            {'results': {'a': [box('a', 0.5), box('a', 0.4)], 'b': []}, 'meta': meta},
+            {'results': {'c': [box('c', 0.3)], 'a': [box('a', 0.1)]}, 'meta': {'use_lidar': False}},
+        ]
+        merged = {'results': {'a': shards[0]['results']['a'], 'b': [], 'c': shards[1]['results']['c']}, 'meta': meta}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for k, content in enumerate(shards + [merged]):
+                paths.append(os.path.join(tmp_dir, '%d.json' % k))
+                with open(paths[-1], 'w') as f:
+                    json.dump(content, f)
+
+            expected, expected_meta = load_prediction(paths[2], 500, DetectionBox)
+            loaded, loaded_meta = load_prediction(paths[:2], 500, DetectionBox)
+            self.assertEqual(loaded, expected)
+            self.assertEqual(loaded_meta, expected_meta)
+
+            loaded, loaded_meta = load_prediction_of_sample_tokens(paths[:2], 500, DetectionBox, ['c', 'a'])
+            self.assertEqual(loaded.sample_tokens, ['c', 'a'])
+            self.assertEqual(loaded['a'], expected['a'])
+            self.assertEqual(loaded_meta, meta)
+            self.assertRaises(KeyError, load_prediction_of_sample_tokens, paths[:2], 500, DetectionBox, ['d'])
+
+    def test_load_prediction_arrays(self):
+        """ Checks the incremental parsing and packing of result files against json.load and EvalBoxes. """
+        np.random.seed(42)
+        results = {}
+        for sample_token in ['a', 'b', 'c', 'd']:
+            results[sample_token] = [
+                DetectionBox(sample_token=sample_token, translation=tuple(np.random.uniform(-50, 50, 3)),
+                             size=(1.0, 2.0, 1.5), rotation=(1.0, 0.0, 0.0, 0.0), velocity=(0.5, 1.0),
+                             detection_name=np.random.choice(['car', 'bicycle']),
+                             detection_score=float(np.random.rand())).serialize()
+                for _ in range(np.random.randint(0, 5))]
+            for box in results[sample_token]:
+                del box['ego_translation'], box['num_pts']
+        content = {'meta': {'use_lidar': True}, 'results': results, 'extra': [1, {'a': None}]}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'results.json')
+            for indent in [None, 4]:
+                with open(path, 'w') as f:
+                    json.dump(content, f, indent=indent)
+                for chunk_size in [1, 7, 1 << 20]:
+                    meta = {}
+                    parsed = dict(_iterate_result_file(path, meta, chunk_size=chunk_size))
+                    self.assertEqual(json.dumps(parsed), json.dumps(results))
+                    self.assertEqual(meta['meta'], content['meta'])
+
+            expected = EvalBoxes.deserialize(results, DetectionBox)
+            arrays, meta = load_prediction_arrays(path, 500, DetectionBox)
+            self.assertEqual(meta, content['meta'])
+            self.assertEqual(eval_boxes_from_arrays(arrays, DetectionBox), expected)
+            arrays, _ = load_prediction_arrays(path, 500, DetectionBox, sample_tokens=['c', 'a'])
+            self.assertEqual(arrays['sample_tokens'].tolist(), ['c', 'a'])
+
+            # Invalid results are rejected while loading.
+            self.assertRaises(AssertionError, load_prediction_arrays, path, 1, DetectionBox)
+            for field, value in [('detection_name', 'bike'), ('translation', [0.0, 0.0]), ('size', [np.nan] * 3),
+                                 ('sample_token', 'b')]:
+                invalid = json.loads(json.dumps(content))
+                invalid['results']['a'][0][field] = value
+                with open(path, 'w') as f:
+                    json.dump(invalid, f)
+                self.assertRaises(AssertionError, load_prediction_arrays, path, 500, DetectionBox)
+
+    def test_iterate_result_file_numbers(self):
+        """ Checks that numbers cut at a chunk boundary are not decoded before the rest of them is read. """
+        text = '{"version": 12.5e-1, "meta": {"use_lidar": true, "scale": -1E+2}, ' \
+               '"results": {"a": [{"detection_score": 0.125, "size": [1e3, 2.5E-2, 10]}], "b": []}, "count": 100}'
+        expected = json.loads(text)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'results.json')
+            with open(path, 'w') as f:
+                f.write(text)
+            for chunk_size in [1, 2, 3, 5, 17, 34, 1 << 20]:
+                meta = {}
+                parsed = dict(_iterate_result_file(path, meta, chunk_size=chunk_size))
+                self.assertEqual(parsed, expected['results'], msg='chunk_size %d' % chunk_size)
+                self.assertEqual(meta['meta'], expected['meta'], msg='chunk_size %d' % chunk_size)
+
+    def test_filter_box_arrays(self):
+        """ Checks that the center distances and filters of packed boxes match those of EvalBoxes. """
+        np.random.seed(42)
+        tables = {}
+        eval_boxes = EvalBoxes()
+        for k in range(5):
+            sample_token = 'sample_%d' % k
+            tables[sample_token] = {'data': {'LIDAR_TOP': 'sd_%d' % k}, 'anns': ['rack_%d' % k]}
+            tables['sd_%d' % k] = {'ego_pose_token': 'pose_%d' % k}
+            tables['pose_%d' % k] = {'translation': list(np.random.uniform(-10, 10, 3))}
+            tables['rack_%d' % k] = {'translation': [0.0, 0.0, 0.0], 'size': [2.0, 6.0, 2.0],
+                                     'rotation': [1.0, 0.0, 0.0, 0.0], 'category_name': 'static_object.bicycle_rack'}
+            eval_boxes.add_boxes(sample_token, [
+                DetectionBox(sample_token=sample_token, translation=tuple(np.random.uniform(-3, 3, 3) * (1 + k * 10)),
+                             detection_name=np.random.choice(['car', 'bicycle', 'motorcycle']),
+                             num_pts=int(np.random.randint(-1, 2)), detection_score=0.5)
+                for _ in range(20)])
+        nusc = SimpleNamespace(get=lambda table_name, token: tables[token])
+        max_dist = config_factory('detection_cvpr_2019').class_range
+
+        arrays = eval_boxes_to_arrays(eval_boxes, DetectionBox)
+        arrays = filter_box_arrays(nusc, add_center_dist_arrays(nusc, arrays), max_dist, DetectionBox)
+        expected = filter_eval_boxes(nusc, add_center_dist(nusc, eval_boxes), max_dist)
+        self.assertEqual(eval_boxes_from_arrays(arrays, DetectionBox), expected)
+        self.assertLess(len(expected.all), 100)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -11,7 +11,8 @@ py-motmetrics at:
 https://github.com/cheind/py-motmetrics
 """
 import os
-from typing import List, Dict, Callable, Tuple
+from multiprocessing.pool import Pool
+from typing import List, Dict, Callable, Iterator, NamedTuple, Optional, Tuple
 import unittest
 
 import numpy as np
@@ -24,12 +25,62 @@ except ModuleNotFoundError:
     raise unittest.SkipTest('Skipping test as pandas was not found!')
 
 from nuscenes.eval.tracking.constants import MOT_METRIC_MAP, TRACKING_METRICS
-from nuscenes.eval.tracking.data_classes import TrackingBox, TrackingMetricData
+from nuscenes.eval.tracking.data_classes import TrackingBox, TrackingMetricData, TrackTable
 from nuscenes.eval.tracking.mot import MOTAccumulatorCustom
+from nuscenes.eval.tracking.mot_native import MOTAccumulatorNative, MOTEvents, compute_mot_metrics, merge_events
 from nuscenes.eval.tracking.render import TrackingRenderer
 from nuscenes.eval.tracking.utils import print_threshold_metrics, create_motmetrics
 
 
+class SceneFrame(NamedTuple):
+    """ The boxes of a class in a frame, see TrackingEvaluation.get_scene_frames. """
+    gt_ids: List[str]
+    pred_ids: List[str]
+    pred_scores: np.ndarray  # <float: len(pred_ids)>.
+    distances: np.ndarray  # <float: len(gt_ids), len(pred_ids)>, nan for pairs that may not be matched.
+
+
+def accumulate_scene(frames: List[SceneFrame],
+                     thresholds: List[Optional[float]]) -> List[Tuple[MOTEvents, List[float]]]:
+    """
+    Accumulate the events of a scene for several score thresholds.
+    Thresholds which select the same predicted boxes in this scene share the same events.
+    :param frames: The frames of the scene, see TrackingEvaluation.get_scene_frames.
+    :param thresholds: score thresholds used to determine positives and negatives, None for all boxes.
+    :return: For each threshold: (The events of the scene, Scores for each TP).
+    """
+    scene_scores = np.concatenate([np.zeros(0)] + [frame.pred_scores for frame in frames])
+    results = []
+    cache = {}  # Results by the number of predicted boxes above the threshold.
+    for threshold in thresholds:
+        num_positives = len(scene_scores) if threshold is None else int(np.sum(scene_scores >= threshold))
+        if num_positives not in cache:
+            acc = MOTAccumulatorNative()
+            scores = []
+            for frame in frames:
+                pred_ids, pred_scores, distances = frame.pred_ids, frame.pred_scores, frame.distances
+
+                # Threshold boxes by score. Note that the scores were previously averaged over the whole track.
+                if num_positives < len(scene_scores):
+                    keep = pred_scores >= threshold
+                    pred_ids = [pred_id for pred_id, k in zip(pred_ids, keep) if k]
+                    pred_scores = pred_scores[keep]
+                    distances = distances[:, keep]
+
+                # Abort if there are neither GT nor pred boxes.
+                if len(frame.gt_ids) == 0 and len(pred_ids) == 0:
+                    continue
+
+                # Accumulate results and store scores of matches, which are used to determine recall thresholds.
+                match_inds, _ = acc.update(frame.gt_ids, pred_ids, distances)
+                match_ids = set(pred_ids[j] for j in match_inds)
+                scores.extend([score for pred_id, score in zip(pred_ids, pred_scores) if pred_id in match_ids])
+            cache[num_positives] = (acc.events, scores)
+        results.append(cache[num_positives])
+
+    return results
+
+
 class TrackingEvaluation(object):
     def __init__(self,
                  tracks_gt: Dict[str, Dict[int, List[TrackingBox]]],
@@ -42,11 +93,13 @@ class TrackingEvaluation(object):
                  metric_worst: Dict[str, float],
                  verbose: bool = True,
                  output_dir: str = None,
-                 render_classes: List[str] = None):
+                 render_classes: List[str] = None,
+                 use_motmetrics: bool = False,
+                 pool: Pool = None):
         """
         Create a TrackingEvaluation object which computes all metrics for a given class.
-        :param tracks_gt: The ground-truth tracks.
-        :param tracks_pred: The predicted tracks.
+        :param tracks_gt: The ground-truth tracks, either as {timestamp: List[TrackingBox]} or as TrackTable per scene.
+        :param tracks_pred: The predicted tracks, in the same format.
         :param class_name: The current class we are evaluating on.
         :param dist_fcn: The distance function used for evaluation.
         :param dist_th_tp: The distance threshold used to determine matches.
@@ -57,6 +110,9 @@ class TrackingEvaluation(object):
         :param verbose: Whether to print to stdout.
         :param output_dir: Output directory to save renders.
         :param render_classes: Classes to render to disk or None.
+        :param use_motmetrics: Whether to compute the metrics with py-motmetrics instead of the equivalent NumPy
+            implementation in mot_native. The renderings always use py-motmetrics.
+        :param pool: Optional process pool over which the scenes are distributed in the NumPy implementation.
 
         Computes the metrics defined in:
         - Stiefelhagen 2008: Evaluating Multiple Object Tracking Performance: The CLEAR MOT Metrics.
@@ -77,6 +133,9 @@ class TrackingEvaluation(object):
         self.verbose = verbose
         self.output_dir = output_dir
         self.render_classes = [] if render_classes is None else render_classes
+        self.use_motmetrics = use_motmetrics
+        self.pool = pool
+        self.scene_frames = {}  # Cache of get_scene_frames().
 
         self.n_scenes = len(self.tracks_gt)
 
@@ -105,6 +164,11 @@ class TrackingEvaluation(object):
         gt_box_count = 0
         gt_track_ids = set()
         for scene_tracks_gt in self.tracks_gt.values():
+            if isinstance(scene_tracks_gt, TrackTable):
+                is_class = scene_tracks_gt.tracking_name == self.class_name
+                gt_box_count += int(np.sum(is_class))
+                gt_track_ids.update(np.unique(scene_tracks_gt.tracking_id[is_class]).tolist())
+                continue
             for frame_gt in scene_tracks_gt.values():
                 for box in frame_gt:
                     if box.tracking_name == self.class_name:
@@ -115,7 +179,7 @@ class TrackingEvaluation(object):
             return md
 
         # Register mot metrics.
-        mh = create_motmetrics()
+        mh = create_motmetrics() if self.use_motmetrics else None
 
         # Get thresholds.
         # Note: The recall values are the hypothetical recall (10%, 20%, ..).
@@ -126,6 +190,12 @@ class TrackingEvaluation(object):
         if self.verbose:
             print('Computed thresholds\n')
 
+        # The native implementation accumulates all thresholds at once to share the work between them.
+        if not self.use_motmetrics:
+            eval_thresholds = [threshold for t, threshold in enumerate(thresholds)
+                               if not np.isnan(threshold) and threshold not in thresholds[:t]]
+            native_results = dict(zip(eval_thresholds, self.accumulate_thresholds_native(eval_thresholds)))
+
         for t, threshold in enumerate(thresholds):
             # If recall threshold is not achieved, we assign the worst possible value in AMOTA and AMOTP.
             if np.isnan(threshold):
@@ -136,24 +206,25 @@ class TrackingEvaluation(object):
             if threshold in thresholds[:t]:
                 continue
 
-            # Accumulate track data.
-            acc, _ = self.accumulate_threshold(threshold)
-            accumulators.append(acc)
-
-            # Compute metrics for current threshold.
+            # Accumulate track data and compute metrics for current threshold.
             thresh_name = self.name_gen(threshold)
-            thresh_summary = mh.compute(acc, metrics=MOT_METRIC_MAP.keys(), name=thresh_name)
+            if self.use_motmetrics:
+                acc, _ = self.accumulate_threshold(threshold)
+                accumulators.append(acc)
+                thresh_summary = mh.compute(acc, metrics=MOT_METRIC_MAP.keys(), name=thresh_name).to_dict()
+            else:
+                events, _ = native_results[threshold]
+                thresh_summary = {mot_name: {thresh_name: value}
+                                  for mot_name, value in compute_mot_metrics(events).items()}
             thresh_metrics.append(thresh_summary)
 
             # Print metrics to stdout.
             if self.verbose:
-                print_threshold_metrics(thresh_summary.to_dict())
+                print_threshold_metrics(thresh_summary)
 
         # Concatenate all metrics. We only do this for more convenient access.
-        if len(thresh_metrics) == 0:
-            summary = []
-        else:
-            summary = pandas.concat(thresh_metrics)
+        summary = {mot_name: np.array([list(m[mot_name].values())[0] for m in thresh_metrics])
+                   for mot_name in MOT_METRIC_MAP.keys()}
 
         # Get the number of thresholds which were not achieved (i.e. nan).
         unachieved_thresholds = np.array([t for t in thresholds if np.isnan(t)])
@@ -192,7 +263,7 @@ class TrackingEvaluation(object):
 
                 all_values = [worst] * TrackingMetricData.nelem
             else:
-                values = summary.get(mot_name).values
+                values = summary[mot_name]
                 assert np.all(values[np.logical_not(np.isnan(values))] >= 0)
 
                 # If a threshold occurred more than once, duplicate the metric values.
@@ -297,6 +368,97 @@ class TrackingEvaluation(object):
 
         return acc_merged, scores
 
+    def iterate_scene_boxes(self, scene_id: str) -> Iterator[Tuple[List[str], np.ndarray, List[str], np.ndarray,
+                                                                   np.ndarray]]:
+        """
+        Iterates over the boxes of the current class in each timestamp of a scene. TrackTables are read column-wise,
+        without creating TrackingBoxes.
+        :param scene_id: The scene.
+        :return: For each timestamp: (GT tracking ids, <float64: N, 2> GT centers, predicted tracking ids,
+            <float64: M, 2> predicted centers, <float64: M> predicted scores).
+        """
+        scene_tracks_gt = self.tracks_gt[scene_id]
+        scene_tracks_pred = self.tracks_pred[scene_id]
+        if isinstance(scene_tracks_gt, TrackTable) and isinstance(scene_tracks_pred, TrackTable) and \
+                np.array_equal(scene_tracks_gt.timestamps, scene_tracks_pred.timestamps):
+            table_gt = scene_tracks_gt.take(np.flatnonzero(scene_tracks_gt.tracking_name == self.class_name))
+            table_pred = scene_tracks_pred.take(np.flatnonzero(scene_tracks_pred.tracking_name == self.class_name))
+            for frame in range(len(table_gt.timestamps)):
+                rows_gt, rows_pred = table_gt.frame_rows(frame), table_pred.frame_rows(frame)
+                yield (table_gt.tracking_id[rows_gt].tolist(), table_gt.translation[rows_gt, :2],
+                       table_pred.tracking_id[rows_pred].tolist(), table_pred.translation[rows_pred, :2],
+                       table_pred.tracking_score[rows_pred])
+            return
+
+        for timestamp in scene_tracks_gt.keys():
+            # Select only the current class.
+            frame_gt = [f for f in scene_tracks_gt[timestamp] if f.tracking_name == self.class_name]
+            frame_pred = [f for f in scene_tracks_pred[timestamp] if f.tracking_name == self.class_name]
+            yield ([gg.tracking_id for gg in frame_gt],
+                   np.array([gg.translation[:2] for gg in frame_gt], dtype=np.float64).reshape(-1, 2),
+                   [tt.tracking_id for tt in frame_pred],
+                   np.array([tt.translation[:2] for tt in frame_pred], dtype=np.float64).reshape(-1, 2),
+                   np.array([tt.tracking_score for tt in frame_pred], dtype=np.float64))
+
+    def get_scene_frames(self, scene_id: str) -> List[SceneFrame]:
+        """
+        Collects the boxes of the current class and their distances for each frame of a scene. The frames are shared by
+        all thresholds, which only need to select the predicted boxes above the threshold.
+        :param scene_id: The scene.
+        :return: The frames with any GT or predicted box of the current class.
+        """
+        if scene_id in self.scene_frames:
+            return self.scene_frames[scene_id]
+
+        frames = []
+        for gt_ids, gt_boxes, pred_ids, pred_boxes, pred_scores in self.iterate_scene_boxes(scene_id):
+            # Abort if there are neither GT nor pred boxes.
+            if len(gt_ids) == 0 and len(pred_ids) == 0:
+                continue
+
+            # Calculate distances, with the same arithmetic as sklearn's euclidean_distances to get bitwise
+            # identical distances as accumulate_threshold.
+            assert self.dist_fcn.__name__ == 'center_distance'
+            if len(gt_ids) == 0 or len(pred_ids) == 0:
+                distances = np.zeros((len(gt_ids), len(pred_ids)))
+            else:
+                distances = -2 * np.dot(gt_boxes, pred_boxes.T)
+                distances += np.einsum('ij,ij->i', gt_boxes, gt_boxes)[:, np.newaxis]
+                distances += np.einsum('ij,ij->i', pred_boxes, pred_boxes)[np.newaxis, :]
+                np.sqrt(np.maximum(distances, 0, out=distances), out=distances)
+
+            # Distances that are larger than the threshold won't be associated.
+            distances[distances >= self.dist_th_tp] = np.nan
+
+            frames.append(SceneFrame(gt_ids=gt_ids, pred_ids=pred_ids, pred_scores=pred_scores, distances=distances))
+
+        self.scene_frames[scene_id] = frames
+        return frames
+
+    def accumulate_thresholds_native(self, thresholds: List[float]) -> List[Tuple[MOTEvents, List[float]]]:
+        """
+        Accumulate the events of several recall thresholds of the current class with the NumPy implementation in
+        mot_native, which gives the same events as accumulate_threshold. If a pool was given, the scenes are
+        distributed over its processes.
+        :param thresholds: score thresholds used to determine positives and negatives, None for all boxes.
+        :return: For each threshold: (The events of all scenes, Scores for each TP).
+        """
+        scene_ids = list(self.tracks_gt.keys())
+        tasks = [(self.get_scene_frames(scene_id), thresholds)
+                 for scene_id in tqdm.tqdm(scene_ids, disable=not self.verbose, leave=False)]
+        if self.pool is None:
+            scene_results = [accumulate_scene(*task) for task in tasks]
+        else:
+            scene_results = self.pool.starmap(accumulate_scene, tasks)
+
+        # Merge the scenes of each threshold.
+        results = []
+        for t in range(len(thresholds)):
+            events = merge_events([res[t][0] for res in scene_results])
+            scores = [score for res in scene_results for score in res[t][1]]
+            results.append((events, scores))
+        return results
+
     def compute_thresholds(self, gt_box_count: int) -> Tuple[List[float], List[float]]:
         """
         Compute the score thresholds for predefined recall values.
@@ -305,7 +467,10 @@ class TrackingEvaluation(object):
         :return: The lists of thresholds and their recall values.
         """
         # Run accumulate to get the scores of TPs.
-        _, scores = self.accumulate_threshold(threshold=None)
+        if self.use_motmetrics or self.class_name in self.render_classes:
+            _, scores = self.accumulate_threshold(threshold=None)
+        else:
+            _, scores = self.accumulate_thresholds_native([None])[0]
 
         # Abort if no predictions exist.
         if len(scores) == 0:
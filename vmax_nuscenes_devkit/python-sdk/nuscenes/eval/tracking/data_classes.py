@@ -1,6 +1,7 @@
 # nuScenes dev-kit.
 # Code written by Holger Caesar, Caglayan Dicle and Oscar Beijbom, 2019.
 
+from collections.abc import Mapping
 from typing import Any, Dict, List, Tuple
 
 import numpy as np
@@ -364,3 +365,104 @@ class TrackingMetricDataList:
         for name, md in content.items():
             mdl.set(name, metric_data_cls.deserialize(md))
         return mdl
+
+
+class TrackTable(Mapping):
+    """
+    Columnar storage of the tracks of a scene, with one row per box in flat NumPy arrays.
+    It can also be used like the {timestamp: List[TrackingBox]} dicts of a scene, in which case the TrackingBoxes of
+    a timestamp are created on access.
+    """
+
+    # Per-row columns, in the order of the TrackingBox arguments.
+    columns = ['sample_token', 'translation', 'size', 'rotation', 'velocity', 'ego_translation', 'num_pts',
+               'tracking_id', 'tracking_name', 'tracking_score']
+
+    def __init__(self, timestamps: np.ndarray, frame: np.ndarray, **columns: np.ndarray):
+        """
+        :param timestamps: <int64: T> All timestamps of the scene in chronological order.
+        :param frame: <int64: N> Index of the timestamp of each row. The rows are sorted by frame.
+        :param columns: The per-row columns, see TrackTable.columns. Ids, names and tokens are str arrays, translation,
+            size, rotation (w, x, y, z), velocity and ego_translation are <float64: N, k> arrays.
+        """
+        assert set(columns.keys()) == set(self.columns), 'Error: Missing or unknown columns!'
+        assert np.all(np.diff(frame) >= 0), 'Error: Rows must be sorted by frame!'
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.frame = np.asarray(frame, dtype=np.int64)
+        for name in self.columns:
+            setattr(self, name, columns[name])
+        self.frame_starts = np.searchsorted(self.frame, np.arange(len(self.timestamps) + 1))
+
+    @classmethod
+    def from_boxes(cls, timestamps: np.ndarray, boxes_by_timestamp: Dict[int, List[TrackingBox]]) -> 'TrackTable':
+        """
+        Create a TrackTable from lists of boxes.
+        :param timestamps: All timestamps of the scene in chronological order.
+        :param boxes_by_timestamp: The boxes of each timestamp, which must be in timestamps.
+        :return: The TrackTable.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        boxes = [box for timestamp in timestamps for box in boxes_by_timestamp.get(timestamp, [])]
+        frame = np.repeat(np.arange(len(timestamps)), [len(boxes_by_timestamp.get(t, [])) for t in timestamps])
+        columns = {
+            'sample_token': np.array([box.sample_token for box in boxes], dtype=str),
+            'num_pts': np.array([box.num_pts for box in boxes], dtype=np.int64),
+            'tracking_id': np.array([box.tracking_id for box in boxes], dtype=str),
+            'tracking_name': np.array([box.tracking_name for box in boxes], dtype=str),
+            'tracking_score': np.array([box.tracking_score for box in boxes], dtype=np.float64),
+        }
+        for name, dim in [('translation', 3), ('size', 3), ('rotation', 4), ('velocity', 2), ('ego_translation', 3)]:
+            columns[name] = np.array([getattr(box, name) for box in boxes], dtype=np.float64).reshape(-1, dim)
+        return cls(timestamps, frame, **columns)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __iter__(self):
+        return iter(self.timestamps.tolist())
+
+    def __contains__(self, timestamp) -> bool:
+        ind = np.searchsorted(self.timestamps, timestamp)
+        return ind < len(self.timestamps) and self.timestamps[ind] == timestamp
+
+    def __getitem__(self, timestamp: int) -> List[TrackingBox]:
+        if timestamp not in self:
+            raise KeyError(timestamp)
+        rows = self.frame_rows(int(np.searchsorted(self.timestamps, timestamp)))
+        return [self.get_box(row) for row in range(rows.start, rows.stop)]
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.frame)
+
+    def frame_rows(self, frame: int) -> slice:
+        """ Returns the rows of a frame, i.e. of the timestamp self.timestamps[frame]. """
+        return slice(int(self.frame_starts[frame]), int(self.frame_starts[frame + 1]))
+
+    def get_box(self, row: int) -> TrackingBox:
+        """ Creates the TrackingBox of a row. """
+        return TrackingBox(sample_token=str(self.sample_token[row]),
+                           translation=tuple(self.translation[row].tolist()),
+                           size=tuple(self.size[row].tolist()),
+                           rotation=tuple(self.rotation[row].tolist()),
+                           velocity=tuple(self.velocity[row].tolist()),
+                           ego_translation=tuple(self.ego_translation[row].tolist()),
+                           num_pts=int(self.num_pts[row]),
+                           tracking_id=str(self.tracking_id[row]),
+                           tracking_name=str(self.tracking_name[row]),
+                           tracking_score=float(self.tracking_score[row]))
+
+    def take(self, rows: np.ndarray) -> 'TrackTable':
+        """ Returns a TrackTable of the same scene with the given rows, which must be sorted by frame. """
+        return TrackTable(self.timestamps, self.frame[rows], **{name: getattr(self, name)[rows] for name in self.columns})
+
+    def serialize(self) -> Dict[str, np.ndarray]:
+        """ Serialize instance into a dict of arrays, e.g. for np.savez. """
+        content = {'timestamps': self.timestamps, 'frame': self.frame}
+        content.update({name: getattr(self, name) for name in self.columns})
+        return content
+
+    @classmethod
+    def deserialize(cls, content: Dict[str, np.ndarray]) -> 'TrackTable':
+        """ Initialize from serialized content. """
+        return cls(content['timestamps'], content['frame'], **{name: content[name] for name in cls.columns})
@@ -5,7 +5,8 @@ import argparse
 import json
 import os
 import time
-from typing import Tuple, List, Dict, Any
+from multiprocessing import Pool
+from typing import Tuple, List, Dict, Any, Union
 
 import numpy as np
 
@@ -13,18 +14,19 @@ from nuscenes import NuScenes
 from nuscenes.eval.common.config import config_factory
 from nuscenes.eval.common.loaders import (
     add_center_dist,
+    add_center_dist_arrays,
+    filter_box_arrays,
     filter_eval_boxes,
     get_samples_of_custom_split,
     load_gt,
     load_gt_of_sample_tokens,
-    load_prediction,
-    load_prediction_of_sample_tokens,
+    load_prediction_arrays,
 )
 from nuscenes.eval.tracking.algo import TrackingEvaluation
 from nuscenes.eval.tracking.constants import AVG_METRIC_MAP, MOT_METRIC_MAP, LEGACY_METRICS
 from nuscenes.eval.tracking.data_classes import TrackingMetrics, TrackingMetricDataList, TrackingConfig, TrackingBox, \
     TrackingMetricData
-from nuscenes.eval.tracking.loaders import create_tracks
+from nuscenes.eval.tracking.loaders import create_tracks, load_tracks, save_tracks, tracks_cache_key
 from nuscenes.eval.tracking.render import recall_metric_curve, summary_plot
 from nuscenes.eval.tracking.utils import print_final_metrics
 from nuscenes.utils.splits import is_predefined_split
@@ -47,23 +49,29 @@ class TrackingEval:
     """
     def __init__(self,
                  config: TrackingConfig,
-                 result_path: str,
+                 result_path: Union[str, List[str]],
                  eval_set: str,
                  output_dir: str,
                  nusc_version: str,
                  nusc_dataroot: str,
                  verbose: bool = True,
-                 render_classes: List[str] = None):
+                 render_classes: List[str] = None,
+                 num_workers: int = 0,
+                 tracks_cache_dir: str = None):
         """
         Initialize a TrackingEval object.
         :param config: A TrackingConfig object.
-        :param result_path: Path of the nuScenes JSON result file.
+        :param result_path: Path of the nuScenes JSON result file, or a list of result files that are merged.
         :param eval_set: The dataset split to evaluate on, e.g. train, val or test.
         :param output_dir: Folder to save plots and results to.
         :param nusc_version: The version of the NuScenes dataset.
         :param nusc_dataroot: Path of the nuScenes dataset on disk.
         :param verbose: Whether to print to stdout.
         :param render_classes: Classes to render to disk or None.
+        :param num_workers: Number of processes over which the scenes of each class are distributed, 0 to evaluate in
+            the main process.
+        :param tracks_cache_dir: Folder to cache the GT and predicted tracks in, so that repeated evaluations of the
+            same result files skip loading, filtering and converting the boxes. None disables the cache.
         """
         self.cfg = config
         self.result_path = result_path
@@ -71,9 +79,11 @@ class TrackingEval:
         self.output_dir = output_dir
         self.verbose = verbose
         self.render_classes = render_classes
+        self.num_workers = num_workers
 
         # Check result file exists.
-        assert os.path.exists(result_path), 'Error: The result file does not exist!'
+        assert all(os.path.exists(x) for x in ([result_path] if isinstance(result_path, str) else result_path)), \
+            'Error: The result file does not exist!'
 
         # Make dirs.
         self.plot_dir = os.path.join(self.output_dir, 'plots')
@@ -91,27 +101,48 @@ class TrackingEval:
             print('Initializing nuScenes tracking evaluation')
 
         if is_predefined_split(split_name=eval_set):
-            pred_boxes, self.meta = load_prediction(
-                self.result_path, self.cfg.max_boxes_per_sample, TrackingBox, verbose=verbose
-            )
-            gt_boxes = load_gt(nusc, self.eval_set, TrackingBox, verbose=verbose)
+            sample_tokens_of_custom_split = None
         else:
             sample_tokens_of_custom_split : List[str] = get_samples_of_custom_split(split_name=eval_set, nusc=nusc)
-            pred_boxes, self.meta = load_prediction_of_sample_tokens(self.result_path, self.cfg.max_boxes_per_sample,
-                TrackingBox, sample_tokens=sample_tokens_of_custom_split, verbose=verbose)
+
+        # The tracks only depend on the dataset, the config and the result files, see tracks_cache_key.
+        cache_prefix = None
+        if tracks_cache_dir is not None:
+            key = tracks_cache_key(nusc, self.eval_set, self.cfg, self.result_path,
+                                   sample_tokens=sample_tokens_of_custom_split)
+            cache_prefix = os.path.join(tracks_cache_dir, 'tracks_{}_{}_{}'.format(nusc.version, eval_set, key))
+            if all(os.path.exists(cache_prefix + suffix) for suffix in ['_gt.npz', '_pred.npz', '_meta.json']):
+                self.tracks_gt = load_tracks(cache_prefix + '_gt.npz')
+                self.tracks_pred = load_tracks(cache_prefix + '_pred.npz')
+                with open(cache_prefix + '_meta.json', 'r') as f:
+                    cache_meta = json.load(f)
+                self.meta, self.sample_tokens = cache_meta['meta'], cache_meta['sample_tokens']
+                if verbose:
+                    print('Loaded tracks of {} scenes from {}'.format(len(self.tracks_gt), cache_prefix))
+                return
+
+        # The predictions stay in typed arrays until they are converted to tracks.
+        if sample_tokens_of_custom_split is None:
+            pred_arrays, self.meta = load_prediction_arrays(self.result_path, self.cfg.max_boxes_per_sample, TrackingBox,
+                                                            verbose=verbose)
+            gt_boxes = load_gt(nusc, self.eval_set, TrackingBox, verbose=verbose)
+        else:
+            pred_arrays, self.meta = load_prediction_arrays(self.result_path, self.cfg.max_boxes_per_sample, TrackingBox,
+                                                            sample_tokens=sample_tokens_of_custom_split,
+                                                            verbose=verbose)
             gt_boxes = load_gt_of_sample_tokens(nusc, sample_tokens_of_custom_split, TrackingBox, verbose=verbose)
 
-        assert set(pred_boxes.sample_tokens) == set(gt_boxes.sample_tokens), \
+        assert set(pred_arrays['sample_tokens'].tolist()) == set(gt_boxes.sample_tokens), \
             "Samples in split don't match samples in predicted tracks."
 
         # Add center distances.
-        pred_boxes = add_center_dist(nusc, pred_boxes)
+        pred_arrays = add_center_dist_arrays(nusc, pred_arrays)
         gt_boxes = add_center_dist(nusc, gt_boxes)
 
         # Filter boxes (distance, points per box, etc.).
         if verbose:
             print('Filtering tracks')
-        pred_boxes = filter_eval_boxes(nusc, pred_boxes, self.cfg.class_range, verbose=verbose)
+        pred_arrays = filter_box_arrays(nusc, pred_arrays, self.cfg.class_range, TrackingBox, verbose=verbose)
         if verbose:
             print('Filtering ground truth tracks')
         gt_boxes = filter_eval_boxes(nusc, gt_boxes, self.cfg.class_range, verbose=verbose)
@@ -120,7 +151,17 @@ class TrackingEval:
 
         # Convert boxes to tracks format.
         self.tracks_gt = create_tracks(gt_boxes, nusc, self.eval_set, gt=True)
-        self.tracks_pred = create_tracks(pred_boxes, nusc, self.eval_set, gt=False)
+        self.tracks_pred = create_tracks(pred_arrays, nusc, self.eval_set, gt=False)
+
+        if cache_prefix is not None:
+            os.makedirs(tracks_cache_dir, exist_ok=True)
+            save_tracks(self.tracks_gt, cache_prefix + '_gt.npz')
+            save_tracks(self.tracks_pred, cache_prefix + '_pred.npz')
+            # Written last, it marks the cache entry as complete.
+            with open(cache_prefix + '_meta.json', 'w') as f:
+                json.dump({'meta': self.meta, 'sample_tokens': self.sample_tokens}, f)
+            if verbose:
+                print('Saved tracks to {}'.format(cache_prefix))
 
     def evaluate(self) -> Tuple[TrackingMetrics, TrackingMetricDataList]:
         """
@@ -137,19 +178,26 @@ class TrackingEval:
             print('Accumulating metric data...')
         metric_data_list = TrackingMetricDataList()
 
-        def accumulate_class(curr_class_name):
+        def accumulate_class(curr_class_name, pool=None):
             curr_ev = TrackingEvaluation(self.tracks_gt, self.tracks_pred, curr_class_name, self.cfg.dist_fcn_callable,
                                          self.cfg.dist_th_tp, self.cfg.min_recall,
                                          num_thresholds=TrackingMetricData.nelem,
                                          metric_worst=self.cfg.metric_worst,
                                          verbose=self.verbose,
                                          output_dir=self.output_dir,
-                                         render_classes=self.render_classes)
+                                         render_classes=self.render_classes,
+                                         pool=pool)
             curr_md = curr_ev.accumulate()
             metric_data_list.set(curr_class_name, curr_md)
 
-        for class_name in self.cfg.class_names:
-            accumulate_class(class_name)
+        if self.num_workers > 0:
+            # All classes share the same pool.
+            with Pool(self.num_workers) as pool:
+                for class_name in self.cfg.class_names:
+                    accumulate_class(class_name, pool)
+        else:
+            for class_name in self.cfg.class_names:
+                accumulate_class(class_name)
 
         # -----------------------------------
         # Step 2: Aggregate metrics from the metric data.
@@ -264,6 +312,10 @@ if __name__ == "__main__":
                         help='Whether to print to stdout.')
     parser.add_argument('--render_classes', type=str, default='', nargs='+',
                         help='For which classes we render tracking results to disk.')
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help='Number of processes over which the scenes are distributed, 0 for the main process.')
+    parser.add_argument('--tracks_cache_dir', type=str, default='',
+                        help='Folder to cache the GT and predicted tracks in. Empty disables the cache.')
     args = parser.parse_args()
 
     result_path_ = os.path.expanduser(args.result_path)
@@ -275,6 +327,8 @@ if __name__ == "__main__":
     render_curves_ = bool(args.render_curves)
     verbose_ = bool(args.verbose)
     render_classes_ = args.render_classes
+    num_workers_ = args.num_workers
+    tracks_cache_dir_ = os.path.expanduser(args.tracks_cache_dir) if args.tracks_cache_dir else None
 
     if config_path == '':
         cfg_ = config_factory('tracking_nips_2019')
@@ -284,5 +338,6 @@ if __name__ == "__main__":
 
     nusc_eval = TrackingEval(config=cfg_, result_path=result_path_, eval_set=eval_set_, output_dir=output_dir_,
                              nusc_version=version_, nusc_dataroot=dataroot_, verbose=verbose_,
-                             render_classes=render_classes_)
+                             render_classes=render_classes_, num_workers=num_workers_,
+                             tracks_cache_dir=tracks_cache_dir_)
     nusc_eval.main(render_curves=render_curves_)
@@ -1,13 +1,17 @@
 # nuScenes dev-kit.
 # Code written by Holger Caesar, Caglayan Dicle and Oscar Beijbom, 2019.
 
+import hashlib
+import json
+import os
 from bisect import bisect
 from collections import defaultdict
-from typing import DefaultDict, Dict, List
+from typing import DefaultDict, Dict, List, Optional, Union
 
 import numpy as np
 from nuscenes.eval.common.data_classes import EvalBoxes
-from nuscenes.eval.tracking.data_classes import TrackingBox
+from nuscenes.eval.common.loaders import gt_cache_key
+from nuscenes.eval.tracking.data_classes import TrackingBox, TrackingConfig, TrackTable
 from nuscenes.nuscenes import NuScenes
 from nuscenes.utils.splits import get_scenes_of_split
 from pyquaternion import Quaternion
@@ -92,79 +96,240 @@ def interpolate_tracks(tracks_by_timestamp: DefaultDict[int, List[TrackingBox]])
     return tracks_by_timestamp
 
 
-def create_tracks(all_boxes: EvalBoxes, nusc: NuScenes, eval_split: str, gt: bool) \
-        -> Dict[str, Dict[int, List[TrackingBox]]]:
+def slerp_quaternions(q0: np.ndarray, q1: np.ndarray, amount: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of pyquaternion's Quaternion.slerp.
+    :param q0: <float: N, 4> First quaternions (w, x, y, z).
+    :param q1: <float: N, 4> Second quaternions.
+    :param amount: <float: N> Interpolation parameters between 0 and 1.
+    :return: <float: N, 4> The interpolated unit quaternions.
+    """
+    def normalise(q):
+        # Same approximation as Quaternion._fast_normalise.
+        mag_squared = np.sum(q * q, axis=1)
+        error = np.abs(1.0 - mag_squared)
+        mag = np.where(error < 2.107342e-08, (1.0 + mag_squared) / 2.0, np.sqrt(mag_squared))
+        mag[(error < 1e-14) | (mag_squared == 0)] = 1.0
+        return q / mag[:, np.newaxis]
+
+    q0, q1 = normalise(q0), normalise(q1)
+    amount = np.clip(amount, 0, 1)[:, np.newaxis]
+    dot = np.sum(q0 * q1, axis=1)[:, np.newaxis]
+
+    # Take the shorter path.
+    q0 = np.where(dot < 0.0, -q0, q0)
+    dot = np.abs(dot)
+
+    # Linear interpolation if the quaternions are too close.
+    theta_0 = np.arccos(np.minimum(dot, 0.9995))
+    theta = theta_0 * amount
+    s0 = np.cos(theta) - dot * np.sin(theta) / np.sin(theta_0)
+    s1 = np.sin(theta) / np.sin(theta_0)
+    qr = np.where(dot > 0.9995, q0 + amount * (q1 - q0), s0 * q0 + s1 * q1)
+    return normalise(qr)
+
+
+def average_track_scores(table: TrackTable) -> TrackTable:
+    """
+    Replace box scores with track score (average box score).
+    :param table: The tracks of a scene.
+    :return: The tracks with the averaged scores.
+    """
+    _, track_inds = np.unique(table.tracking_id, return_inverse=True)
+    sums = np.bincount(track_inds, weights=table.tracking_score)
+    counts = np.bincount(track_inds)
+    table.tracking_score = (sums / np.maximum(counts, 1))[track_inds]
+    return table
+
+
+def interpolate_track_table(table: TrackTable) -> TrackTable:
+    """
+    Vectorized version of interpolate_tracks: fill in holes of the tracks of a scene by linear interpolation of the
+    previous and next box of each track (and slerp of the rotation). The interpolated boxes are appended to the boxes
+    of their timestamp in the order in which the tracks appear, as in interpolate_tracks.
+    :param table: The tracks of a scene.
+    :return: The interpolated tracks.
+    """
+    if table.num_rows == 0:
+        return table
+
+    # Sort the rows by track, ordered by first appearance, and by time.
+    _, first_rows, track_inds = np.unique(table.tracking_id, return_index=True, return_inverse=True)
+    track_rank = np.argsort(np.argsort(first_rows))[track_inds]
+    order = np.lexsort((np.arange(table.num_rows), track_rank))
+
+    # Find the gaps between consecutive boxes of a track.
+    left, right = order[:-1], order[1:]
+    gaps = (track_rank[left] == track_rank[right]) & (table.frame[right] - table.frame[left] > 1)
+    left, right = left[gaps], right[gaps]
+    if len(left) == 0:
+        return table
+    num_missing = table.frame[right] - table.frame[left] - 1
+    left, right = np.repeat(left, num_missing), np.repeat(right, num_missing)
+    frame = table.frame[left] + 1 + np.arange(len(left)) - np.repeat(np.cumsum(num_missing) - num_missing, num_missing)
+
+    # Note that the ratio is the weight given to the right box, as in interpolate_tracks.
+    left_timestamps, right_timestamps = table.timestamps[table.frame[left]], table.timestamps[table.frame[right]]
+    right_ratio = (right_timestamps - table.timestamps[frame]) / (right_timestamps - left_timestamps)
+
+    def interp(values):
+        ratio = right_ratio.reshape((-1,) + (1,) * (values.ndim - 1))
+        return (1.0 - ratio) * values[left] + ratio * values[right]
+
+    new_columns = {
+        'sample_token': table.sample_token[right],
+        'translation': interp(table.translation),
+        'size': interp(table.size),
+        'rotation': slerp_quaternions(table.rotation[left], table.rotation[right], right_ratio),
+        'velocity': interp(table.velocity),
+        'ego_translation': interp(table.ego_translation),  # May be inaccurate.
+        'num_pts': np.full(len(right), -1, dtype=np.int64),
+        'tracking_id': table.tracking_id[right],
+        'tracking_name': table.tracking_name[right],
+        'tracking_score': interp(table.tracking_score),  # Score will remain -1 for GT.
+    }
+
+    # Append the interpolated boxes of each timestamp, ordered by track.
+    all_frame = np.concatenate([table.frame, frame])
+    is_new = np.arange(len(all_frame)) >= table.num_rows
+    rank = np.concatenate([np.arange(table.num_rows), track_rank[right]])
+    order = np.lexsort((rank, is_new, all_frame))
+    columns = {name: np.concatenate([getattr(table, name), new_columns[name]])[order] for name in TrackTable.columns}
+    return TrackTable(table.timestamps, all_frame[order], **columns)
+
+
+def create_tracks(all_boxes: Union[EvalBoxes, Dict[str, np.ndarray]], nusc: NuScenes, eval_split: str, gt: bool) \
+        -> Dict[str, TrackTable]:
     """
     Returns all tracks for all scenes. Samples within a track are sorted in chronological order.
     This can be applied either to GT or predictions.
-    :param all_boxes: Holds all GT or predicted boxes.
+    :param all_boxes: Holds all GT or predicted boxes, either as EvalBoxes or in the columnar layout of
+        load_prediction_arrays.
     :param nusc: The NuScenes instance to load the sample information from.
     :param eval_split: The evaluation split for which we create tracks.
     :param gt: Whether we are creating tracks for GT or predictions
-    :return: The tracks.
+    :return: The tracks as {scene_token: TrackTable}, which can also be used as {timestamp: List[TrackingBox]}.
     """
     # Only keep samples from this split.
-    scenes_of_eval_split : List[str] = get_scenes_of_split(split_name=eval_split, nusc=nusc)
-
-    scene_tokens = set()
-    for sample_token in all_boxes.sample_tokens:
-        scene_token = nusc.get('sample', sample_token)['scene_token']
-        scene = nusc.get('scene', scene_token)
-        if scene['name'] in scenes_of_eval_split:
-            scene_tokens.add(scene_token)
-
-    # Tracks are stored as dict {scene_token: {timestamp: List[TrackingBox]}}.
-    tracks = defaultdict(lambda: defaultdict(list))
-
-    # Init all scenes and timestamps to guarantee completeness.
-    for scene_token in scene_tokens:
-        # Init all timestamps in this scene.
-        scene = nusc.get('scene', scene_token)
-        cur_sample_token = scene['first_sample_token']
-        while True:
-            # Initialize array for current timestamp.
-            cur_sample = nusc.get('sample', cur_sample_token)
-            tracks[scene_token][cur_sample['timestamp']] = []
-
-            # Abort after the last sample.
-            if cur_sample_token == scene['last_sample_token']:
-                break
-
-            # Move to next sample.
-            cur_sample_token = cur_sample['next']
-
-    # Group annotations wrt scene and timestamp.
-    for sample_token in all_boxes.sample_tokens:
-        sample_record = nusc.get('sample', sample_token)
-        scene_token = sample_record['scene_token']
-        tracks[scene_token][sample_record['timestamp']] = all_boxes.boxes[sample_token]
-
-    # Replace box scores with track score (average box score). This only affects the compute_thresholds method and
-    # should be done before interpolation to avoid diluting the original scores with interpolated boxes.
-    if not gt:
-        for scene_id, scene_tracks in tracks.items():
-            # For each track_id, collect the scores.
-            track_id_scores = defaultdict(list)
-            for timestamp, boxes in scene_tracks.items():
-                for box in boxes:
-                    track_id_scores[box.tracking_id].append(box.tracking_score)
-
-            # Compute average scores for each track.
-            track_id_avg_scores = {}
-            for tracking_id, scores in track_id_scores.items():
-                track_id_avg_scores[tracking_id] = np.mean(scores)
-
-            # Apply average score to each box.
-            for timestamp, boxes in scene_tracks.items():
-                for box in boxes:
-                    box.tracking_score = track_id_avg_scores[box.tracking_id]
-
-    # Interpolate GT and predicted tracks.
-    for scene_token in tracks.keys():
-        tracks[scene_token] = interpolate_tracks(tracks[scene_token])
+    scenes_of_eval_split = set(get_scenes_of_split(split_name=eval_split, nusc=nusc))
 
+    # Look up the scene and timestamp of all samples in one pass over the sample table.
+    scene_names = {scene['token']: scene['name'] for scene in nusc.scene}
+    sample_scene_timestamps = {}
+    scene_timestamps = defaultdict(list)
+    for sample in nusc.sample:
+        sample_scene_timestamps[sample['token']] = (sample['scene_token'], sample['timestamp'])
+        scene_timestamps[sample['scene_token']].append(sample['timestamp'])
+
+    # Group annotations wrt scene and timestamp. Packed boxes are grouped as sample indices instead.
+    if isinstance(all_boxes, EvalBoxes):
+        sample_tokens = all_boxes.sample_tokens
+    else:
+        sample_tokens = all_boxes['sample_tokens'].tolist()
+        sample_starts = np.cumsum(all_boxes['counts']) - all_boxes['counts']
+    boxes_by_scene = defaultdict(dict)
+    for ind, sample_token in enumerate(sample_tokens):
+        scene_token, timestamp = sample_scene_timestamps[sample_token]
+        if scene_names[scene_token] in scenes_of_eval_split:
+            boxes_by_scene[scene_token][timestamp] = \
+                all_boxes.boxes[sample_token] if isinstance(all_boxes, EvalBoxes) else ind
+
+    tracks = {}
+    for scene_token, boxes_by_timestamp in boxes_by_scene.items():
+        # Init all timestamps in this scene to guarantee completeness.
+        if isinstance(all_boxes, EvalBoxes):
+            table = TrackTable.from_boxes(sorted(scene_timestamps[scene_token]), boxes_by_timestamp)
+        else:
+            table = _track_table_from_arrays(sorted(scene_timestamps[scene_token]), all_boxes, sample_starts,
+                                             boxes_by_timestamp)
+
+        # Replace box scores with track score (average box score). This only affects the compute_thresholds method
+        # and should be done before interpolation to avoid diluting the original scores with interpolated boxes.
         if not gt:
-            # Make sure predictions are sorted in in time. (Always true for GT).
-            tracks[scene_token] = defaultdict(list, sorted(tracks[scene_token].items(), key=lambda kv: kv[0]))
+            table = average_track_scores(table)
+
+        # Interpolate GT and predicted tracks.
+        tracks[scene_token] = interpolate_track_table(table)
 
     return tracks
+
+
+def _track_table_from_arrays(timestamps: List[int],
+                             arrays: Dict[str, np.ndarray],
+                             sample_starts: np.ndarray,
+                             sample_ind_by_timestamp: Dict[int, int]) -> TrackTable:
+    """
+    Like TrackTable.from_boxes, but takes the rows of packed boxes instead of TrackingBoxes.
+    :param timestamps: All timestamps of the scene in chronological order.
+    :param arrays: The packed boxes of all samples, see load_prediction_arrays.
+    :param sample_starts: Row of the first box of each sample.
+    :param sample_ind_by_timestamp: Index into arrays['sample_tokens'] of each timestamp with boxes.
+    :return: The TrackTable.
+    """
+    sample_inds = np.array([sample_ind_by_timestamp[t] for t in timestamps if t in sample_ind_by_timestamp],
+                           dtype=np.int64)
+    frames = np.array([i for i, t in enumerate(timestamps) if t in sample_ind_by_timestamp], dtype=np.int64)
+    counts = arrays['counts'][sample_inds]
+    # The rows of each sample are consecutive, so they are its start row plus the position within the sample.
+    rows = np.repeat(sample_starts[sample_inds] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    columns = {name: arrays[name][rows] for name in TrackTable.columns if name != 'sample_token'}
+    columns['sample_token'] = np.repeat(arrays['sample_tokens'][sample_inds], counts)
+    return TrackTable(timestamps, np.repeat(frames, counts), **columns)
+
+
+def save_tracks(tracks: Dict[str, TrackTable], path: str) -> None:
+    """
+    Saves the tracks of create_tracks to a .npz file, so that they can be reused without the boxes and nuScenes.
+    :param tracks: The tracks of all scenes.
+    :param path: The output path.
+    """
+    content = {'%s/%s' % (scene_token, name): value
+               for scene_token, table in tracks.items() for name, value in table.serialize().items()}
+    # Write to a temporary file first so that concurrent evaluations never read a partial cache.
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **content)
+    os.replace(tmp_path, path)
+
+
+def load_tracks(path: str) -> Dict[str, TrackTable]:
+    """
+    Loads tracks saved with save_tracks.
+    :param path: The .npz file.
+    :return: The tracks of all scenes.
+    """
+    content = defaultdict(dict)
+    with np.load(path, allow_pickle=False) as f:
+        for key in f.files:
+            scene_token, name = key.split('/')
+            content[scene_token][name] = f[key]
+    return {scene_token: TrackTable.deserialize(scene_content) for scene_token, scene_content in content.items()}
+
+
+def tracks_cache_key(nusc: NuScenes,
+                     eval_split: str,
+                     config: TrackingConfig,
+                     result_path: Union[str, List[str]],
+                     sample_tokens: Optional[List[str]] = None) -> str:
+    """
+    Computes the key under which the GT and predicted tracks of an evaluation are cached.
+    The key changes whenever the GT cache key, the config or any of the result files changes.
+    :param nusc: A NuScenes instance.
+    :param eval_split: The evaluation split.
+    :param config: The TrackingConfig of the evaluation.
+    :param result_path: Path of the result file or a list of result files.
+    :param sample_tokens: Optional sample tokens of a custom split.
+    :return: A hex digest identifying the cache entry.
+    """
+    result_stats = []
+    for path in ([result_path] if isinstance(result_path, str) else result_path):
+        stat = os.stat(path)
+        result_stats.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+
+    content = {
+        'gt': gt_cache_key(nusc, eval_split, TrackingBox, config.class_range, sample_tokens=sample_tokens),
+        'config': config.serialize(),
+        'results': result_stats,
+    }
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
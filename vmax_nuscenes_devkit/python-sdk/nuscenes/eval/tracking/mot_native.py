@@ -0,0 +1,269 @@
+"""
+nuScenes dev-kit.
+
+NumPy implementation of the MOT accumulator and of the metrics in MOT_METRIC_MAP. It reproduces the events of
+py-motmetrics' MOTAccumulator (as merged by MOTAccumulatorCustom.merge_event_dataframes) and the metrics computed by the
+MetricsHost of create_motmetrics(), but stores the events in flat arrays instead of pandas dataframes.
+
+py-motmetrics at:
+https://github.com/cheind/py-motmetrics
+"""
+import math
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from nuscenes.eval.tracking.metrics import motar, mota_custom, faf
+
+# Event types. The RAW events of motmetrics are not stored as none of the metrics uses them.
+MATCH, SWITCH, MISS, FP = 0, 1, 2, 3
+
+
+class MOTEvents(NamedTuple):
+    """ Event log of a MOTAccumulatorNative. Ids are unique across scenes and -1 if there is no object/hypothesis. """
+    frame_id: np.ndarray  # <int64: N>.
+    type: np.ndarray  # <int8: N> with MATCH, SWITCH, MISS or FP.
+    oid: np.ndarray  # <int64: N>.
+    hid: np.ndarray  # <int64: N>.
+    distance: np.ndarray  # <float64: N>, nan for MISS and FP.
+    num_frames: int
+
+
+class MOTAccumulatorNative:
+    def __init__(self):
+        """
+        Accumulates the MOT events of all scenes of a class.
+        Frame ids are assigned consecutively and the object/hypothesis ids of each scene are mapped to new integer ids,
+        which is equivalent to merging the per-scene MOTAccumulators with merge_event_dataframes().
+        """
+        self.num_frames = 0
+        self.oid_offset = 0
+        self.hid_offset = 0
+        self.oid_map = {}
+        self.hid_map = {}
+        self.matches = {}  # Last hypothesis matched to each object of the current scene.
+
+        self._frame_ids = []
+        self._types = []
+        self._oids = []
+        self._hids = []
+        self._distances = []
+
+    def new_scene(self) -> None:
+        """ Starts a new scene, i.e. forgets the ids and previous associations. """
+        self.oid_offset += len(self.oid_map)
+        self.hid_offset += len(self.hid_map)
+        self.oid_map = {}
+        self.hid_map = {}
+        self.matches = {}
+
+    def update(self, gt_ids: List[Any], pred_ids: List[Any], distances: np.ndarray) -> Tuple[List[int], List[int]]:
+        """
+        Adds the events of a frame, following the algorithm of motmetrics' MOTAccumulator.update:
+        1. Keep the objects matched to the same hypothesis as in previous frames if their distance is finite.
+        2. Match the remaining objects and hypotheses with the Hungarian algorithm. If an object was previously
+           matched to a different hypothesis, this is a SWITCH.
+        3. The remaining objects are MISSes and the remaining hypotheses are FPs.
+        :param gt_ids: The tracking ids of the GT boxes.
+        :param pred_ids: The tracking ids of the predicted boxes.
+        :param distances: <float: len(gt_ids), len(pred_ids)> distances, nan for pairs that may not be matched.
+        :return: The indices of the predicted boxes with a MATCH and with a SWITCH event in this frame.
+        """
+        oids = self._map_ids(gt_ids, self.oid_map, self.oid_offset)
+        hids = self._map_ids(pred_ids, self.hid_map, self.hid_offset)
+        oid_free = [True] * len(oids)
+        hid_free = [True] * len(hids)
+        match_inds, switch_inds = [], []
+        frame_types, frame_oids, frame_hids, frame_distances = [], [], [], []
+
+        if len(oids) > 0 and len(hids) > 0:
+            # 1. Re-establish tracks from previous correspondences.
+            hid_inds = {}
+            for j, h in enumerate(hids):
+                hid_inds.setdefault(h, j)
+            for i, o in enumerate(oids):
+                j = hid_inds.get(self.matches.get(o, -1))
+                if j is None:
+                    continue
+                if not hid_free[j]:
+                    # Only happens with duplicate ids, take the next free hypothesis with this id.
+                    j = next((k for k in range(j + 1, len(hids)) if hids[k] == hids[j] and hid_free[k]), None)
+                    if j is None:
+                        continue
+                distance = distances[i, j]
+                if not math.isfinite(distance):
+                    continue
+                oid_free[i] = hid_free[j] = False
+                match_inds.append(j)
+                frame_types.append(MATCH)
+                frame_oids.append(o)
+                frame_hids.append(hids[j])
+                frame_distances.append(distance)
+
+            # 2. Match the remaining objects and hypotheses.
+            # Unassignable pairs are set to the same value as in motmetrics' scipy solver to get the same assignment.
+            if any(oid_free) and any(hid_free):
+                costs = distances.astype(float)
+                costs[np.logical_not(oid_free), :] = np.nan
+                costs[:, np.logical_not(hid_free)] = np.nan
+                valid = np.isfinite(costs)
+                if np.any(valid):
+                    costs[~valid] = 2 * costs[valid].max() + 1
+                    for i, j in zip(*linear_sum_assignment(costs)):
+                        if not valid[i, j]:
+                            continue
+                        o, h = oids[i], hids[j]
+                        is_switch = o in self.matches and self.matches[o] != h
+                        (switch_inds if is_switch else match_inds).append(j)
+                        frame_types.append(SWITCH if is_switch else MATCH)
+                        frame_oids.append(o)
+                        frame_hids.append(h)
+                        frame_distances.append(distances[i, j])
+                        oid_free[i] = hid_free[j] = False
+                        self.matches[o] = h
+
+        # 3. All remaining objects are missed and all remaining hypotheses are false positives.
+        missed = [o for o, free in zip(oids, oid_free) if free]
+        false_positives = [h for h, free in zip(hids, hid_free) if free]
+        frame_types.extend([MISS] * len(missed) + [FP] * len(false_positives))
+        frame_oids.extend(missed + [-1] * len(false_positives))
+        frame_hids.extend([-1] * len(missed) + false_positives)
+        frame_distances.extend([np.nan] * (len(missed) + len(false_positives)))
+
+        self._frame_ids.extend([self.num_frames] * len(frame_types))
+        self._types.extend(frame_types)
+        self._oids.extend(frame_oids)
+        self._hids.extend(frame_hids)
+        self._distances.extend(frame_distances)
+        self.num_frames += 1
+
+        return match_inds, switch_inds
+
+    @property
+    def events(self) -> MOTEvents:
+        """ All events accumulated so far. """
+        return MOTEvents(frame_id=np.array(self._frame_ids, dtype=np.int64),
+                         type=np.array(self._types, dtype=np.int8),
+                         oid=np.array(self._oids, dtype=np.int64),
+                         hid=np.array(self._hids, dtype=np.int64),
+                         distance=np.array(self._distances, dtype=np.float64),
+                         num_frames=self.num_frames)
+
+    @staticmethod
+    def _map_ids(ids: List[Any], id_map: Dict[Any, int], offset: int) -> List[int]:
+        """ Maps the tracking ids of a scene to integer ids, which start at offset for each scene. """
+        for x in ids:
+            if x not in id_map:
+                id_map[x] = offset + len(id_map)
+        return [id_map[x] for x in ids]
+
+
+def compute_mot_metrics(events: MOTEvents) -> Dict[str, float]:
+    """
+    Computes the metrics of MOT_METRIC_MAP from an event log, with the same definitions as the motmetrics functions and
+    the custom metrics in nuscenes.eval.tracking.metrics.
+    :param events: The events of all scenes of a class.
+    :return: Mapping from motmetrics metric name to value.
+    """
+    counts = np.bincount(events.type, minlength=4)
+    num_matches, num_switches, num_misses, num_false_positives = [int(c) for c in counts]
+    num_detections = num_matches + num_switches
+    num_objects = num_detections + num_misses
+    num_predictions = num_detections + num_false_positives
+
+    # Sort the object events by object and frame, so that each object is a contiguous sequence in time.
+    is_obj = events.oid >= 0
+    order = np.lexsort((events.frame_id[is_obj], events.oid[is_obj]))
+    oid = events.oid[is_obj][order]
+    frame_id = events.frame_id[is_obj][order]
+    tracked = events.type[is_obj][order] != MISS
+
+    # Per object: number of frames, number of tracked frames, first and last frame.
+    _, starts, obj_frequencies = np.unique(oid, return_index=True, return_counts=True)
+    obj_inds = np.repeat(np.arange(len(starts)), obj_frequencies)
+    num_tracked = np.bincount(obj_inds, weights=tracked, minlength=len(starts))
+    track_ratios = num_tracked / obj_frequencies
+    first_frame = frame_id[starts]
+    last_frame = frame_id[starts + obj_frequencies - 1]
+
+    # Per matched object: first and last tracked frame.
+    matched = num_tracked > 0
+    num_matched = int(matched.sum())
+    tracked_inds = obj_inds[tracked]
+    tracked_frame_id = frame_id[tracked]
+    tracked_objs, tracked_starts, tracked_counts = np.unique(tracked_inds, return_index=True, return_counts=True)
+    tracked_ends = tracked_starts + tracked_counts - 1
+    first_tracked = np.zeros(len(starts), dtype=np.int64)
+    last_tracked = np.zeros(len(starts), dtype=np.int64)
+    first_tracked[tracked_objs] = tracked_frame_id[tracked_starts]
+    last_tracked[tracked_objs] = tracked_frame_id[tracked_ends]
+
+    # Track initialization duration, in sample periods of 0.5s.
+    tid = np.nan if num_matched == 0 else \
+        float(np.sum(first_tracked[matched] - first_frame[matched])) * 0.5 / num_matched
+
+    # Longest gap duration: the largest number of consecutive untracked frames between the first and last frame.
+    if len(starts) == 0 or num_matched == 0:
+        lgd = np.nan
+    else:
+        gaps = np.maximum(first_tracked - first_frame, last_frame - last_tracked)
+        inner = tracked_inds[1:] == tracked_inds[:-1]
+        np.maximum.at(gaps, tracked_inds[1:][inner], np.diff(tracked_frame_id)[inner] - 1)
+        lgd = float(np.sum(gaps[matched])) * 0.5 / num_matched
+
+    # Fragmentations: transitions from tracked to missed before the last tracked frame of an object.
+    last_tracked_pos = np.full(len(starts), -1, dtype=np.int64)
+    last_tracked_pos[tracked_objs] = np.flatnonzero(tracked)[tracked_ends]
+    same_obj = obj_inds[1:] == obj_inds[:-1]
+    before_last = np.arange(1, len(oid)) < last_tracked_pos[obj_inds[1:]]
+    fragmentation = tracked[:-1] & ~tracked[1:] & same_obj & before_last
+
+    num_frames = events.num_frames
+    is_det = (events.type == MATCH) | (events.type == SWITCH)
+    return {
+        'num_frames': num_frames,
+        'num_objects': num_objects,
+        'num_predictions': num_predictions,
+        'num_matches': num_matches,
+        'motar': motar(None, num_matches, num_misses, num_switches, num_false_positives, num_objects),
+        'mota_custom': mota_custom(None, num_misses, num_switches, num_false_positives, num_objects),
+        'motp_custom': np.nan if num_detections == 0 else events.distance[is_det].sum() / num_detections,
+        'faf': faf(None, num_false_positives, num_frames),
+        'mostly_tracked': int(np.sum(track_ratios >= 0.8)),
+        'mostly_lost': int(np.sum(track_ratios < 0.2)),
+        'num_false_positives': num_false_positives,
+        'num_misses': num_misses,
+        'num_switches': num_switches,
+        'num_fragmentations_custom': int(fragmentation.sum()),
+        'recall': num_detections / num_objects,
+        'tid': tid,
+        'lgd': lgd
+    }
+
+
+def merge_events(events_list: List[MOTEvents]) -> MOTEvents:
+    """
+    Merges event logs, e.g. of different scenes, making frame ids and object/hypothesis ids unique.
+    :param events_list: The event logs to merge.
+    :return: The merged event log.
+    """
+    if len(events_list) == 0:
+        return MOTAccumulatorNative().events
+
+    frame_offsets = np.cumsum([0] + [events.num_frames for events in events_list])
+    oid_offsets = np.cumsum([0] + [events.oid.max(initial=-1) + 1 for events in events_list])
+    hid_offsets = np.cumsum([0] + [events.hid.max(initial=-1) + 1 for events in events_list])
+
+    def concat(name, offsets=None):
+        values = [getattr(events, name) for events in events_list]
+        if offsets is not None:
+            values = [np.where(x >= 0, x + offset, x) for x, offset in zip(values, offsets)]
+        return np.concatenate(values)
+
+    return MOTEvents(frame_id=concat('frame_id', frame_offsets),
+                     type=concat('type'),
+                     oid=concat('oid', oid_offsets),
+                     hid=concat('hid', hid_offsets),
+                     distance=concat('distance'),
+                     num_frames=int(frame_offsets[-1]))
@@ -1,14 +1,20 @@
 import copy
+import os
+import tempfile
 import unittest
 from collections import defaultdict
+from multiprocessing import Pool
+from types import SimpleNamespace
 from typing import Tuple, Dict, List
 
 import numpy as np
+from pyquaternion import Quaternion
 
 from nuscenes.eval.common.config import config_factory
 from nuscenes.eval.tracking.algo import TrackingEvaluation
-from nuscenes.eval.tracking.data_classes import TrackingMetricData, TrackingBox
-from nuscenes.eval.tracking.loaders import interpolate_tracks
+from nuscenes.eval.tracking.data_classes import TrackingMetricData, TrackingBox, TrackTable
+from nuscenes.eval.tracking.loaders import interpolate_tracks, interpolate_track_table, load_tracks, save_tracks, \
+    tracks_cache_key
 from nuscenes.eval.tracking.tests.scenarios import get_scenarios
 
 
@@ -258,6 +264,89 @@ class TestAlgo(unittest.TestCase):
         assert np.all(md.frag == 0)
         assert np.all(md.ids == 0)
 
+    def test_track_table(self):
+        """ Test that TrackTables are interpolated and evaluated like the box dicts. """
+
+        # Get config.
+        cfg = config_factory('tracking_nips_2019')
+
+        # Create GT and predicted tracks with holes.
+        np.random.seed(42)
+        tracks = []
+        for tag in ['gt', 'pred']:
+            timestamp_boxes = defaultdict(list)
+            for timestamp in range(10):
+                for obj_id in np.random.permutation(5):
+                    if np.random.rand() < 0.3:
+                        continue
+                    rotation = tuple(Quaternion(axis=(0, 0, 1), angle=np.random.uniform(-np.pi, np.pi)).elements)
+                    xy = np.random.uniform(-10, 10, 2)
+                    timestamp_boxes[timestamp * 500000].append(
+                        TrackingBox(sample_token=str(timestamp), translation=(xy[0], xy[1], 0.0), rotation=rotation,
+                                    tracking_id='%s_%d' % (tag, obj_id), tracking_name='car',
+                                    tracking_score=float(np.random.rand()) if tag == 'pred' else -1.0))
+            tracks.append(timestamp_boxes)
+        timestamps = np.arange(10) * 500000
+
+        # Check the interpolation.
+        tracks_table = [interpolate_track_table(TrackTable.from_boxes(timestamps, t)) for t in tracks]
+        tracks_dict = [interpolate_tracks(defaultdict(list, sorted(copy.deepcopy(t).items()))) for t in tracks]
+        for table, boxes_by_timestamp in zip(tracks_table, tracks_dict):
+            self.assertEqual(list(table.keys()), list(boxes_by_timestamp.keys()))
+            for timestamp in table.keys():
+                self.assertEqual(len(table[timestamp]), len(boxes_by_timestamp[timestamp]))
+                for box, expected in zip(table[timestamp], boxes_by_timestamp[timestamp]):
+                    self.assertEqual(box.tracking_id, expected.tracking_id)
+                    self.assertEqual(box.translation, tuple(expected.translation))
+                    np.testing.assert_allclose(box.rotation, expected.rotation, atol=1e-12)
+
+        # Check the metrics.
+        mds = []
+        for tracks_gt, tracks_pred in [tracks_table, tracks_dict]:
+            ev = TrackingEvaluation({'scene-1': tracks_gt}, {'scene-1': tracks_pred}, 'car', cfg.dist_fcn_callable,
+                                    cfg.dist_th_tp, cfg.min_recall, num_thresholds=TrackingMetricData.nelem,
+                                    metric_worst=cfg.metric_worst, verbose=False)
+            mds.append(ev.accumulate())
+        for metric_name in ['confidence', 'recall_hypo'] + TrackingMetricData.metrics:
+            np.testing.assert_array_equal(mds[0].get_metric(metric_name), mds[1].get_metric(metric_name),
+                                          err_msg=metric_name)
+
+    def test_tracks_cache(self):
+        """ Test that saved tracks load unchanged and that the cache key follows the result files and the config. """
+        cfg = config_factory('tracking_nips_2019')
+        box = TrackingBox(sample_token='a', translation=(1, 2, 3), tracking_id='t1', tracking_name='car',
+                          tracking_score=0.5)
+        tracks = {'scene-1': TrackTable.from_boxes(np.array([0, 500000]), {0: [box], 500000: []})}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tracks_path = os.path.join(tmp_dir, 'tracks.npz')
+            save_tracks(tracks, tracks_path)
+            loaded = load_tracks(tracks_path)
+            self.assertEqual(list(loaded.keys()), ['scene-1'])
+            self.assertEqual(list(loaded['scene-1'].keys()), [0, 500000])
+            self.assertEqual(loaded['scene-1'][0][0].tracking_id, 't1')
+            self.assertEqual(loaded['scene-1'][0][0].translation, (1, 2, 3))
+
+            table_root = os.path.join(tmp_dir, 'tables')
+            os.makedirs(table_root)
+            nusc = SimpleNamespace(version='v1.0-mini', table_root=table_root, category=[{'name': 'vehicle.car'}])
+            result_path = os.path.join(tmp_dir, 'results.json')
+            with open(result_path, 'w') as f:
+                f.write('{}')
+
+            key = tracks_cache_key(nusc, 'mini_val', cfg, result_path)
+            self.assertEqual(key, tracks_cache_key(nusc, 'mini_val', cfg, [result_path]))
+            self.assertNotEqual(key, tracks_cache_key(nusc, 'mini_train', cfg, result_path))
+            self.assertNotEqual(key, tracks_cache_key(nusc, 'mini_val', config_factory('tracking_nips_2019'),
+                                                      [result_path, result_path]))
+            cfg_changed = config_factory('tracking_nips_2019')
+            cfg_changed.dist_th_tp += 1.0
+            self.assertNotEqual(key, tracks_cache_key(nusc, 'mini_val', cfg_changed, result_path))
+
+            stat = os.stat(result_path)
+            os.utime(result_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            self.assertNotEqual(key, tracks_cache_key(nusc, 'mini_val', cfg, result_path))
+
     def test_scenarios(self):
         """ More flexible scenario test structure. """
 
@@ -292,6 +381,61 @@ class TestAlgo(unittest.TestCase):
                 metric_values = metric_values[np.logical_not(np.isnan(metric_values))]
                 assert np.all(metric_values == value)
 
+    def test_native_motmetrics(self):
+        """ Test that the NumPy implementation gives the same metrics as py-motmetrics. """
+
+        # Get config.
+        cfg = config_factory('tracking_nips_2019')
+
+        # Create random scenes with misses, identity switches and false positives.
+        np.random.seed(42)
+        tracks_gt, tracks_pred = {}, {}
+        for scene_id in range(3):
+            num_objects, num_frames = 8, 15
+            pos = np.random.uniform(-20, 20, (num_objects, 2))
+            vel = np.random.normal(0, 1, (num_objects, 2))
+            first_frame = np.random.randint(0, num_frames, num_objects)
+            scores = np.random.uniform(0, 1, num_objects)
+            tracks_gt[scene_id], tracks_pred[scene_id] = {}, {}
+            for timestamp in range(num_frames):
+                tracks_gt[scene_id][timestamp], tracks_pred[scene_id][timestamp] = [], []
+                for obj_id in np.where(first_frame <= timestamp)[0]:
+                    xy = pos[obj_id] + vel[obj_id] * timestamp
+                    tracks_gt[scene_id][timestamp].append(
+                        TrackingBox(translation=(xy[0], xy[1], 0), tracking_id='gt_%d' % obj_id, tracking_name='car'))
+                    if np.random.rand() < 0.2:
+                        continue
+                    pred_id = obj_id if np.random.rand() < 0.9 else np.random.randint(num_objects)
+                    xy = xy + np.random.normal(0, 1, 2)
+                    tracks_pred[scene_id][timestamp].append(
+                        TrackingBox(translation=(xy[0], xy[1], 0), tracking_id='pred_%d' % pred_id,
+                                    tracking_name='car', tracking_score=float(scores[obj_id])))
+
+        # Accumulate metrics with both implementations.
+        mds = []
+        for use_motmetrics in [True, False]:
+            ev = TrackingEvaluation(tracks_gt, tracks_pred, 'car', cfg.dist_fcn_callable,
+                                    cfg.dist_th_tp, cfg.min_recall, num_thresholds=TrackingMetricData.nelem,
+                                    metric_worst=cfg.metric_worst, verbose=False, use_motmetrics=use_motmetrics)
+            mds.append(ev.accumulate())
+
+        # Check outputs.
+        md_motmetrics, md_native = mds
+        assert np.nanmax(md_native.ids) > 0 and np.nanmax(md_native.frag) > 0
+        for metric_name in ['confidence', 'recall_hypo'] + TrackingMetricData.metrics:
+            np.testing.assert_allclose(md_native.get_metric(metric_name), md_motmetrics.get_metric(metric_name),
+                                       rtol=1e-12, err_msg=metric_name)
+
+        # Distribute the scenes over a process pool.
+        with Pool(2) as pool:
+            ev = TrackingEvaluation(tracks_gt, tracks_pred, 'car', cfg.dist_fcn_callable,
+                                    cfg.dist_th_tp, cfg.min_recall, num_thresholds=TrackingMetricData.nelem,
+                                    metric_worst=cfg.metric_worst, verbose=False, pool=pool)
+            md_pool = ev.accumulate()
+        for metric_name in ['confidence', 'recall_hypo'] + TrackingMetricData.metrics:
+            np.testing.assert_array_equal(md_pool.get_metric(metric_name), md_native.get_metric(metric_name),
+                                          err_msg=metric_name)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,10 +5,12 @@ import json
 import math
 import os
 import os.path as osp
+import pickle
 import sys
 import time
+from collections import defaultdict
 from datetime import datetime
-from typing import Tuple, List, Iterable
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 import cv2
 import matplotlib.pyplot as plt
@@ -32,6 +34,9 @@ from nuscenes.utils.color_map import get_colormap
 
 PYTHON_VERSION = sys.version_info[0]
 
+# Bump whenever the reverse indexing or the layout of the lazy table cache changes.
+TABLE_CACHE_FORMAT = 1
+
 if not PYTHON_VERSION == 3:
     raise ValueError("nuScenes dev-kit only supports Python version 3.")
 
@@ -45,17 +50,25 @@ class NuScenes:
                  version: str = 'v1.0-mini',
                  dataroot: str = '/data/sets/nuscenes',
                  verbose: bool = True,
-                 map_resolution: float = 0.1):
+                 map_resolution: float = 0.1,
+                 lazy: bool = False,
+                 cache_dir: str = None):
         """
         Loads database and creates reverse indexes and shortcuts.
         :param version: Version to load (e.g. "v1.0", ...).
         :param dataroot: Path to the tables and data.
         :param verbose: Whether to print status messages during load.
         :param map_resolution: Resolution of maps (meters).
+        :param lazy: Whether to load each table on first access from a binary cache of the reverse-indexed tables.
+            The cache is built from the JSON tables once and rebuilt whenever one of them changes.
+        :param cache_dir: Folder of the table cache used in lazy mode. Defaults to <dataroot>/table_cache/<version>.
         """
         self.version = version
         self.dataroot = dataroot
         self.verbose = verbose
+        self.map_resolution = map_resolution
+        self.lazy = lazy
+        self.cache_dir = cache_dir if cache_dir is not None else osp.join(dataroot, 'table_cache', version)
         self.table_names = ['category', 'attribute', 'visibility', 'instance', 'sensor', 'calibrated_sensor',
                             'ego_pose', 'log', 'scene', 'sample', 'sample_data', 'sample_annotation', 'map']
 
@@ -65,25 +78,32 @@ class NuScenes:
         if verbose:
             print("======\nLoading NuScenes tables for version {}...".format(self.version))
 
-        # Explicitly assign tables to help the IDE determine valid class members.
-        self.category = self.__load_table__('category')
-        self.attribute = self.__load_table__('attribute')
-        self.visibility = self.__load_table__('visibility')
-        self.instance = self.__load_table__('instance')
-        self.sensor = self.__load_table__('sensor')
-        self.calibrated_sensor = self.__load_table__('calibrated_sensor')
-        self.ego_pose = self.__load_table__('ego_pose')
-        self.log = self.__load_table__('log')
-        self.scene = self.__load_table__('scene')
-        self.sample = self.__load_table__('sample')
-        self.sample_data = self.__load_table__('sample_data')
-        self.sample_annotation = self.__load_table__('sample_annotation')
-        self.map = self.__load_table__('map')
+        lidar_tasks = [t for t in ['lidarseg', 'panoptic'] if osp.exists(osp.join(self.table_root, t + '.json'))]
+
+        if self.lazy:
+            # Tables are loaded from the cache on first access, see __getattr__.
+            self.table_names.extend(lidar_tasks)
+            self._token2ind: Dict[str, Optional[dict]] = {table: None for table in self.table_names}
+            self.__prepare_table_cache__(verbose)
+        else:
+            # Explicitly assign tables to help the IDE determine valid class members.
+            self.category = self.__load_table__('category')
+            self.attribute = self.__load_table__('attribute')
+            self.visibility = self.__load_table__('visibility')
+            self.instance = self.__load_table__('instance')
+            self.sensor = self.__load_table__('sensor')
+            self.calibrated_sensor = self.__load_table__('calibrated_sensor')
+            self.ego_pose = self.__load_table__('ego_pose')
+            self.log = self.__load_table__('log')
+            self.scene = self.__load_table__('scene')
+            self.sample = self.__load_table__('sample')
+            self.sample_data = self.__load_table__('sample_data')
+            self.sample_annotation = self.__load_table__('sample_annotation')
+            self.map = self.__load_table__('map')
 
         # Initialize the colormap which maps from class names to RGB values.
         self.colormap = get_colormap()
 
-        lidar_tasks = [t for t in ['lidarseg', 'panoptic'] if osp.exists(osp.join(self.table_root, t + '.json'))]
         if len(lidar_tasks) > 0:
             self.lidarseg_idx2name_mapping = dict()
             self.lidarseg_name2idx_mapping = dict()
@@ -91,18 +111,14 @@ class NuScenes:
         for i, lidar_task in enumerate(lidar_tasks):
             if self.verbose:
                 print(f'Loading nuScenes-{lidar_task}...')
-            if lidar_task == 'lidarseg':
-                self.lidarseg = self.__load_table__(lidar_task)
-            else:
-                self.panoptic = self.__load_table__(lidar_task)
-
-            setattr(self, lidar_task, self.__load_table__(lidar_task))
+            if not self.lazy:
+                setattr(self, lidar_task, self.__load_table__(lidar_task))
+                self.table_names.append(lidar_task)
             label_files = os.listdir(os.path.join(self.dataroot, lidar_task, self.version))
             num_label_files = len([name for name in label_files if (name.endswith('.bin') or name.endswith('.npz'))])
             num_lidarseg_recs = len(getattr(self, lidar_task))
             assert num_lidarseg_recs == num_label_files, \
                 f'Error: there are {num_label_files} label files but {num_lidarseg_recs} {lidar_task} records.'
-            self.table_names.append(lidar_task)
             # Sort the colormap to ensure that it is ordered according to the indices in self.category.
             self.colormap = dict({c['name']: self.colormap[c['name']]
                                   for c in sorted(self.category, key=lambda k: k['index'])})
@@ -111,21 +127,40 @@ class NuScenes:
         if osp.exists(osp.join(self.table_root, 'image_annotations.json')):
             self.image_annotations = self.__load_table__('image_annotations')
 
-        # Initialize map mask for each map record.
-        for map_record in self.map:
-            map_record['mask'] = MapMask(osp.join(self.dataroot, map_record['filename']), resolution=map_resolution)
+        if not self.lazy:
+            # Initialize map mask for each map record.
+            self.__init_map_masks__(self.map)
 
         if verbose:
-            for table in self.table_names:
-                print("{} {},".format(len(getattr(self, table)), table))
-            print("Done loading in {:.3f} seconds.\n======".format(time.time() - start_time))
+            if not self.lazy:
+                for table in self.table_names:
+                    print("{} {},".format(len(getattr(self, table)), table))
+            print("Done loading in {:.3f} seconds (lazy={}).\n======".format(time.time() - start_time, self.lazy))
 
-        # Make reverse indexes for common lookups.
-        self.__make_reverse_index__(verbose)
+        # Make reverse indexes for common lookups. In lazy mode the cached tables are already reverse-indexed.
+        if not self.lazy:
+            self.__make_reverse_index__(verbose)
+
+        # Secondary indexes for field2token, built on demand.
+        self._field_index: Dict[Tuple[str, Union[str, Tuple[str, ...]]], Optional[Dict[Any, List[str]]]] = dict()
 
         # Initialize NuScenesExplorer class.
         self.explorer = NuScenesExplorer(self)
 
+    def __getattr__(self, attr_name: str) -> Any:
+        """
+        Implement lazy loading for the database tables. Otherwise throw the default error.
+        :param attr_name: The name of the variable to look for.
+        :return: The list of records that represents that table.
+        """
+        # Use __dict__ to avoid recursion before the instance is fully initialized, e.g. when unpickling.
+        if self.__dict__.get('lazy', False) and attr_name in self.__dict__.get('table_names', ()):
+            table = self.__load_cached_table__(attr_name)
+            setattr(self, attr_name, table)
+            return table
+        else:
+            raise AttributeError("Error: %r object has no attribute %r" % (self.__class__.__name__, attr_name))
+
     @property
     def table_root(self) -> str:
         """ Returns the folder where the tables are stored for the relevant version. """
@@ -137,6 +172,79 @@ class NuScenes:
             table = json.load(f)
         return table
 
+    def __init_map_masks__(self, map_table: List[dict]) -> None:
+        """
+        Initialize the map mask for each map record. The mask images themselves are only read when used.
+        :param map_table: The records of the map table.
+        """
+        for map_record in map_table:
+            map_record['mask'] = MapMask(osp.join(self.dataroot, map_record['filename']),
+                                         resolution=self.map_resolution)
+
+    def __table_cache_manifest__(self) -> dict:
+        """
+        Describes the JSON tables the table cache is built from.
+        :return: The manifest, which changes whenever one of the JSON tables changes.
+        """
+        tables = dict()
+        for table_name in self.table_names:
+            stat = os.stat(osp.join(self.table_root, '{}.json'.format(table_name)))
+            tables[table_name] = [stat.st_mtime_ns, stat.st_size]
+        return {'format': TABLE_CACHE_FORMAT, 'tables': tables}
+
+    def __prepare_table_cache__(self, verbose: bool) -> None:
+        """
+        Builds the table cache used in lazy mode if it is missing or outdated.
+        Building loads and reverse-indexes all tables once, so they stay loaded in this instance.
+        :param verbose: Whether to print outputs.
+        """
+        manifest = self.__table_cache_manifest__()
+        manifest_path = osp.join(self.cache_dir, 'manifest.json')
+        if osp.exists(manifest_path):
+            with open(manifest_path) as f:
+                if json.load(f) == manifest:
+                    return
+
+        if verbose:
+            print("Building table cache in {}...".format(self.cache_dir))
+        for table_name in self.table_names:
+            setattr(self, table_name, self.__load_table__(table_name))
+        self.__make_reverse_index__(verbose)
+
+        # Write each table to a temporary file first so that concurrent readers never see a partial table.
+        # The manifest is written last, as it marks the cache as complete.
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for table_name in self.table_names + ['manifest']:
+            ext = 'json' if table_name == 'manifest' else 'pkl'
+            path = osp.join(self.cache_dir, '{}.{}'.format(table_name, ext))
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            if table_name == 'manifest':
+                with open(tmp_path, 'w') as f:
+                    json.dump(manifest, f)
+            else:
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(getattr(self, table_name), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+        self.__init_map_masks__(self.map)
+
+    def __load_cached_table__(self, table_name: str) -> List[dict]:
+        """
+        Load a reverse-indexed table from the table cache.
+        :param table_name: The name of the table to load.
+        :return: The table records.
+        """
+        start_time = time.time()
+        with open(osp.join(self.cache_dir, '{}.pkl'.format(table_name)), 'rb') as f:
+            table = pickle.load(f)
+        if table_name == 'map':
+            self.__init_map_masks__(table)
+
+        if self.verbose:
+            print("Loaded {} {}(s) in {:.3f}s,".format(len(table), table_name, time.time() - start_time))
+
+        return table
+
     def load_lidarseg_cat_name_mapping(self):
         """ Create mapping from class index to class name, and vice versa, for easy lookup later on """
         for lidarseg_category in self.category:
@@ -158,7 +266,7 @@ class NuScenes:
             print("Reverse indexing ...")
 
         # Store the mapping from token to table index for each table.
-        self._token2ind = dict()
+        self._token2ind: Dict[str, Optional[dict]] = dict()
         for table in self.table_names:
             self._token2ind[table] = dict()
 
@@ -222,23 +330,73 @@ class NuScenes:
         :param token: Token of the record.
         :return: The index of the record in table, table is an array.
         """
+        # Lazy loading: Compute reverse indices.
+        if self._token2ind[table_name] is None:
+            self._token2ind[table_name] = dict()
+            for ind, member in enumerate(getattr(self, table_name)):
+                self._token2ind[table_name][member['token']] = ind
+
         return self._token2ind[table_name][token]
 
-    def field2token(self, table_name: str, field: str, query) -> List[str]:
+    def field2token(self, table_name: str, field: Union[str, Tuple[str, ...]], query) -> List[str]:
         """
         This function queries all records for a certain field value, and returns the tokens for the matching records.
-        Warning: this runs in linear time.
+        The first query of a field builds a secondary index of the table (see create_field_index), later queries of
+        the same field run in constant time. Fields with unhashable values, e.g. lists, fall back to a linear scan.
         :param table_name: Table name.
-        :param field: Field name. See README.md for details.
-        :param query: Query to match against. Needs to type match the content of the query field.
+        :param field: Field name, or a tuple of field names to query several fields at once. See README.md for details.
+        :param query: Query to match against. Needs to type match the content of the query field, or be a tuple of
+            values for a tuple of fields.
         :return: List of tokens for the matching records.
         """
+        index = self.create_field_index(table_name, field)
+        if index is not None:
+            try:
+                return list(index.get(query, []))
+            except TypeError:
+                # Unhashable queries cannot be looked up, scan the table instead.
+                pass
+
+        fields = field if isinstance(field, tuple) else None
         matches = []
         for member in getattr(self, table_name):
-            if member[field] == query:
+            value = tuple(member[f] for f in fields) if fields is not None else member[field]
+            if value == query:
                 matches.append(member['token'])
         return matches
 
+    def create_field_index(self, table_name: str, field: Union[str, Tuple[str, ...]]) \
+            -> Optional[Dict[Any, List[str]]]:
+        """
+        Declares a secondary index on a table, e.g. ('sample', 'scene_token'), ('sample_annotation', 'instance_token')
+        or ('sample_data', ('sample_token', 'channel')). The index maps each value of the field (or tuple of values)
+        to the tokens of the matching records in table order. It is built on first use and cached, so calling this
+        explicitly is only needed to build it ahead of time, e.g. before forking workers.
+        Note that the index does not reflect later modifications of the indexed fields.
+        :param table_name: Table name.
+        :param field: Field name or tuple of field names.
+        :return: The index, or None if the field values are not hashable.
+        """
+        # Optional tables like image_annotations are loaded as attributes, but are not listed in table_names.
+        if not hasattr(self, table_name):
+            raise ValueError('Error: Table {} is not loaded.'.format(table_name))
+
+        key = (table_name, field)
+        if key not in self._field_index:
+            index = defaultdict(list)
+            try:
+                if isinstance(field, tuple):
+                    for member in getattr(self, table_name):
+                        index[tuple(member[f] for f in field)].append(member['token'])
+                else:
+                    for member in getattr(self, table_name):
+                        index[member[field]].append(member['token'])
+                self._field_index[key] = dict(index)
+            except TypeError:
+                self._field_index[key] = None
+
+        return self._field_index[key]
+
     def get_sample_data_path(self, sample_data_token: str) -> str:
         """ Returns the path to a sample_data. """
 
@@ -0,0 +1,95 @@
+# nuScenes dev-kit.
+
+"""
+Micro-benchmark comparing linear table scans with the secondary indexes behind NuScenes.field2token, e.g.:
+python nuscenes/scripts/benchmark_field2token.py --dataroot /data/sets/nuscenes --version v1.0-trainval
+"""
+
+import argparse
+import random
+import time
+from typing import Any, Callable, List, Tuple, Union
+
+from nuscenes.nuscenes import NuScenes
+
+
+def linear_field2token(nusc: NuScenes, table_name: str, field: Union[str, Tuple[str, ...]], query) -> List[str]:
+    """
+    Reference implementation of field2token that scans the whole table for every query.
+    :param nusc: A NuScenes instance.
+    :param table_name: Table name.
+    :param field: Field name or tuple of field names.
+    :param query: Query to match against.
+    :return: List of tokens for the matching records.
+    """
+    fields = field if isinstance(field, tuple) else (field,)
+    query = query if isinstance(field, tuple) else (query,)
+    return [member['token'] for member in getattr(nusc, table_name)
+            if tuple(member[f] for f in fields) == query]
+
+
+def time_queries(func: Callable, queries: List[Any]) -> Tuple[float, List[List[str]]]:
+    """
+    Runs a function on each query.
+    :param func: The function to time.
+    :param queries: The queries.
+    :return: The runtime in seconds and the results.
+    """
+    start_time = time.time()
+    results = [func(query) for query in queries]
+    return time.time() - start_time, results
+
+
+def main(dataroot: str, version: str, num_queries: int, seed: int) -> None:
+    """
+    Times the lookups used for split filtering and per-scene iteration with and without secondary indexes.
+    :param dataroot: Path of the nuScenes dataset.
+    :param version: NuScenes version.
+    :param num_queries: Maximum number of queries per index.
+    :param seed: Seed used to sample the queries.
+    """
+    nusc = NuScenes(version=version, dataroot=dataroot, verbose=False)
+    rand = random.Random(seed)
+
+    def sample_queries(values: List[Any]) -> List[Any]:
+        return rand.sample(values, min(num_queries, len(values)))
+
+    benchmarks = [
+        ('sample', 'scene_token', sample_queries([rec['token'] for rec in nusc.scene])),
+        ('sample_annotation', 'instance_token', sample_queries([rec['token'] for rec in nusc.instance])),
+        ('sample_data', ('sample_token', 'channel'),
+         sample_queries([(rec['token'], 'LIDAR_TOP') for rec in nusc.sample])),
+    ]
+
+    print('{:<50} {:>8} {:>12} {:>12} {:>12} {:>9}'.format('index', 'queries', 'linear [s]', 'build [s]',
+                                                           'indexed [s]', 'speedup'))
+    for table_name, field, queries in benchmarks:
+        linear_time, linear_results = time_queries(
+            lambda query: linear_field2token(nusc, table_name, field, query), queries)
+
+        start_time = time.time()
+        nusc.create_field_index(table_name, field)
+        build_time = time.time() - start_time
+
+        indexed_time, indexed_results = time_queries(lambda query: nusc.field2token(table_name, field, query), queries)
+        assert linear_results == indexed_results, 'Error: Indexed results differ for %s.%s!' % (table_name, field)
+
+        print('{:<50} {:>8} {:>12.4f} {:>12.4f} {:>12.6f} {:>8.1f}x'.format(
+            '%s.%s' % (table_name, field), len(queries), linear_time, build_time, indexed_time,
+            linear_time / max(build_time + indexed_time, 1e-9)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark field2token with and without secondary indexes.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', type=str, default='/data/sets/nuscenes',
+                        help='Default nuScenes data directory.')
+    parser.add_argument('--version', type=str, default='v1.0-trainval',
+                        help='Which version of the nuScenes dataset to evaluate on, e.g. v1.0-trainval.')
+    parser.add_argument('--num_queries', type=int, default=200,
+                        help='Maximum number of queries per index.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed used to sample the queries.')
+    args = parser.parse_args()
+
+    main(dataroot=args.dataroot, version=args.version, num_queries=args.num_queries, seed=args.seed)
@@ -2,6 +2,7 @@
 # Code written by Oscar Beijbom, 2019.
 
 import os
+import tempfile
 import unittest
 
 from nuscenes import NuScenes
@@ -21,6 +22,70 @@ class TestNuScenes(unittest.TestCase):
         # Trivial assert statement
         self.assertEqual(nusc.table_root, os.path.join(os.environ['NUSCENES'], 'v1.0-mini'))
 
+    def test_load_lazy(self):
+        """
+        Checks that the lazily loaded tables match the eagerly loaded ones, both when building and when reading the
+        table cache.
+        """
+        assert 'NUSCENES' in os.environ, 'Set NUSCENES env. variable to enable tests.'
+        nusc = NuScenes(version='v1.0-mini', dataroot=os.environ['NUSCENES'], verbose=False)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for _ in range(2):
+                nusc_lazy = NuScenes(version='v1.0-mini', dataroot=os.environ['NUSCENES'], verbose=False, lazy=True,
+                                     cache_dir=cache_dir)
+                self.assertEqual(nusc.table_names, nusc_lazy.table_names)
+                for table_name in nusc.table_names:
+                    records = [{k: v for k, v in rec.items() if k != 'mask'} for rec in getattr(nusc, table_name)]
+                    records_lazy = [{k: v for k, v in rec.items() if k != 'mask'}
+                                    for rec in getattr(nusc_lazy, table_name)]
+                    self.assertEqual(records, records_lazy)
+
+                sample = nusc.sample[0]
+                self.assertEqual(nusc_lazy.get('sample', sample['token']), sample)
+                self.assertEqual(nusc_lazy.getind('sample', sample['token']), 0)
+                self.assertEqual(nusc_lazy.field2token('sample', 'scene_token', sample['scene_token']),
+                                 nusc.field2token('sample', 'scene_token', sample['scene_token']))
+                self.assertEqual(nusc_lazy.map[0]['mask'].img_file, nusc.map[0]['mask'].img_file)
+
+    def test_field2token(self):
+        """
+        Checks that the indexed field2token matches a linear scan of the table.
+        """
+        assert 'NUSCENES' in os.environ, 'Set NUSCENES env. variable to enable tests.'
+        nusc = NuScenes(version='v1.0-mini', dataroot=os.environ['NUSCENES'], verbose=False)
+
+        for scene in nusc.scene:
+            self.assertEqual(nusc.field2token('sample', 'scene_token', scene['token']),
+                             [rec['token'] for rec in nusc.sample if rec['scene_token'] == scene['token']])
+        instance_token = nusc.instance[0]['token']
+        self.assertEqual(nusc.field2token('sample_annotation', 'instance_token', instance_token),
+                         [rec['token'] for rec in nusc.sample_annotation if rec['instance_token'] == instance_token])
+        sample_token = nusc.sample[0]['token']
+        self.assertEqual(nusc.field2token('sample_data', ('sample_token', 'channel'), (sample_token, 'LIDAR_TOP')),
+                         [rec['token'] for rec in nusc.sample_data
+                          if rec['sample_token'] == sample_token and rec['channel'] == 'LIDAR_TOP'])
+        self.assertEqual(nusc.field2token('sample', 'scene_token', 'unknown'), [])
+
+        # Unhashable field values fall back to a linear scan.
+        self.assertIsNone(nusc.create_field_index('sample_annotation', 'attribute_tokens'))
+        self.assertEqual(nusc.field2token('sample_annotation', 'attribute_tokens', []),
+                         [rec['token'] for rec in nusc.sample_annotation if rec['attribute_tokens'] == []])
+
+    def test_field2token_optional_table(self):
+        """
+        Checks that tables loaded outside of table_names, like image_annotations, can be queried.
+        """
+        nusc = NuScenes.__new__(NuScenes)
+        nusc.table_names = ['sample']
+        nusc._field_index = {}
+        nusc.sample = []
+        nusc.image_annotations = [{'token': 'a', 'category_name': 'vehicle.car'},
+                                  {'token': 'b', 'category_name': 'human.pedestrian.adult'}]
+
+        self.assertEqual(nusc.field2token('image_annotations', 'category_name', 'vehicle.car'), ['a'])
+        self.assertRaises(ValueError, nusc.field2token, 'unknown_table', 'token', 'a')
+
 
 if __name__ == '__main__':
     unittest.main()
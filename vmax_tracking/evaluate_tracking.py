@@ -1,24 +1,68 @@
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
 from nuscenes.nuscenes import NuScenes
+from nuscenes.eval.common.loaders import create_splits_scenes
+from nuscenes.eval.tracking.utils import category_to_tracking_name
 import numpy as np
 np.bool = np.bool_
 from pyquaternion import Quaternion
 
 from vmax_tracking.model import AB3DMOT
-import time
-
-def get_gt_detections(sample):
-    annotation_tokens = sample['anns']
-    boxes = []
-
-    for ann_token in annotation_tokens:
-        box = nusc.get_box(ann_token)
-        # [h,w,l,x,y,z,theta]
-        boxes.append([box.wlh[2], box.wlh[0], box.wlh[1], box.center[0], box.center[1], box.center[2], box.orientation.radians])
-
-    return np.array(boxes)
-
 
-def get_sample_result(sample_token, track):
+RESULTS_META = {
+    "use_camera": False,
+    "use_lidar": True,
+    "use_radar": False,
+    "use_map": False,
+    "use_external": False
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Runs AB3DMOT on all scenes of a split and writes nuScenes tracking results.')
+    parser.add_argument('--det_results', type=str, default=None,
+                        help='results_nusc.json of NuScenesDataset.evaluation, the ground-truth boxes are tracked if not set')
+    parser.add_argument('--dataroot', type=str, default='/opt/vmax_dataset/vmax_OpenPCDet/data/nuscenes/v1.0-mini')
+    parser.add_argument('--version', type=str, default='v1.0-mini')
+    parser.add_argument('--split', type=str, default='mini_all')
+    parser.add_argument('--tracking_names', type=str, nargs='+', default=['car'],
+                        help='classes to track; without --det_results the GT annotations are mapped with '
+                             'category_to_tracking_name and only these classes are kept')
+    parser.add_argument('--score_thresh', type=float, default=0.0, help='detections below this score are dropped')
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help='processes tracking the scenes in parallel, the latencies include CPU contention')
+    parser.add_argument('--output', type=str, default=None, help='defaults to prediction_tracks_<split>.json')
+    return parser.parse_args()
+
+
+def get_detections(boxes, name_key, score_key, tracking_names, score_thresh):
+    """
+    Converts nuScenes boxes (result or sample_annotation dicts) of one sample to the AB3DMOT input.
+    Returns dets [[h,w,l,x,y,z,theta]] and info [[0, class index, 0, 0, 0, 0, score]], the layout of AB3DMOT's
+    additional info, so track[9] is the class index and track[-1] the confidence of the tracker output.
+    """
+    boxes = [box for box in boxes if box[name_key] in tracking_names and box[score_key] >= score_thresh]
+    dets = np.zeros((len(boxes), 7))
+    info = np.zeros((len(boxes), 7))
+    if len(boxes) == 0:
+        return dets, info
+
+    size = np.array([box['size'] for box in boxes])  # width, length, height.
+    rotation = np.array([box['rotation'] for box in boxes])  # w, x, y, z.
+    w, x, y, z = rotation.T
+    dets[:, 0:3] = size[:, [2, 0, 1]]
+    dets[:, 3:6] = [box['translation'] for box in boxes]
+    dets[:, 6] = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    info[:, 1] = [tracking_names.index(box[name_key]) for box in boxes]
+    info[:, 6] = [box[score_key] for box in boxes]
+    return dets, info
+
+
+def get_sample_result(sample_token, track, tracking_name):
     q = Quaternion(axis=[0, 0, 1], angle=track[6])
 
     return {
@@ -27,74 +71,127 @@ def get_sample_result(sample_token, track):
         "size": [track[1], track[2], track[0]], # width, length, height.
         "rotation": q.elements.tolist(), # w, x, y, z.
         "velocity": [0.0, 0.0], # Not supported
-        "tracking_id": track[7],
-        "tracking_name": "car",
+        "tracking_id": f"{tracking_name}_{int(track[7])}",
+        "tracking_name": tracking_name,
         "tracking_score": track[-1]
     }
 
-def process_scene(scene, tracker, total_tracks, track_times):
-    print(f"Processing scene: {scene['name']}")
-    first_sample_token = scene['first_sample_token']
-    sample = nusc.get('sample', first_sample_token)
-
-    while sample:
-        total_tracks["results"][sample["token"]] = []
-        detections = get_gt_detections(sample)
-
-        detections = {"dets": detections, "info": np.zeros_like(detections)}
-        # h,w,l,x,y,z,theta, ID, ..., confidence
-        start_time = time.perf_counter()
-        tracks, affi = tracker.track(detections)
-        end_time = time.perf_counter()
-        elapsed_time = end_time - start_time
-        track_times.append(elapsed_time)
-        tracks = tracks[0]# ???
-
-        for track in tracks:
-            total_tracks["results"][sample["token"]].append(get_sample_result(sample["token"], track))
-            
-
-        # Move to the next sample
-        if sample['next']:
-            sample = nusc.get('sample', sample['next'])
-        else:
-            sample = None
-    
-    
 
-if __name__ == "__main__":
-    nusc = NuScenes(version='v1.0-mini', dataroot='/opt/vmax_dataset/vmax_OpenPCDet/data/nuscenes/v1.0-mini', verbose=True)
+def process_scene(scene_name, sample_tokens, frames, tracking_names):
+    """
+    Tracks one scene with an AB3DMOT per class. Scenes are independent, so this runs in the worker processes.
+    :return: scene_name, {sample_token: results}, tracking time of every frame in seconds
+    """
+    trackers = [AB3DMOT() for _ in tracking_names]
+    results = {}
+    frame_times = np.zeros(len(sample_tokens))
 
-    split = "mini_all"
-    from nuscenes.eval.common.loaders import create_splits_scenes
-    splits = create_splits_scenes()
-    splits = splits[split]
-    track_times = []
+    for frame_idx, (sample_token, (dets, info)) in enumerate(zip(sample_tokens, frames)):
+        results[sample_token] = []
+        for class_idx, tracker in enumerate(trackers):
+            mask = info[:, 1] == class_idx
+            detections = {"dets": dets[mask], "info": info[mask]}
+            # h,w,l,x,y,z,theta, ID, ..., confidence
+            start_time = time.perf_counter()
+            tracks, affi = tracker.track(detections)
+            frame_times[frame_idx] += time.perf_counter() - start_time
+
+            for track in tracks[0]:
+                results[sample_token].append(get_sample_result(sample_token, track, tracking_names[class_idx]))
+
+    return scene_name, results, frame_times
+
+
+def _process_scene_job(job):
+    return process_scene(*job)
 
-    total_tracks = {
-            "meta": {
-                "use_camera": False,
-                "use_lidar": True,
-                "use_radar": False,
-                "use_map": False,
-                "use_external": False
-            },
-            "results": {
-            }
-        }
+
+def get_scene_jobs(nusc, scene_names, det_results, tracking_names, score_thresh):
+    """
+    Collects the detections of every scene in sample order, so the workers do not need the NuScenes tables.
+    """
+    samples_by_scene = {}
+    for sample in nusc.sample:
+        samples_by_scene.setdefault(sample['scene_token'], []).append(sample)
+
+    jobs = []
     for scene in nusc.scene:
-        if not scene["name"] in splits:
-           continue
-
-        tracker = AB3DMOT()
-        process_scene(scene, tracker, total_tracks, track_times)
-
-    track_times = np.array(track_times)
-    mean_time = np.mean(track_times)
-    std_time = np.std(track_times)
-    print(f"Mean tracking time: {mean_time * 1000} ms")
-    print(f"Standard deviation of tracking time: {std_time * 1000} ms")
-    
-    import json
-    with open(f"prediction_tracks_{split}.json", 'w') as json_file:
-        json.dump(total_tracks, json_file, indent=4)
+        if scene['name'] not in scene_names:
+            continue
+        samples = sorted(samples_by_scene.get(scene['token'], []), key=lambda sample: sample['timestamp'])
+        frames = []
+        for sample in samples:
+            if det_results is not None:
+                frames.append(get_detections(det_results.get(sample['token'], []), 'detection_name', 'detection_score',
+                                             tracking_names, score_thresh))
+            else:
+                annotations = [nusc.get('sample_annotation', ann_token) for ann_token in sample['anns']]
+                annotations = [dict(ann, tracking_name=category_to_tracking_name(ann['category_name'])
+                                    or ann['category_name'], tracking_score=1.0) for ann in annotations]
+                frames.append(get_detections(annotations, 'tracking_name', 'tracking_score', tracking_names, -np.inf))
+        jobs.append((scene['name'], [sample['token'] for sample in samples], frames, tracking_names))
+    return jobs
+
+
+def get_latency_summary(frame_times, wall_time):
+    frame_times_ms = frame_times * 1000
+    return {
+        "num_frames": len(frame_times),
+        "mean_ms": float(np.mean(frame_times_ms)),
+        "std_ms": float(np.std(frame_times_ms)),
+        "p50_ms": float(np.percentile(frame_times_ms, 50)),
+        "p90_ms": float(np.percentile(frame_times_ms, 90)),
+        "p99_ms": float(np.percentile(frame_times_ms, 99)),
+        "max_ms": float(np.max(frame_times_ms)),
+        "frames_per_second": len(frame_times) / wall_time
+    }
+
+
+def main():
+    args = parse_args()
+    output_path = args.output if args.output is not None else f"prediction_tracks_{args.split}.json"
+    nusc = NuScenes(version=args.version, dataroot=args.dataroot, verbose=True)
+    scene_names = set(create_splits_scenes()[args.split])
+
+    det_results = None
+    if args.det_results is not None:
+        with open(args.det_results, 'r') as f:
+            det_results = json.load(f)['results']
+    jobs = get_scene_jobs(nusc, scene_names, det_results, args.tracking_names, args.score_thresh)
+    del det_results
+    # the latency summary needs at least one frame, so fail before writing an empty result file
+    if sum(len(sample_tokens) for _, sample_tokens, _, _ in jobs) == 0:
+        raise ValueError(f"No samples of split {args.split} were found in {args.version} at {args.dataroot}")
+
+    pool = Pool(args.num_workers) if args.num_workers > 0 else None
+    scene_results = pool.imap_unordered(_process_scene_job, jobs) if pool is not None else map(_process_scene_job, jobs)
+
+    # the results of every scene are written as soon as it is tracked instead of being gathered for one json.dump
+    track_times = []
+    num_written = 0
+    start_time = time.perf_counter()
+    with open(output_path, 'w') as f:
+        f.write('{"results": {')
+        for scene_name, results, frame_times in scene_results:
+            print(f"Processed scene: {scene_name} ({len(frame_times)} frames, {np.mean(frame_times) * 1000:.2f} ms per frame)")
+            for sample_token, sample_results in results.items():
+                f.write('%s%s: %s' % (', ' if num_written > 0 else '', json.dumps(sample_token), json.dumps(sample_results)))
+                num_written += 1
+            track_times.append(frame_times)
+        f.write('}, "meta": %s}' % json.dumps(RESULTS_META))
+    wall_time = time.perf_counter() - start_time
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    latency = get_latency_summary(np.concatenate(track_times), wall_time)
+    print(f"Tracking time per frame: mean {latency['mean_ms']:.3f} ms, std {latency['std_ms']:.3f} ms, "
+          f"p50 {latency['p50_ms']:.3f} ms, p90 {latency['p90_ms']:.3f} ms, p99 {latency['p99_ms']:.3f} ms, "
+          f"max {latency['max_ms']:.3f} ms")
+    print(f"Throughput: {latency['frames_per_second']:.1f} frames/s with {max(args.num_workers, 1)} process(es)")
+    with open(os.path.splitext(output_path)[0] + '_latency.json', 'w') as f:
+        json.dump(latency, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()